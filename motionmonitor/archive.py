@@ -0,0 +1,332 @@
+import json
+import logging
+import os
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from motionmonitor.models import Frame, EventFrame
+
+_LOGGER = logging.getLogger(__name__)
+
+# How the conversion specifiers of motion's filename templates appear in the paths they produce.
+_SPECIFIERS = {
+    "t": ("camera", r"\d+"),
+    "Y": ("year", r"\d{4}"),
+    "m": ("month", r"\d{2}"),
+    "d": ("day", r"\d{2}"),
+    "H": ("hour", r"\d{2}"),
+    "M": ("minute", r"\d{2}"),
+    "S": ("second", r"\d{2}"),
+    "C": ("event", r"[^/]+"),
+    "v": ("event", r"\d+"),
+    "q": ("frame", r"\d+"),
+}
+_SPECIFIER_RE = re.compile(r"%(.)")
+_DATE_SPECIFIERS = "YmdHMS"
+
+
+class FilenameTemplate:
+    """A motion filename template (snapshot_filename or picture_filename), compiled once into a pattern that parses
+    the paths motion creates from it.  Paths are relative to TARGET_DIR and may have any file extension.
+    """
+
+    def __init__(self, template: str):
+        self.template = template
+        self.components = template.split("/")
+
+        # The index of the path component that holds the camera number, all the camera's files are below it.
+        self.camera_depth = next(i for (i, component) in enumerate(self.components) if "%t" in component)
+        # The number of directory levels below the camera's down to the first that names the day, so that each
+        # directory at that depth holds a day's files at most, or None if no directory names the day.
+        self.day_depth = next((i - self.camera_depth for (i, component) in enumerate(self.components[:-1])
+                               if i > self.camera_depth and "%d" in component), None)
+
+        # Only the last occurrence of a specifier is captured; motion's templates repeat the date in the directory
+        # and the filename, and the filename is the more precise of the two.
+        specifiers = _SPECIFIER_RE.findall(template)
+        last_occurrence = {specifier: i for (i, specifier) in enumerate(specifiers)}
+
+        regex = []
+        position = 0
+        for i, match in enumerate(_SPECIFIER_RE.finditer(template)):
+            regex.append(re.escape(template[position:match.start()]))
+            specifier = match.group(1)
+            if specifier == "%":
+                regex.append("%")
+            elif specifier not in _SPECIFIERS:
+                raise ValueError("Unsupported conversion specifier '%{}' in {}".format(specifier, template))
+            else:
+                name, value_regex = _SPECIFIERS[specifier]
+                if last_occurrence[specifier] == i:
+                    regex.append("(?P<{}>{})".format(name, value_regex))
+                else:
+                    regex.append("(?:{})".format(value_regex))
+            position = match.end()
+        regex.append(re.escape(template[position:]))
+        self.pattern = re.compile("".join(regex) + r"(?:\.\w+)?$")
+
+    @property
+    def prefix(self) -> str:
+        """The static directory the template's files are all beneath, relative to TARGET_DIR."""
+        return os.path.join(*self.components[:self.camera_depth]) if self.camera_depth else ""
+
+    def parse(self, path: str, relpath: str):
+        """Given the path of a file and that path relative to TARGET_DIR, returns the Frame or EventFrame it holds.
+        Returns None if the path wasn't created from this template.
+        """
+        match = self.pattern.match(relpath)
+        if not match:
+            return None
+        values = match.groupdict()
+
+        try:
+            timestamp = datetime(int(values.get("year") or 1970), int(values.get("month") or 1),
+                                 int(values.get("day") or 1), int(values.get("hour") or 0),
+                                 int(values.get("minute") or 0), int(values.get("second") or 0))
+        except ValueError:
+            return None
+
+        camera_id = values["camera"]
+        frame_num = int(values.get("frame") or 0)
+        if values.get("event"):
+            return EventFrame(camera_id, values["event"], timestamp, frame_num, path, 0)
+        return Frame(camera_id, timestamp, frame_num, path)
+
+
+def load_checkpoints(path: str) -> dict:
+    """Reads the checkpoints the walks of the archive were left at, or none if the file is missing or unreadable, in
+    which case everything is walked."""
+    try:
+        with open(path) as checkpoint_file:
+            checkpoints = json.load(checkpoint_file)
+        if not isinstance(checkpoints, dict):
+            raise ValueError("Expected an object, not {!r}".format(checkpoints))
+        return checkpoints
+    except (IOError, ValueError) as e:
+        _LOGGER.warning("Unable to read the checkpoints from %s, walking everything: %s", path, e)
+        return {}
+
+
+def save_checkpoints(path: str, checkpoints: dict):
+    checkpoint_dir = os.path.dirname(path)
+    if checkpoint_dir and not os.path.exists(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+
+    # Write to a temporary file first so a failed write can't lose the previous checkpoints.
+    temp_file = path + ".tmp"
+    with open(temp_file, "w") as checkpoint_file:
+        json.dump(checkpoints, checkpoint_file)
+    os.replace(temp_file, path)
+
+
+class _Subtree:
+    """A unit of the walk, queued behind its batches once it has been walked."""
+
+    def __init__(self, path: str, relpath: str, camera: str, date_parts: list):
+        self.path = path
+        self.relpath = relpath
+        self.camera = camera
+        self.date_parts = date_parts
+        # The newest date directory found within it, at date_depth
+        self.newest = None
+        # Whether it was walked without error
+        self.complete = False
+
+
+class ArchiveWalker:
+    """Walks the files created from a FilenameTemplate beneath TARGET_DIR, fanning the camera and date subtrees out
+    across a pool of threads.  Each path is parsed once, and the frames are yielded in batches as they are found.
+
+    The first date_depth directories below each camera are expected to be named after the date, in a way that sorts
+    (YYYY/MM/DD/HH, YYYYMMDD and so on).  Unless full is set, date directories older than the camera's checkpoint are
+    not descended into.  Once the walk ends, the checkpoints are updated in place with the newest date directory found
+    in the subtrees of each camera that were walked completely, but never past the oldest subtree that failed or was
+    left unfinished, so that it's walked again next time.
+
+    The subtrees walked in parallel are each camera's day directories, or its deepest date directories if they don't
+    name the day, so that a year of snapshots in YYYY/MM/DD/HH is still spread across the threads.  Subtrees, or any of
+    the date directories above them, whose paths relative to TARGET_DIR are in skip aren't walked at all, and on_done is
+    called with the relative path of each subtree that was walked without error, from the consumer's thread once every
+    batch of the subtree has been yielded to it.
+
+    With remove_empty_dirs, empty directories are removed, along with any of their parents left empty, down to the
+    template's prefix.
+    """
+
+    def __init__(self, target_dir: str, template: FilenameTemplate, date_depth: int, checkpoints: dict = None,
+                 full=True, workers=8, batch_size=500, remove_empty_dirs=False, skip=(), on_done=None):
+        self.target_dir = target_dir
+        self.template = template
+        self.date_depth = date_depth
+        # The depth of the date directories that are each a unit of work
+        self.split_depth = date_depth if template.day_depth is None else min(date_depth, template.day_depth)
+        self.checkpoints = checkpoints if checkpoints is not None else {}
+        self.full = full
+        self.workers = workers
+        self.batch_size = batch_size
+        self.remove_empty_dirs = remove_empty_dirs
+        self.skip = skip
+        self.on_done = on_done
+
+        self.__batches = queue.Queue(maxsize=workers * 2)
+        self.__stopped = threading.Event()
+
+    def __wanted(self, camera, date_key):
+        if self.full:
+            return True
+        checkpoint = self.checkpoints.get(camera, "")
+        return date_key >= checkpoint[:len(date_key)]
+
+    def __update_checkpoints(self, subtrees, finished):
+        """Advances the checkpoint of each camera to the newest date directory of its finished subtrees, but no further
+        than the oldest of those that weren't."""
+        checkpoints = {}
+        unfinished = {}
+        for subtree in subtrees:
+            camera = subtree.camera
+            checkpoints.setdefault(camera, self.checkpoints.get(camera, ""))
+            if subtree in finished:
+                checkpoints[camera] = max(checkpoints[camera], subtree.newest or "")
+            else:
+                date_key = "".join(subtree.date_parts)
+                unfinished[camera] = min(unfinished.get(camera, date_key), date_key)
+
+        for camera, checkpoint in checkpoints.items():
+            if camera in unfinished:
+                checkpoint = min(checkpoint, unfinished[camera])
+            if checkpoint:
+                self.checkpoints[camera] = checkpoint
+
+    def __put(self, item):
+        # Give up if the consumer has stopped iterating, rather than blocking forever.
+        while not self.__stopped.is_set():
+            try:
+                self.__batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def __scan(self, path, subtree, date_parts, batch):
+        if self.__stopped.is_set():
+            return
+
+        with os.scandir(path) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+
+        if not entries and self.remove_empty_dirs:
+            self.__remove_empty(path)
+            return
+
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                child_parts = date_parts
+                if len(date_parts) < self.date_depth:
+                    child_parts = date_parts + [entry.name]
+                    date_key = "".join(child_parts)
+                    if not self.__wanted(subtree.camera, date_key):
+                        continue
+                    if len(child_parts) == self.date_depth:
+                        subtree.newest = max(subtree.newest or "", date_key)
+                self.__scan(entry.path, subtree, child_parts, batch)
+            else:
+                frame = self.template.parse(entry.path, os.path.relpath(entry.path, self.target_dir))
+                if frame is None:
+                    _LOGGER.debug("Ignoring %s, it doesn't match %s", entry.path, self.template.template)
+                    continue
+                batch.append(frame)
+                if len(batch) >= self.batch_size:
+                    self.__put(list(batch))
+                    batch.clear()
+
+    def __remove_empty(self, path):
+        """Removes the empty directory, then each of its parents that is left empty, as far as the template's prefix."""
+        base_dir = os.path.normpath(os.path.join(self.target_dir, self.template.prefix))
+        while os.path.normpath(path) != base_dir:
+            try:
+                os.rmdir(path)
+            except OSError as e:
+                # Not empty, most likely, or removed by another thread
+                _LOGGER.debug("Unable to remove empty directory %s: %s", path, e)
+                return
+            path = os.path.dirname(path)
+
+    def __walk_subtree(self, subtree):
+        batch = []
+        if len(subtree.date_parts) == self.date_depth:
+            subtree.newest = "".join(subtree.date_parts)
+        try:
+            self.__scan(subtree.path, subtree, subtree.date_parts, batch)
+            if batch:
+                self.__put(batch)
+            subtree.complete = True
+        except OSError as e:
+            _LOGGER.exception("Error walking %s: %s", subtree.path, e)
+        finally:
+            # Tell the consumer this subtree is done, and whether it was walked completely.
+            self.__put(subtree)
+
+    def __subtrees(self):
+        """Lists the units of work, a _Subtree for each camera's date directories at split_depth."""
+        base_dir = os.path.join(self.target_dir, self.template.prefix)
+        if not os.path.isdir(base_dir):
+            _LOGGER.warning("No directory to walk at %s", base_dir)
+            return
+
+        with os.scandir(base_dir) as cameras:
+            camera_dirs = sorted((entry.name, entry.path) for entry in cameras if entry.is_dir())
+
+        for camera, camera_path in camera_dirs:
+            yield from self.__date_subtrees(camera_path, camera, [])
+
+    def __date_subtrees(self, path, camera, date_parts):
+        if os.path.relpath(path, self.target_dir) in self.skip:
+            return
+        if len(date_parts) == self.split_depth:
+            yield _Subtree(path, os.path.relpath(path, self.target_dir), camera, date_parts)
+            return
+
+        with os.scandir(path) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+        if not entries and date_parts and self.remove_empty_dirs:
+            self.__remove_empty(path)
+            return
+
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            child_parts = date_parts + [entry.name]
+            date_key = "".join(child_parts)
+            if not self.__wanted(camera, date_key):
+                continue
+            yield from self.__date_subtrees(entry.path, camera, child_parts)
+
+    def walk(self):
+        """A generator of lists of the Frame and EventFrame objects that were found."""
+        self.__stopped.clear()
+        subtrees = []
+        finished = set()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ArchiveWalker") as executor:
+                try:
+                    for subtree in self.__subtrees():
+                        executor.submit(self.__walk_subtree, subtree)
+                        subtrees.append(subtree)
+
+                    pending = len(subtrees)
+                    while pending:
+                        batch = self.__batches.get()
+                        if isinstance(batch, _Subtree):
+                            pending -= 1
+                            if batch.complete:
+                                finished.add(batch)
+                                if self.on_done is not None:
+                                    self.on_done(batch.relpath)
+                            continue
+                        yield batch
+                finally:
+                    self.__stopped.set()
+        finally:
+            self.__update_checkpoints(subtrees, finished)
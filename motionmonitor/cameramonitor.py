@@ -5,6 +5,7 @@ Created on 11/08/2013
 '''
 import logging
 
+from motionmonitor import metrics
 from motionmonitor.models import Camera, Event
 from motionmonitor.const import (
     EVENT_MOTION_EVENT_START,
@@ -28,10 +29,14 @@ class CameraMonitor():
         self.__logger.info("Initialised")
 
     def handle_motion_start(self, event):
-        pass
-        # self.__state = self.STATE_ACTIVITY
-        # self.__recent_motion.appendleft(new_event)
-        # self.__logger.debug("Last motion: %s" % self.__recent_motion)
+        new_event = event.data
+        if new_event.camera_id not in self.mm.cameras:
+            self.__create_camera(new_event.camera_id)
+
+        # The event's frames are appended to it as they arrive, see handle_motion_frame.
+        recent_motion = self.mm.cameras[new_event.camera_id].recent_motion
+        if new_event.id not in recent_motion:
+            recent_motion[new_event.id] = new_event
 
     def handle_motion_end(self, event):
         pass
@@ -43,6 +48,7 @@ class CameraMonitor():
             self.__create_camera(frame.camera_id)
 
         self.mm.cameras[frame.camera_id].append_snapshot_frame(frame)
+        metrics.FRAMES.labels(frame.camera_id, "snapshot").inc()
 
     def handle_motion_frame(self, event):
         motion_frame = event.data
@@ -51,14 +57,15 @@ class CameraMonitor():
 
         if len(self.mm.cameras[motion_frame.camera_id].recent_motion) == 0 or \
                 next(reversed(self.mm.cameras[motion_frame.camera_id].recent_motion.values())).id != motion_frame.event_id:
-            self.__logger.warning(
-                "Must have missed the start event '{}', forcing creation".format(motion_frame.event_id))
+            self.__logger.warning("Must have missed the start event '%s', forcing creation", motion_frame.event_id)
+            self.mm.sequences.missed_event_start(motion_frame.camera_id)
             new_event = Event(motion_frame.event_id, motion_frame.camera_id, motion_frame.timestamp)
-            self.__logger.info("Created new event: {}".format(new_event))
+            self.__logger.info("Created new event: %s", new_event)
             self.mm.cameras[motion_frame.camera_id].recent_motion[new_event.id] = new_event
 
         next(reversed(self.mm.cameras[motion_frame.camera_id].recent_motion.values())).append_frame(motion_frame)
+        metrics.FRAMES.labels(motion_frame.camera_id, "motion").inc()
 
     def __create_camera(self, camera_id):
-        self.__logger.info("Creating a new camera: {}".format(camera_id))
+        self.__logger.info("Creating a new camera: %s", camera_id)
         self.mm.cameras[camera_id] = Camera(camera_id)
@@ -0,0 +1,245 @@
+"""Cluster mode, where the cameras are partitioned across a number of MotionMonitor shard processes.
+
+With [CLUSTER] SHARDS set, the launcher runs a ClusterFront rather than a MotionMonitor.  The front spawns a shard
+process for each partition, each being a complete MotionMonitor (CameraMonitor, Recorder, API and so on) that only
+ever hears about its own cameras.  The front then:
+
+- receives motion's UDP datagrams on [SOCKET_SERVER] ADDRESS/PORT and forwards each, untouched, to the socket server
+  of the shard that owns its camera.  Messages without a camera, such as audits and sweeps, go to the first shard.
+- serves the API on [API] PORT, proxying /cameras/{camera_id}/... to the camera's shard, merging the listings of
+  /cameras and /sequences from every shard and proxying everything else to the first shard.
+
+Shard n listens for datagrams on SHARD_BASE_PORT + 2n and serves its API on SHARD_BASE_PORT + 2n + 1, both on the
+loopback interface.  A "{shard}" in [RECORDER] URL is replaced by the shard number, giving each shard its own
+database.  The extensions that would see every camera, or bind the same port in each shard, are turned off: the web
+server and the file watcher in every shard, and the file manager in all but the first, which audits and sweeps the
+whole of TARGET_DIR.  The Zabbix writer stays on, as each shard only reports the activity of its own cameras.
+
+A shard that's down leaves its cameras out of the merged listings, and its requests are answered with a 503.
+"""
+import asyncio
+import configparser
+import logging
+import multiprocessing
+import signal
+import zlib
+
+import aiohttp
+from aiohttp import web
+
+from motionmonitor import codec
+
+_LOGGER = logging.getLogger(__name__)
+
+SHARD_ADDRESS = "127.0.0.1"
+
+
+def shard_for(camera_id, shards: int) -> int:
+    """The shard that owns a camera.  A stable hash, so that a camera's shard is the same across restarts."""
+    return zlib.crc32(str(camera_id).encode()) % shards
+
+
+def shard_ports(config, shard: int) -> (int, int):
+    """The (socket server, API) ports of a shard."""
+    base_port = int(config["CLUSTER"]["SHARD_BASE_PORT"]) + 2 * shard
+    return base_port, base_port + 1
+
+
+def shard_config(config, shard: int) -> configparser.RawConfigParser:
+    """Returns a copy of the config for the given shard."""
+    shard_conf = configparser.RawConfigParser()
+    shard_conf.read_dict({section: dict(config[section]) for section in config.sections()})
+    socket_port, api_port = shard_ports(config, shard)
+
+    shard_conf.read_dict({"SOCKET_SERVER": {"TRANSPORT": "udp", "ADDRESS": SHARD_ADDRESS, "PORT": str(socket_port),
+                                            "WORKERS": "0"},
+                          "API": {"ADDRESS": SHARD_ADDRESS, "PORT": str(api_port)},
+                          "CLUSTER": {"SHARDS": "0", "SHARD": str(shard)}})
+
+    if shard_conf.has_option("RECORDER", "URL"):
+        shard_conf["RECORDER"]["URL"] = shard_conf["RECORDER"]["URL"].replace("{shard}", str(shard))
+
+    # The file watcher would see every camera's files, but a shard must only hear about its own cameras.
+    _disable(shard_conf, "FILE_WATCHER", "file watcher", shard, warn=True)
+    # Every shard's web server would bind the same port.
+    _disable(shard_conf, "WEB_SERVER", "web server", shard, warn=True)
+    # The audits and sweeps are routed to the first shard, the others would each walk the whole of TARGET_DIR again.
+    if shard > 0:
+        _disable(shard_conf, "FILE_MANAGER", "file manager", shard)
+
+    return shard_conf
+
+
+def _disable(config, section: str, name: str, shard: int, warn=False):
+    if not config.has_section(section):
+        config.add_section(section)
+    if warn and config[section].get("ENABLED", "true").lower() == "true":
+        _LOGGER.warning("The %s isn't supported in cluster mode, disabling it for shard %d", name, shard)
+    config[section]["ENABLED"] = "false"
+
+
+def run_shard(sections: dict, shard: int, log_level: int):
+    """The main function of a shard process, given the sections of its config."""
+    import motionmonitor.core
+
+    config = configparser.RawConfigParser()
+    config.read_dict(sections)
+
+    logging.basicConfig(level=log_level, format='%(asctime)s - %(name)s - shard {} - %(levelname)s - '
+                                                '%(message)s'.format(shard))
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    mm = motionmonitor.core.MotionMonitor(config, loop)
+    loop.run_until_complete(mm.run())
+    # Terminated by the ClusterFront as it closes
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    loop.run_forever()
+    loop.run_until_complete(mm.close())
+    loop.close()
+
+
+class ClusterRouter(asyncio.DatagramProtocol):
+    """Forwards each of motion's datagrams to the socket server of the shard that owns its camera."""
+
+    def __init__(self, shard_addresses: [(str, int)]):
+        self.__logger = logging.getLogger("%s.%s" % (self.__class__.__module__, self.__class__.__name__))
+        self.shard_addresses = shard_addresses
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            camera_id = codec.loads(data).get("camera")
+        except (ValueError, AttributeError) as e:
+            self.__logger.error("Dropping an invalid datagram from %s: %s", addr, e)
+            return
+
+        shard = shard_for(camera_id, len(self.shard_addresses)) if camera_id is not None else 0
+        self.transport.sendto(data, self.shard_addresses[shard])
+
+
+class ClusterAPI:
+    """The front of the shards' APIs."""
+
+    # The headers that describe a connection rather than the response, so are not copied from a shard's response.
+    HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "content-length", "content-encoding"}
+
+    def __init__(self, shard_urls: [str], timeout=30.0):
+        self.__logger = logging.getLogger("%s.%s" % (self.__class__.__module__, self.__class__.__name__))
+        self.shard_urls = shard_urls
+        # A shard that has hung is given up on, rather than holding the request forever.
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.session = None
+
+        self.app = web.Application()
+        self.app.on_startup.append(self.__open_session)
+        self.app.on_cleanup.append(self.__close_session)
+        self.app.router.add_route("GET", "/cameras", self.merge_listing)
+        self.app.router.add_route("GET", "/sequences", self.merge_listing)
+        self.app.router.add_route("*", "/cameras/{camera_id}", self.proxy_to_camera_shard)
+        self.app.router.add_route("*", "/cameras/{camera_id}/{tail:.*}", self.proxy_to_camera_shard)
+        self.app.router.add_route("*", "/{tail:.*}", self.proxy_to_first_shard)
+
+    async def __open_session(self, app):
+        self.session = aiohttp.ClientSession()
+
+    async def __close_session(self, app):
+        await self.session.close()
+
+    async def merge_listing(self, request):
+        """Merges the entities listed by every shard that answers."""
+        responses = await asyncio.gather(*[self.__get_json(url + request.rel_url.path_qs) for url in self.shard_urls],
+                                         return_exceptions=True)
+        merged = None
+        for (shard, response) in enumerate(responses):
+            if isinstance(response, Exception):
+                self.__logger.warning("Leaving shard %d out of %s: %r", shard, request.rel_url.path, response)
+                continue
+            if merged is None:
+                merged = response
+            else:
+                merged["entities"].extend(response["entities"])
+        if merged is None:
+            raise web.HTTPServiceUnavailable(text="No shard is available")
+        return codec.json_response(merged)
+
+    async def __get_json(self, url):
+        async with self.session.get(url, timeout=self.timeout) as response:
+            response.raise_for_status()
+            return await response.json(loads=codec.loads)
+
+    async def proxy_to_camera_shard(self, request):
+        shard = shard_for(request.match_info["camera_id"], len(self.shard_urls))
+        return await self.__proxy(request, self.shard_urls[shard])
+
+    async def proxy_to_first_shard(self, request):
+        return await self.__proxy(request, self.shard_urls[0])
+
+    async def __proxy(self, request, shard_url):
+        body = await request.read()
+        try:
+            async with self.session.request(request.method, shard_url + request.rel_url.path_qs, data=body or None,
+                                            headers={"Accept": request.headers.get("Accept", "*/*")},
+                                            timeout=self.timeout) as response:
+                headers = {name: value for (name, value) in response.headers.items()
+                           if name.lower() not in self.HOP_BY_HOP_HEADERS}
+                return web.Response(status=response.status, body=await response.read(), headers=headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.__logger.warning("The shard at %s is unavailable: %r", shard_url, e)
+            raise web.HTTPServiceUnavailable(text="The camera's shard is unavailable") from None
+
+
+class ClusterFront:
+    """Runs in place of a MotionMonitor in cluster mode, starting the shards and routing to them."""
+
+    def __init__(self, config, loop):
+        self.__logger = logging.getLogger("%s.%s" % (self.__class__.__module__, self.__class__.__name__))
+
+        self.config = config
+        self.loop = loop
+        codec.select(config["GENERAL"].get("JSON_CODEC") or None)
+        self.shards = int(config["CLUSTER"]["SHARDS"])
+        self.processes = []
+        self.transport = None
+        self.runner = None
+
+    async def run(self):
+        log_level = logging.getLogger().getEffectiveLevel()
+        context = multiprocessing.get_context("spawn")
+        for shard in range(self.shards):
+            config = shard_config(self.config, shard)
+            sections = {section: dict(config[section]) for section in config.sections()}
+            process = context.Process(target=run_shard, args=(sections, shard, log_level),
+                                      name="Shard-{}".format(shard), daemon=True)
+            process.start()
+            self.processes.append(process)
+
+        ports = [shard_ports(self.config, shard) for shard in range(self.shards)]
+
+        if self.config["SOCKET_SERVER"].get("TRANSPORT", "udp") != "udp":
+            self.__logger.warning("Only the udp transport is supported in cluster mode, listening for datagrams")
+        address = self.config["SOCKET_SERVER"]["ADDRESS"]
+        port = int(self.config["SOCKET_SERVER"]["PORT"])
+        router = ClusterRouter([(SHARD_ADDRESS, socket_port) for (socket_port, api_port) in ports])
+        self.transport, p1 = await self.loop.create_datagram_endpoint(lambda: router, local_addr=(address, port))
+
+        api = ClusterAPI(["http://{}:{}".format(SHARD_ADDRESS, api_port) for (socket_port, api_port) in ports])
+        self.runner = web.AppRunner(api.app)
+        await self.runner.setup()
+        api_port = int(self.config["API"]["PORT"])
+        await web.TCPSite(self.runner, 'localhost', api_port).start()
+
+        self.__logger.info("Routing to %d shards, datagrams on %s:%d and the API on port %d", self.shards, address,
+                           port, api_port)
+
+    async def close(self):
+        if self.transport:
+            self.transport.close()
+        if self.runner:
+            await self.runner.cleanup()
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
@@ -0,0 +1,87 @@
+"""The JSON codec used to decode motion's messages and to encode the API's responses.
+
+orjson is used when it is installed, otherwise ujson, otherwise the standard library's json; the choice is made once,
+on import, and can be changed with select().  Call the functions through the module, codec.loads() rather than a
+loads imported from it, so that a selection applies everywhere.
+
+    codec.loads(data)   Decodes the JSON in the given bytes or str.  Raises a ValueError if it isn't valid JSON, or
+                        isn't UTF-8.
+    codec.dumps(obj)    Encodes the object as UTF-8 JSON bytes.
+"""
+import json
+import logging
+
+from aiohttp import web
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _json_codec():
+    def dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+
+    return json.loads, dumps
+
+
+def _ujson_codec():
+    import ujson
+
+    def dumps(obj) -> bytes:
+        # ujson escapes "/" by default, which every href would be full of.
+        return ujson.dumps(obj, escape_forward_slashes=False, ensure_ascii=False).encode()
+
+    return ujson.loads, dumps
+
+
+def _orjson_codec():
+    import orjson
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+    return orjson.loads, dumps
+
+
+# The codecs, in order of preference.
+CODECS = {"orjson": _orjson_codec, "ujson": _ujson_codec, "json": _json_codec}
+
+NAME = None
+loads = None
+dumps = None
+
+
+def available() -> [str]:
+    """The names of the codecs that can be used here, in order of preference."""
+    names = []
+    for name, factory in CODECS.items():
+        try:
+            factory()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def select(name=None):
+    """Uses the named codec, or the most preferred of those installed.  Raises ImportError if the named codec isn't
+    installed.
+    """
+    # The functions are bound directly, rather than wrapped, as they are called for every datagram.
+    global NAME, loads, dumps
+    for candidate in [name] if name else CODECS:
+        try:
+            loads, dumps = CODECS[candidate]()
+        except ImportError:
+            if name:
+                raise
+            continue
+        NAME = candidate
+        _LOGGER.debug("Using the %s codec", NAME)
+        return
+
+
+def json_response(obj, status=200) -> web.Response:
+    return web.Response(body=dumps(obj), status=status, content_type='application/json', charset='utf-8')
+
+
+select()
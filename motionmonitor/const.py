@@ -12,4 +12,18 @@ EVENT_MOTION_EVENT_END = "event:motion_event_end"
 
 MAX_JOBQ_SIZE = 10
 
+# Retention tiers for snapshot frames.  The tier is worked out when a frame is inserted so that finding the stale
+# frames is a range scan over (archive, timestamp) rather than a scan of every row's hour and minute.
+KEEP_TIER_7_DAYS = 0
+KEEP_TIER_4_WEEKS = 1
+KEEP_TIER_3_MONTHS = 2
+KEEP_TIER_FOREVER = 3
+
+# Timelapse granularities.  A snapshot frame is indexed at every granularity up to and including its retention tier, so
+# it never drops out of a timelapse before the frame itself is swept.
+TIMELAPSE_MINUTELY = KEEP_TIER_7_DAYS
+TIMELAPSE_HOURLY = KEEP_TIER_4_WEEKS
+TIMELAPSE_SIX_HOURLY = KEEP_TIER_3_MONTHS
+TIMELAPSE_DAILY = KEEP_TIER_FOREVER
+
 KEY_MM = "key:motion-monitor"
\ No newline at end of file
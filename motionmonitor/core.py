@@ -1,11 +1,13 @@
 import logging
 import os
 import time
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from importlib import util
 
 import motionmonitor.cameramonitor
 import motionmonitor.config
+from motionmonitor import codec, metrics
+from motionmonitor.sequence import SequenceTracker
 # import extensions.mysql_db_server.__init__
 from motionmonitor.const import (
     MATCH_ALL, EVENT_JOB, MAX_JOBQ_SIZE
@@ -19,11 +21,16 @@ class MotionMonitor(object):
 
         self.config = config
         self.loop = loop
-        self.bus = EventBus(self)
+        codec.select(config["GENERAL"].get("JSON_CODEC") or None)
+        self.bus = EventBus(self,
+                            slow_listener_budget=float(config["BUS"]["SLOW_LISTENER_MS"]) / 1000,
+                            slow_listener_warning_interval=float(config["BUS"]["SLOW_LISTENER_WARNING_INTERVAL"]),
+                            listener_window=int(config["BUS"]["LISTENER_WINDOW"]))
         self.jobs = OrderedDict()
 
         self.bus.listen(EVENT_JOB, self.job_handler)
         self.cameras = {}
+        self.sequences = SequenceTracker()
 
         self.__camera_monitor = motionmonitor.cameramonitor.CameraMonitor(self)
 
@@ -37,8 +44,19 @@ class MotionMonitor(object):
             await extension.start_extension()
             self.__logger.debug("Started: {}".format(extension))
 
+    async def close(self):
+        """Closes the extensions that have a close(), in the reverse of the order they were started in."""
+        for extension in reversed(self.extensions):
+            if not hasattr(extension, "close"):
+                continue
+            self.__logger.debug("About to close: {}".format(extension))
+            try:
+                extension.close()
+            except Exception:
+                self.__logger.exception("Unable to close {}".format(extension))
+
     def job_handler(self, event):
-        self.__logger.debug("Handling a job event: {}".format(event))
+        self.__logger.debug("Handling a job event: %s", event)
         job = event.data
         self.jobs[job.id] = job
         while (len(self.jobs) > MAX_JOBQ_SIZE):
@@ -143,22 +161,83 @@ class Event(object):
                 self.time_fired == other.time_fired)
 
 
+def listener_name(func) -> str:
+    """A readable name for a listener, such as motionmonitor.cameramonitor.CameraMonitor.handle_snapshot_frame."""
+    qualname = getattr(func, "__qualname__", None)
+    if qualname is None:
+        return repr(func)
+    return "{}.{}".format(getattr(func, "__module__", None), qualname)
+
+
+class ListenerStats:
+    """The timings of one listener handling one type of event, over a rolling window of its most recent calls."""
+
+    def __init__(self, event_type, func, window):
+        self.event_type = event_type
+        self.listener = listener_name(func)
+        self.durations = deque(maxlen=window)
+        self.calls = 0
+        self.slow_calls = 0
+        self.metric = metrics.LISTENER_SECONDS.labels(event_type, self.listener)
+
+        # Slow calls are only warned about once per interval, the rest are counted until the next warning.
+        self.last_warning = None
+        self.suppressed_warnings = 0
+
+    def record(self, duration):
+        self.calls += 1
+        self.durations.append(duration)
+        self.metric.observe(duration)
+
+    def to_json(self):
+        durations = sorted(self.durations)
+        json_str = {"eventType": self.event_type,
+                    "listener": self.listener,
+                    "calls": self.calls,
+                    "slowCalls": self.slow_calls,
+                    "window": len(durations)}
+        if durations:
+            json_str.update({"meanMs": 1000 * sum(durations) / len(durations),
+                             "p50Ms": 1000 * durations[int(0.5 * (len(durations) - 1))],
+                             "p99Ms": 1000 * durations[int(0.99 * (len(durations) - 1))],
+                             "maxMs": 1000 * durations[-1]})
+        return json_str
+
+
 class EventBus(object):
     """Allow the firing of and listening for events."""
 
-    def __init__(self, mm):
-        """Initialize a new event bus."""
+    def __init__(self, mm, slow_listener_budget=0.1, slow_listener_warning_interval=60, listener_window=1000):
+        """Initialize a new event bus.  A listener taking longer than slow_listener_budget seconds to handle an
+        event is warned about, at most once every slow_listener_warning_interval seconds.
+        """
         self.__logger = logging.getLogger("%s.%s" % (self.__class__.__module__, self.__class__.__name__))
 
         self._listeners = {}
         self._mm = mm
 
+        self.slow_listener_budget = slow_listener_budget
+        self.slow_listener_warning_interval = slow_listener_warning_interval
+        self.listener_window = listener_window
+
+        # The ListenerStats of each (event_type, listener), created on the first fire rather than every time.
+        self._listener_stats = {}
+
     @property
     def listeners(self):
         """Return dictionary with events and the number of listeners."""
         return {key: len(self._listeners[key])
                 for key in self._listeners}
 
+    def has_listeners(self, event_type) -> bool:
+        """Whether anything listens for the given type of event, not counting the listeners for every event."""
+        return bool(self._listeners.get(event_type))
+
+    @property
+    def listener_stats(self):
+        """Return the ListenerStats of every listener that has handled an event."""
+        return list(self._listener_stats.values())
+
     def fire(self, event_type, event_data=None):
         """Fire an event."""
         listeners = self._listeners.get(event_type, [])
@@ -169,13 +248,44 @@ class EventBus(object):
 
         event = Event(event_type, event_data)
 
-        self.__logger.debug("Handling {} with {}".format(event, listeners))
+        if self.__logger.isEnabledFor(logging.DEBUG):
+            self.__logger.debug("Handling %s with %s", event, listeners)
+
+        metrics.EVENTS_FIRED.labels(event_type).inc()
 
         if not listeners:
             return
 
         for func in listeners:
-            func(event)
+            start = time.perf_counter()
+            try:
+                func(event)
+            finally:
+                duration = time.perf_counter() - start
+                stats = self._stats(event_type, func)
+                stats.record(duration)
+                if duration > self.slow_listener_budget:
+                    self._slow_listener(stats, duration)
+
+    def _stats(self, event_type, func):
+        key = (event_type, func)
+        stats = self._listener_stats.get(key)
+        if stats is None:
+            stats = self._listener_stats[key] = ListenerStats(event_type, func, self.listener_window)
+        return stats
+
+    def _slow_listener(self, stats, duration):
+        stats.slow_calls += 1
+        now = time.monotonic()
+        if stats.last_warning is not None and now - stats.last_warning < self.slow_listener_warning_interval:
+            stats.suppressed_warnings += 1
+            return
+
+        self.__logger.warning("%s took %.1fms to handle %s, over the budget of %.1fms (%d more slow calls since "
+                              "the last warning)", stats.listener, 1000 * duration, stats.event_type,
+                              1000 * self.slow_listener_budget, stats.suppressed_warnings)
+        stats.last_warning = now
+        stats.suppressed_warnings = 0
 
     def listen(self, event_type, listener):
         """Listen for all events or events of a specific type.
@@ -192,6 +302,7 @@ class EventBus(object):
             """Remove the listener."""
             try:
                 self._listeners[event_type].remove(listener)
+                self._listener_stats.pop((event_type, listener), None)
 
                 # delete event_type list if empty
                 if not self._listeners[event_type]:
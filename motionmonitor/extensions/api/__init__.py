@@ -1,5 +1,4 @@
 import base64
-import json
 import logging
 from collections import deque
 from datetime import datetime
@@ -7,13 +6,20 @@ from datetime import datetime
 from aiohttp import web, MultipartWriter
 from aiohttp.web_exceptions import HTTPBadRequest, HTTPNotImplemented
 
+from motionmonitor import codec, metrics, validation
 from motionmonitor.const import KEY_MM
+from motionmonitor.extensions.api.schema import IMAGE_QUERY_SCHEMA, VIDEO_QUERY_SCHEMA
 from motionmonitor.extensions.api.siren import Entity, EmbeddedRepresentationSubEntity
 from motionmonitor.models import Frame, EventFrame
 from motionmonitor.utils import convert_frames, animate_frames, stringify_dict, lower_camel_casify_dict_keys
 
 _LOGGER = logging.getLogger(__name__)
 
+_SNAPSHOT_LOOKUP_HITS = metrics.CACHE_LOOKUPS.labels("recent_snapshots", "hit")
+_SNAPSHOT_LOOKUP_MISSES = metrics.CACHE_LOOKUPS.labels("recent_snapshots", "miss")
+_EVENT_FRAME_LOOKUP_HITS = metrics.CACHE_LOOKUPS.labels("recent_motion", "hit")
+_EVENT_FRAME_LOOKUP_MISSES = metrics.CACHE_LOOKUPS.labels("recent_motion", "miss")
+
 
 def get_extension(mm):
     return [API(mm), APItoHTML(mm)]
@@ -57,6 +63,9 @@ class API:
         self.register_view(APICameraEventTimelapseView)
         self.register_view(APIJobsView)
         self.register_view(APIJobEntityView)
+        self.register_view(APIMetricsView)
+        self.register_view(APIBusView)
+        self.register_view(APISequencesView)
 
         # Prevent the router from getting frozen so that extensions are able to add new routes, even after
         # the server has started.  Inspired by Home-Assistant code (https://github.com/home-assistant).
@@ -103,6 +112,8 @@ class BaseAPIView:
     name = None
     description = None
     extra_urls = []
+    # The JSON schema that the view's query parameters must match, if any.
+    query_schema = None
 
     def register(self, router):
         """Register the view with a router."""
@@ -117,6 +128,15 @@ class BaseAPIView:
 
             router.add_route(method, self.url, handler, name=self.name)
 
+    def _validate_query(self, request):
+        """Raises HTTPBadRequest if the request's query parameters don't match the view's query_schema."""
+        if self.query_schema is None or not request.query:
+            return
+        error = validation.compile_schema(self.query_schema).error(dict(request.query))
+        if error is not None:
+            _LOGGER.error("Invalid query parameters: %s", error)
+            raise HTTPBadRequest(text=error)
+
     @classmethod
     def to_entity_repr(cls, request, classes=[], rel=["self"], path_params={}, query_params={}):
         return {
@@ -144,15 +164,17 @@ class BaseAPIView:
 
 
 class APIImageView(BaseAPIView):
+    query_schema = IMAGE_QUERY_SCHEMA
+
     def _get_scale_param(self, request):
         scale = None
         if "scale" in request.query:
             scale = request.query["scale"]
-            _LOGGER.debug("Need to scale: {}".format(scale))
+            _LOGGER.debug("Need to scale: %s", scale)
             try:
                 scale = float(scale)
             except ValueError:
-                _LOGGER.error("Scale is not a float: {}".format(scale))
+                _LOGGER.error("Scale is not a float: %s", scale)
                 raise HTTPBadRequest()
         return scale
 
@@ -160,11 +182,12 @@ class APIImageView(BaseAPIView):
         img_format = default
         if "format" in request.query:
             img_format = request.query["format"]
-            _LOGGER.debug("Need to format: {}".format(img_format))
+            _LOGGER.debug("Need to format: %s", img_format)
         return img_format
 
     def _create_response(self, request, frame: Frame, frame_params: dict, self_view: BaseAPIView) -> web.Response:
-        _LOGGER.debug(frame_params)
+        _LOGGER.debug("Frame params: %s", frame_params)
+        self._validate_query(request)
 
         scale = self._get_scale_param(request)
         img_format = self._get_format_param(request)
@@ -181,7 +204,7 @@ class APIImageView(BaseAPIView):
             response["links"].append(self_view.to_link_repr(request, rel=["jpeg-thumbnail"], path_params=frame_params,
                                                             query_params={"format": "jpeg", "scale": "0.2"}))
 
-            return web.Response(text=json.dumps(response), content_type='application/json')
+            return codec.json_response(response)
         else:
             if img_format.upper() not in ["JPEG", "PNG", "GIF", "BMP"]:
                 return HTTPBadRequest()
@@ -191,7 +214,10 @@ class APIImageView(BaseAPIView):
 
 
 class APIVideoView(APIImageView):
+    query_schema = VIDEO_QUERY_SCHEMA
+
     async def _create_response(self, request, frames: [], self_view: BaseAPIView) -> web.Response:
+        self._validate_query(request)
         scale = self._get_scale_param(request)
         img_format = self._get_format_param(request, "GIF")
 
@@ -245,7 +271,7 @@ class APIRootView(BaseAPIView):
                 "description": "<str>"
             }
             response["entities"].append(entity)
-        return web.Response(text=json.dumps(response), content_type='application/json')
+        return codec.json_response(response)
 
 
 class APICamerasView(BaseAPIView):
@@ -261,7 +287,7 @@ class APICamerasView(BaseAPIView):
                                                                          ["camera"],
                                                                          ["item"],
                                                                          {"camera_id": camera_id}))
-        return web.Response(text=json.dumps(response), content_type='application/json')
+        return codec.json_response(response)
 
 
 class APICameraEntityView(BaseAPIView):
@@ -279,7 +305,7 @@ class APICameraEntityView(BaseAPIView):
         try:
             camera = mm.cameras[camera_id]
         except KeyError:
-            _LOGGER.error("Invalid cameraId: {}".format(camera_id))
+            _LOGGER.error("Invalid cameraId: %s", camera_id)
             raise HTTPBadRequest()
 
         response = self.to_entity_repr(request, classes=["cameras"], path_params={"camera_id": camera_id})
@@ -309,7 +335,7 @@ class APICameraEntityView(BaseAPIView):
             APICameraEventsView.to_link_repr(request, ["events"],
                                              rel=["http://motion-monitor/rel/recent-motion"],
                                              path_params={"camera_id": camera_id}))
-        return web.Response(text=json.dumps(response), content_type='application/json')
+        return codec.json_response(response)
 
 
 class APICameraSnapshotFramesView(BaseAPIView):
@@ -324,7 +350,7 @@ class APICameraSnapshotFramesView(BaseAPIView):
         try:
             camera = mm.cameras[camera_id]
         except KeyError:
-            _LOGGER.error("Invalid cameraId: {}".format(camera_id))
+            _LOGGER.error("Invalid cameraId: %s", camera_id)
             raise HTTPBadRequest()
 
         response = self.to_entity_repr(request, ["snapshots"], path_params={"camera_id": camera_id})
@@ -342,7 +368,7 @@ class APICameraSnapshotFramesView(BaseAPIView):
                                                                                              "timestamp": timestamp,
                                                                                              "frame": frame_num}))
 
-        return web.Response(text=json.dumps(response), content_type='application/json')
+        return codec.json_response(response)
 
 
 class APICameraSnapshotFrameView(APIImageView):
@@ -360,8 +386,10 @@ class APICameraSnapshotFrameView(APIImageView):
             camera = mm.cameras[camera_id]
             frame = camera.recent_snapshots[Frame.create_id(timestamp, frame_num)]
         except KeyError:
-            _LOGGER.error("Invalid cameraId: {}".format(camera_id))
+            _SNAPSHOT_LOOKUP_MISSES.inc()
+            _LOGGER.error("Invalid cameraId: %s", camera_id)
             raise HTTPBadRequest()
+        _SNAPSHOT_LOOKUP_HITS.inc()
 
         frame_params = {
             "camera_id": camera_id,
@@ -387,7 +415,7 @@ class APICameraSnapshotTimelapseView(APIVideoView):
         try:
             camera = mm.cameras[camera_id]
         except KeyError:
-            _LOGGER.error("Invalid cameraId: {}".format(camera_id))
+            _LOGGER.error("Invalid cameraId: %s", camera_id)
             raise HTTPBadRequest()
 
         return await self._create_response(request, camera.recent_snapshots.values(), self)
@@ -405,7 +433,7 @@ class APICameraEventsView(BaseAPIView):
         try:
             camera = mm.cameras[camera_id]
         except KeyError:
-            _LOGGER.error("Invalid cameraId: {}".format(camera_id))
+            _LOGGER.error("Invalid cameraId: %s", camera_id)
             raise HTTPBadRequest()
 
         response = self.to_entity_repr(request, ["events"], path_params={"camera_id": camera_id})
@@ -417,7 +445,7 @@ class APICameraEventsView(BaseAPIView):
                                                                               path_params={"camera_id": event.camera_id,
                                                                                            "event_id": event.id}))
 
-        return web.Response(text=json.dumps(response), content_type='application/json')
+        return codec.json_response(response)
 
 
 class APICameraEventsTimelapseView(APIVideoView):
@@ -432,7 +460,7 @@ class APICameraEventsTimelapseView(APIVideoView):
         try:
             camera = mm.cameras[camera_id]
         except KeyError:
-            _LOGGER.error("Invalid cameraId: {}".format(camera_id))
+            _LOGGER.error("Invalid cameraId: %s", camera_id)
             raise HTTPBadRequest()
 
         frames = []
@@ -442,7 +470,7 @@ class APICameraEventsTimelapseView(APIVideoView):
             for frame in event.frames.values():
                 if len(high_score_frames) == 0 or frame.score > high_score_frames[0]:
                     high_score_frames.append(frame)
-            _LOGGER.debug("Have these high-score-frames: {}".format(high_score_frames))
+            _LOGGER.debug("Have these high-score-frames: %s", high_score_frames)
             frames.extend(high_score_frames)
 
         return await self._create_response(request, frames, self)
@@ -462,7 +490,7 @@ class APICameraEventEntityView(BaseAPIView):
             camera = mm.cameras[camera_id]
             event = camera.recent_motion[event_id]
         except KeyError:
-            _LOGGER.error("Invalid cameraId: {}".format(camera_id))
+            _LOGGER.error("Invalid cameraId: %s", camera_id)
             raise HTTPBadRequest()
 
         response = self.to_entity_repr(request, ["event"], path_params={"camera_id": camera_id, "event_id": event_id})
@@ -485,7 +513,7 @@ class APICameraEventEntityView(BaseAPIView):
                                                                           ["http://motion-monitor/rel/frames"],
                                                                           path_params={"camera_id": camera_id,
                                                                                        "event_id": event_id}))
-        return web.Response(text=json.dumps(response), content_type='application/json')
+        return codec.json_response(response)
 
     async def delete(self, request):
         raise HTTPNotImplemented()
@@ -505,7 +533,7 @@ class APICameraEventFramesView(APIImageView):
             camera = mm.cameras[camera_id]
             event = camera.recent_motion[event_id]
         except KeyError:
-            _LOGGER.error("Invalid cameraId: {}".format(camera_id))
+            _LOGGER.error("Invalid cameraId: %s", camera_id)
             raise HTTPBadRequest()
 
         response = self.to_entity_repr(request, ["frames"], path_params={"camera_id": camera_id, "event_id": event_id})
@@ -523,7 +551,7 @@ class APICameraEventFramesView(APIImageView):
                                                                                               "%Y%m%d%H%M%S"),
                                                                                           "frame": frame.frame_num}))
 
-        return web.Response(text=json.dumps(response), content_type='application/json')
+        return codec.json_response(response)
 
 
 class APICameraEventFrameView(APIImageView):
@@ -542,12 +570,14 @@ class APICameraEventFrameView(APIImageView):
             camera = mm.cameras[camera_id]
             frame = camera.recent_motion[event_id].frames[EventFrame.create_id(timestamp, frame_num)]
         except KeyError:
-            _LOGGER.error("Invalid cameraId: {}".format(camera_id))
+            _EVENT_FRAME_LOOKUP_MISSES.inc()
+            _LOGGER.error("Invalid cameraId: %s", camera_id)
             raise HTTPBadRequest()
+        _EVENT_FRAME_LOOKUP_HITS.inc()
 
         frame_params = {
-            "cameraId": camera_id,
-            "eventId": frame.event_id,
+            "camera_id": camera_id,
+            "event_id": frame.event_id,
             "timestamp": timestamp.strftime("%Y%m%d%H%M%S"),
             "score": frame.score,
             "frame": frame_num
@@ -572,7 +602,7 @@ class APICameraEventTimelapseView(APIVideoView):
             camera = mm.cameras[camera_id]
             event = camera.recent_motion[event_id]
         except KeyError:
-            _LOGGER.error("Invalid cameraId: {}".format(camera_id))
+            _LOGGER.error("Invalid cameraId: %s", camera_id)
             raise HTTPBadRequest()
 
         return await self._create_response(request, event.frames.values(), self)
@@ -590,7 +620,7 @@ class APIJobsView(BaseAPIView):
             response["entities"].append(APIJobEntityView.to_link_repr(request, ["job"],
                                                                       rel=["item"],
                                                                       path_params={"job_id": job.id}))
-        return web.Response(text=json.dumps(response), content_type='application/json')
+        return codec.json_response(response)
 
 
 class APIJobEntityView(BaseAPIView):
@@ -600,3 +630,50 @@ class APIJobEntityView(BaseAPIView):
 
     async def get(self, request):
         raise HTTPNotImplemented()
+
+
+class APIMetricsView(BaseAPIView):
+    url = "/metrics"
+    name = "api:metrics"
+    description = "Returns the runtime metrics, in the Prometheus text format"
+
+    async def get(self, request):
+        return web.Response(body=metrics.REGISTRY.render().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+class APIBusView(BaseAPIView):
+    url = "/bus"
+    name = "api:bus"
+    description = "Shows the event bus's listeners and how long each takes to handle its events"
+
+    async def get(self, request):
+        bus = request.app[KEY_MM].bus
+        response = self.to_entity_repr(request, ["bus"])
+        response["properties"] = {
+            "listeners": bus.listeners,
+            "slowListenerBudgetMs": 1000 * bus.slow_listener_budget
+        }
+
+        # The listeners that have spent the most time handling events first
+        for stats in sorted(bus.listener_stats, key=lambda s: sum(s.durations), reverse=True):
+            entity = self.to_link_repr(request, ["listener"], rel=["item"])
+            entity["properties"] = stats.to_json()
+            response["entities"].append(entity)
+        return codec.json_response(response)
+
+
+class APISequencesView(BaseAPIView):
+    url = "/sequences"
+    name = "api:sequences"
+    description = "Shows the frames of each camera that were lost, duplicated or arrived out of order"
+
+    async def get(self, request):
+        mm = request.app[KEY_MM]
+        response = self.to_entity_repr(request, ["sequences"])
+        for sequence in mm.sequences.cameras.values():
+            entity = APICameraEntityView.to_link_repr(request, ["camera", "sequence"], rel=["item"],
+                                                      path_params={"camera_id": sequence.camera_id})
+            entity["properties"] = sequence.to_json()
+            response["entities"].append(entity)
+        return codec.json_response(response)
@@ -368,4 +368,25 @@ JSONSCHEMA = {
             ]
         }
     }
-}
\ No newline at end of file
+}
+
+# The query parameters of the views that return images, each a string as it arrives in the URL.
+_SCALE = {"type": "string", "pattern": r"^([0-9]+\.?[0-9]*|\.[0-9]+)$"}
+
+IMAGE_QUERY_SCHEMA = {
+    "$schema": "http://json-schema.org/draft-04/schema#",
+    "type": "object",
+    "properties": {
+        "scale": _SCALE,
+        "format": {"type": "string", "pattern": "(?i)^(json|jpeg|png|gif|bmp)$"},
+    },
+}
+
+VIDEO_QUERY_SCHEMA = {
+    "$schema": "http://json-schema.org/draft-04/schema#",
+    "type": "object",
+    "properties": {
+        "scale": _SCALE,
+        "format": {"type": "string", "pattern": "(?i)^(gif|mjpeg)$"},
+    },
+}
@@ -11,6 +11,8 @@ import threading
 
 import motionmonitor.core
 import extensions.mysql_db_server.__init__
+from motionmonitor.archive import ArchiveWalker, FilenameTemplate, load_checkpoints, save_checkpoints
+from motionmonitor.models import EventFrame
 from motionmonitor.const import (
     EVENT_JOB,
     EVENT_MANAGEMENT_ACTIVITY
@@ -18,6 +20,8 @@ from motionmonitor.const import (
 
 
 def get_extension(mm):
+    if mm.config["FILE_MANAGER"].get("ENABLED", "true").lower() != "true":
+        return []
     return [Auditor(mm), Sweeper(mm)]
 
 
@@ -38,173 +42,91 @@ def delete_dir_if_empty(path, delParents=False):
 
 class AuditorThread(threading.Thread):
 
-    def __init__(self, mm):
+    # The number of directory levels beneath each camera that are named after the date the files were created.
+    SNAPSHOT_DATE_DEPTH = 4  # YYYY/MM/DD/HH
+    MOTION_DATE_DEPTH = 1  # YYYYMMDD
+
+    def __init__(self, mm, full=False):
         threading.Thread.__init__(self)
         self.__logger = logging.getLogger("%s.%s" % (self.__class__.__module__, self.__class__.__name__))
 
         self.mm = mm
 
-        # Extract the following from the config
-        self.target_dir = self.mm.config.TARGET_DIR
+        # A full audit walks everything, otherwise only directories at or after the last audit's checkpoint.
+        self.full = full
 
         # Extract the following from the config
-        self.snapshot_filename = 'snapshots/camera%t/%Y/%m/%d/%H/%M/%S-snapshot.jpg'
+        self.target_dir = self.mm.config["GENERAL"]["TARGET_DIR"]
+        self.checkpoint_file = self.mm.config["FILE_MANAGER"]["AUDIT_CHECKPOINT"]
+        self.workers = int(self.mm.config["FILE_MANAGER"]["AUDIT_WORKERS"])
 
-        # Extract the following from the config
-        self.motion_filename = 'motion/camera%t/%Y%m%d/%C/%Y%m%d-%H%M%S-%q.jpg'
+        # The filename templates are compiled once, each path is then parsed in a single match.
+        self.snapshot_template = FilenameTemplate(self.mm.config["GENERAL"]["SNAPSHOT_FILENAME"])
+        self.motion_template = FilenameTemplate(self.mm.config["GENERAL"]["MOTION_FILENAME"])
         self.__logger.info("Initialised")
 
-    @staticmethod
-    def __split_all(path):
-        allparts = []
-        while 1:
-            parts = os.path.split(path)
-            if parts[0] == path:  # sentinel for absolute paths
-                allparts.insert(0, parts[0])
-                break
-            elif parts[1] == path:  # sentinel for relative paths
-                allparts.insert(0, parts[1])
-                break
-            else:
-                path = parts[0]
-                allparts.insert(0, parts[1])
-        return allparts
-
-    def __get_camera_from_filepath(self, filepath):
-        camera_folder = self.__split_all(filepath)[4]
-        camera = camera_folder.replace("camera", "")
-        return camera
-
-    def __get_timestamp_from_snapshot_filepath(self, filepath):
-        year = self.__split_all(filepath)[5]
-        month = self.__split_all(filepath)[6]
-        day = self.__split_all(filepath)[7]
-        hours = self.__split_all(filepath)[8]
-        mins = self.__split_all(filepath)[9]
-        secs_file = self.__split_all(filepath)[10]
-        secs = secs_file.replace("-snapshot.jpg", "")
-        return "%s%s%s%s%s%s" % (year, month, day, hours, mins, secs)
-
-    def __get_timestamp_from_motion_filepath(self, filepath):
-        filename = self.__split_all(filepath)[7]
-        date = filename.split("-")[0]
-        time = filename.split("-")[1]
-        return "{}{}".format(date, time)
-
-    def __get_starttime_from_motion_event(self, event):
-        return event.split("-")[0]
-
-    def __get_event_from_motion_filepath(self, filepath):
-        return self.__split_all(filepath)[6]
-
-    def __get_frame_from_motion_filepath(self, filepath):
-        filename = self.__split_all(filepath)[7]
-        filename = filename.replace(".jpg", "")
-        frame = filename.split("-")[2]
-        return frame
-
-    def __audit_snapshot_frames(self):
-        try:
-            insertedFiles = []
-            for root, dirs, files in os.walk(self.target_dir, topdown=True):
-
-                # Hack! Only worry about snapshot files.
-                if not root.startswith('/data/motion/snapshots'): continue
-
-                delete_dir_if_empty(root, True)
-
-                try:
-                    for filename in files:
-                        filepath = os.path.join(root, filename)
+    def __walker(self, template, date_depth, checkpoints):
+        return ArchiveWalker(self.target_dir, template, date_depth, checkpoints, full=self.full,
+                             workers=self.workers, remove_empty_dirs=True)
 
-                        row = (self.__get_camera_from_filepath(filepath),
-                               self.__get_timestamp_from_snapshot_filepath(filepath),
-                               0,
-                               filepath)
-
-                        self.__logger.debug("Inserting the following snapshot file: %s" % str(row))
-                        insertedFiles.append(row)
-
-                        if len(insertedFiles) > 50:
-                            self.__logger.debug("Inserting DB entries: %s" % insertedFiles)
-                            self.__sqlwriter.insert_snapshot_frames(insertedFiles)
-                            insertedFiles = []
-                except Exception as e:
-                    self.__logger.exception(e)
-
-            # Insert the file into the DB
-            self.__logger.debug("Inserting remaining DB entries: %s" % insertedFiles)
-            self.__sqlwriter.insert_snapshot_frames(insertedFiles)
+    def __audit_snapshot_frames(self, checkpoints):
+        try:
+            for frames in self.__walker(self.snapshot_template, self.SNAPSHOT_DATE_DEPTH, checkpoints).walk():
+                rows = [(frame.camera_id, frame.timestamp.strftime("%Y%m%d%H%M%S"), frame.frame_num, frame.filename)
+                        for frame in frames]
+                self.__logger.debug("Inserting %d snapshot DB entries", len(rows))
+                self.__sqlwriter.insert_snapshot_frames(rows)
         except Exception as e:
             self.__logger.exception(e)
             raise
 
-    def __audit_motion_frames(self):
+    def __audit_motion_frames(self, checkpoints):
         try:
-            insertedFiles = []
-            for root, dirs, files in os.walk(self.target_dir, topdown=True):
-
-                # Hack! Only worry about motion files.
-                if not root.startswith('/data/motion/motion'): continue
-
-                delete_dir_if_empty(root, True)
-
-                try:
-                    for filename in files:
-                        filepath = os.path.join(root, filename)
-
-                        eventId = self.__get_event_from_motion_filepath(filepath)
-                        cameraId = self.__get_camera_from_filepath(filepath)
-                        timestamp = self.__get_timestamp_from_motion_filepath(filepath)
-                        frame = self.__get_frame_from_motion_filepath(filepath)
-
-                        # Some validation
-                        try:
-                            if len(self.__split_all(filepath)) != 8:
-                                raise ValueError("Not right number of parts in filepath: {}".format(filepath))
-                            if int(frame) < 0:
-                                raise ValueError("Frame isn't positive integer: {}".format(frame))
-                            datetime.datetime.strptime(timestamp, "%Y%m%d%H%M%S")
-                        except ValueError as e:
-                            self.__logger.exception(e)
-                            self.__logger.warning("Invalid frame, should delete it and skipping {}".format(filename))
-                            # delete_path(filename)
-                            # delete_dir_if_empty(root, True)
-                            continue
-
-                        row = (eventId, cameraId, timestamp, frame, 0, filepath)
-
-                        self.__logger.debug("Inserting the following motion file: %s" % str(row))
-                        insertedFiles.append(row)
-
-                        if len(insertedFiles) > 50:
-                            self.__logger.debug("Inserting DB entries: %s" % insertedFiles)
-                            self.__sqlwriter.insert_motion_frames(insertedFiles)
-                            insertedFiles = []
-
-                    if not dirs:
-                        # This is a lowest branch, we can work out the motion_event entry
-                        starttime = self.__get_starttime_from_motion_event(eventId)
-                        row = (eventId, cameraId, starttime)
-                        self.__sqlwriter.insert_motion_events([row])
-                except Exception as e:
-                    self.__logger.exception(e)
-
-            # Insert the file into the DB
-            self.__logger.debug("Inserting remaining DB entries: %s" % insertedFiles)
-            self.__sqlwriter.insert_motion_frames(insertedFiles)
+            # Kept for the whole walk, as an event's frames can span date directories and so batches.
+            events = {}
+            for frames in self.__walker(self.motion_template, self.MOTION_DATE_DEPTH, checkpoints).walk():
+                rows = []
+                for frame in frames:
+                    if not isinstance(frame, EventFrame):
+                        self.__logger.warning("Skipping {}, it has no event".format(frame.filename))
+                        continue
+                    timestamp = frame.timestamp.strftime("%Y%m%d%H%M%S")
+                    rows.append((frame.event_id, frame.camera_id, timestamp, frame.frame_num, 0, frame.filename))
+
+                    # The event starts with the earliest of its frames.
+                    key = (frame.event_id, frame.camera_id)
+                    events[key] = min(events.get(key, timestamp), timestamp)
+
+                self.__logger.debug("Inserting %d motion DB entries", len(rows))
+                self.__sqlwriter.insert_motion_frames(rows)
+
+            self.__logger.debug("Inserting %d motion events", len(events))
+            self.__sqlwriter.insert_motion_events([(event_id, camera_id, start_time)
+                                                   for ((event_id, camera_id), start_time) in events.items()])
         except Exception as e:
             self.__logger.exception(e)
             raise
 
     def run(self):
         self.__sqlwriter = extensions.mysql_db_server.__init__.SQLWriter(self.mm)
+        checkpoints = load_checkpoints(self.checkpoint_file)
+        self.__logger.info("Starting a %s audit" % ("full" if self.full else "incremental"))
+
         self.__logger.info("Auditing the motion frames")
-        self.__audit_motion_frames()
+        checkpoints.setdefault("motion", {})
+        self.__audit_motion_frames(checkpoints["motion"])
+        save_checkpoints(self.checkpoint_file, checkpoints)
         self.__logger.info("Motion auditing finished")
+
         self.__logger.info("Auditing the snapshot frames")
-        self.__audit_snapshot_frames()
+        checkpoints.setdefault("snapshots", {})
+        self.__audit_snapshot_frames(checkpoints["snapshots"])
+        save_checkpoints(self.checkpoint_file, checkpoints)
         self.__logger.info("Snapshot auditing finished")
+        if self.full:
+            # Otherwise the sweeps index the frames as they arrive.
+            self.__logger.info("Populating the snapshot timelapse index")
+            self.__sqlwriter.populate_snapshot_timelapse()
         self.__sqlwriter.close()
 
 
@@ -224,10 +146,13 @@ class Auditor():
         msg = event.data
         if not msg["type"] in ["audit"]: return
 
+        # Audits are incremental, unless a full audit is explicitly requested.
+        full = msg.get("mode") == "full"
+
         if not self.__thread or not self.__thread.isAlive():
             # Create a thread and start it
             self.__logger.info("Creating a new AuditorThread and starting it")
-            self.__thread = AuditorThread(self.mm)
+            self.__thread = AuditorThread(self.mm, full)
             self.__thread.start()
         else:
             self.__logger.warning("AuditorThread is already running")
@@ -241,6 +166,7 @@ class SweeperThread(threading.Thread):
 
         self.mm = mm
         self.__sqlreader = extensions.mysql_db_server.__init__.SQLReader(self.mm)
+        self.__sqlwriter = extensions.mysql_db_server.__init__.SQLWriter(self.mm)
 
         self.__job = motionmonitor.core.Job("Sweeper")
 
@@ -252,6 +178,11 @@ class SweeperThread(threading.Thread):
     def __sweep_snapshot_frames(self):
 
         try:
+            self.__sqlreader.assign_snapshot_keep_tiers()
+            # Only the frames taken since the last sweep want indexing.  The last 7 days cover them, unless the sweeps
+            # are further apart than that, which a full audit catches up on.
+            self.__sqlwriter.populate_snapshot_timelapse(datetime.datetime.now() - datetime.timedelta(days=7))
+
             stale_files = []
             stale_files.extend(self.__sqlreader.get_stale_snapshot_frames())
 
@@ -0,0 +1,230 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+
+from motionmonitor.archive import FilenameTemplate
+from motionmonitor.const import EVENT_NEW_FRAME
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def get_extension(mm):
+    if mm.config["FILE_WATCHER"]["ENABLED"].lower() != "true":
+        return []
+    return [FileWatcher(mm)]
+
+
+class Inotify:
+    """A minimal wrapper of the Linux inotify API, using ctypes."""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+
+    _EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not supported by {}".format(libc_name))
+
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """Returns a list of the pending (wd, mask, name) events, without blocking."""
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self._EVENT_HEADER.unpack_from(data, offset)
+            offset += self._EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FileWatcher:
+    """An extension that watches TARGET_DIR for the snapshots motion writes, as an alternative to its UDP messages.
+
+    Only the newest directories of each camera are watched, new directories are watched as they are created and the
+    directories they replace are retired shortly after.  A new snapshot is held for GRACE_PERIOD seconds and is only
+    fired onto the bus if the socket server hasn't already delivered it, so it fills the gaps of lost datagrams
+    without duplicating the frames that did arrive.  Both record the files they fire with mm.sequences, so the socket
+    server drops a snapshot that arrives after the watcher has fired it.
+
+    Motion frames aren't fired.  Their path holds the event's text (%C) rather than the event id motion sends, and no
+    score, so they'd be recorded twice and start an event of their own; an audit picks up any that were lost.
+    """
+
+    WATCH_MASK = Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO | Inotify.IN_CREATE | Inotify.IN_ONLYDIR
+
+    # How long directories are still watched for after a newer sibling directory is created.
+    RETIRE_DELAY = 60
+
+    def __init__(self, mm):
+        self.mm = mm
+        self.__target_dir = mm.config["GENERAL"]["TARGET_DIR"]
+        self.__grace_period = float(mm.config["FILE_WATCHER"]["GRACE_PERIOD"])
+        self.__templates = [FilenameTemplate(mm.config["GENERAL"]["SNAPSHOT_FILENAME"])]
+
+        self.__inotify = None
+        self.__watches = {}
+        self.__paths = {}
+
+    async def start_extension(self):
+        try:
+            self.__inotify = Inotify()
+        except OSError as e:
+            _LOGGER.error("Unable to start watching for files: %s", e)
+            return
+
+        self.mm.sequences.track_deliveries()
+
+        for template in self.__templates:
+            base_dir = os.path.join(self.__target_dir, template.prefix)
+            if os.path.isdir(base_dir):
+                # Watch every camera directory, but only the newest date directories within them.
+                self.__watch_newest(base_dir, 1)
+
+        self.mm.loop.add_reader(self.__inotify.fd, self._read_events)
+        _LOGGER.info("Watching %s directories beneath %s", len(self.__watches), self.__target_dir)
+
+    def close(self):
+        if self.__inotify:
+            self.mm.loop.remove_reader(self.__inotify.fd)
+            self.__inotify.close()
+            self.__inotify = None
+
+    def __add_watch(self, path):
+        try:
+            wd = self.__inotify.add_watch(path, self.WATCH_MASK)
+        except OSError as e:
+            _LOGGER.warning("Unable to watch %s: %s", path, e)
+            return False
+        self.__watches[wd] = path
+        self.__paths[path] = wd
+        return True
+
+    def __watch_newest(self, path, camera_levels):
+        """Watches the path and the newest directory at each level beneath it.  Every directory within the first
+        camera_levels is watched though, there being one for each camera rather than one for each date.
+        """
+        if not self.__add_watch(path):
+            return
+        try:
+            with os.scandir(path) as entries:
+                dirs = sorted(entry.path for entry in entries if entry.is_dir(follow_symlinks=False))
+        except OSError as e:
+            _LOGGER.warning("Unable to list %s: %s", path, e)
+            return
+        if camera_levels > 0:
+            for child in dirs:
+                self.__watch_newest(child, camera_levels - 1)
+        elif dirs:
+            self.__watch_newest(dirs[-1], 0)
+
+    def __watch_created(self, path):
+        """Watches a directory that has just been created, along with anything that was created within it before
+        the watch was in place.
+        """
+        if not self.__add_watch(path):
+            return
+        try:
+            with os.scandir(path) as entries:
+                entries = sorted(entries, key=lambda e: e.name)
+        except OSError as e:
+            # Most likely removed again already, in which case the watch is dropped with an IN_IGNORED event.
+            _LOGGER.warning("Unable to list %s: %s", path, e)
+            return
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                self.__watch_created(entry.path)
+            else:
+                self.__file_written(entry.path)
+
+        # The sibling directories are for older dates, there'll be nothing more written to them soon.
+        if not self.__is_camera_dir(path):
+            parent = os.path.dirname(path)
+            siblings = [p for p in self.__paths if os.path.dirname(p) == parent and p != path]
+            for sibling in siblings:
+                self.mm.loop.call_later(self.RETIRE_DELAY, self.__retire, sibling)
+
+    def __is_camera_dir(self, path):
+        relpath = os.path.relpath(path, self.__target_dir)
+        depth = relpath.count(os.sep) + 1
+        return any(relpath.startswith(t.prefix) and depth <= t.camera_depth + 1 for t in self.__templates)
+
+    def __retire(self, path):
+        for watched in [p for p in self.__paths if p == path or p.startswith(path + os.sep)]:
+            wd = self.__paths.pop(watched)
+            self.__watches.pop(wd, None)
+            if self.__inotify:
+                self.__inotify.rm_watch(wd)
+
+    def _read_events(self):
+        for wd, mask, name in self.__inotify.read_events():
+            if mask & Inotify.IN_Q_OVERFLOW:
+                _LOGGER.warning("Missed file events, the inotify queue overflowed.  An audit is recommended.")
+                continue
+
+            if mask & Inotify.IN_IGNORED:
+                # The directory was deleted or the watch was removed.
+                path = self.__watches.pop(wd, None)
+                if path:
+                    self.__paths.pop(path, None)
+                continue
+
+            directory = self.__watches.get(wd)
+            if not directory:
+                continue
+            path = os.path.join(directory, name)
+
+            if mask & Inotify.IN_ISDIR:
+                if mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO):
+                    self.__watch_created(path)
+            elif mask & (Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO):
+                self.__file_written(path)
+
+    def __file_written(self, path):
+        relpath = os.path.relpath(path, self.__target_dir)
+        for template in self.__templates:
+            frame = template.parse(path, relpath)
+            if frame:
+                self.mm.loop.call_later(self.__grace_period, self._fire_if_unseen, frame)
+                return
+        _LOGGER.debug("Ignoring %s, it isn't a snapshot", path)
+
+    def _fire_if_unseen(self, frame):
+        if not self.mm.sequences.deliver(frame, "file watcher"):
+            return
+
+        _LOGGER.info("Frame was not delivered by the socket server, firing it: %s", frame.filename)
+        self.mm.bus.fire(EVENT_NEW_FRAME, frame)
@@ -8,13 +8,50 @@ import logging
 
 import MySQLdb
 
-from motionmonitor.const import EVENT_MOTION_INTERNAL
+from motionmonitor.const import (
+    EVENT_MOTION_INTERNAL,
+    KEEP_TIER_7_DAYS,
+    KEEP_TIER_4_WEEKS,
+    KEEP_TIER_3_MONTHS,
+    KEEP_TIER_FOREVER,
+    TIMELAPSE_MINUTELY,
+    TIMELAPSE_HOURLY,
+    TIMELAPSE_SIX_HOURLY,
+    TIMELAPSE_DAILY
+)
 
 
 def get_extension(mm):
     return [SQLReader(mm), SQLWriter(mm)]
 
 
+# The timelapse index holds one snapshot frame per camera, granularity and bucket (see
+# motionmonitor.utils.snapshot_timelapse_buckets).  It is filled in from snapshot_frame by each sweep, so that a
+# timelapse is a single range read of the primary key.
+SNAPSHOT_TIMELAPSE_DDL = """CREATE TABLE IF NOT EXISTS snapshot_timelapse (
+                                camera_id int(11) NOT NULL,
+                                granularity tinyint(1) NOT NULL,
+                                bucket datetime NOT NULL,
+                                timestamp datetime NOT NULL,
+                                frame int(11) DEFAULT NULL,
+                                filename varchar(100) DEFAULT NULL,
+                                PRIMARY KEY (camera_id, granularity, bucket),
+                                KEY snapshot_timelapse_frame (camera_id, timestamp)
+                            )"""
+
+# The sweeps read snapshot_frame by retention tier and timestamp.  The Recorder's model declares this index, but the
+# tables it didn't create lack it.
+SNAPSHOT_FRAME_ARCHIVE_INDEX_DDL = """ALTER TABLE snapshot_frame
+                                      ADD INDEX snapshot_frame_archive_timestamp (archive, timestamp)"""
+
+# The one-off upgrades of existing rows that have been applied, see DBConnection.upgrade_once.
+UPGRADE_DDL = """CREATE TABLE IF NOT EXISTS motion_monitor_upgrade (
+                     name varchar(100) NOT NULL,
+                     applied datetime NOT NULL,
+                     PRIMARY KEY (name)
+                 )"""
+
+
 class DBConnection:
     def __init__(self, config):
         self.__logger = logging.getLogger("%s.%s" % (self.__class__.__module__, self.__class__.__name__))
@@ -28,6 +65,35 @@ class DBConnection:
 
         self.__logger.info("Initialised")
 
+    # Whether the tables this module adds to the schema are known to exist, shared by every connection.
+    __tables_created = False
+
+    def create_tables(self):
+        """Creates the tables and indexes this module adds to the schema, if they don't already exist.  Only the first
+        call in the process queries the DB."""
+        if DBConnection.__tables_created:
+            return
+        self.run_query(SNAPSHOT_TIMELAPSE_DDL)
+        self.run_query(UPGRADE_DDL)
+        if not self.run_query("""SHOW INDEX
+                                 FROM snapshot_frame
+                                 WHERE Column_name = 'archive'
+                                   AND Seq_in_index = 1"""):
+            self.__logger.info("Adding the (archive, timestamp) index to snapshot_frame")
+            self.run_query(SNAPSHOT_FRAME_ARCHIVE_INDEX_DDL)
+        DBConnection.__tables_created = True
+
+    def upgrade_once(self, name, query, args=None):
+        """Runs the query, which upgrades existing rows, unless the upgrade of that name has already been applied to
+        the DB.  Returns whether it ran."""
+        self.create_tables()
+        if self.run_query("SELECT name FROM motion_monitor_upgrade WHERE name = %s", args=(name,)):
+            return False
+        self.__logger.info("Applying the one-off upgrade '%s'", name)
+        self.run_query(query, args=args)
+        self.run_query("INSERT IGNORE INTO motion_monitor_upgrade (name, applied) VALUES (%s, now())", args=(name,))
+        return True
+
     def __open(self):
         try:
             self.__connection = MySQLdb.connect(host=self.__DB_SERVER_ADDR, db=self.__DB_NAME, user=self.__DB_USER,
@@ -39,7 +105,9 @@ class DBConnection:
     def __close(self):
         self.__connection.close()
 
-    def run_query(self, query, params=None):
+    def run_query(self, query, params=None, args=None):
+        """Runs the query.  'params' is a list of rows to run the query against many times over, whereas 'args' are
+        the parameters for a single execution of the query."""
 
         cursor = self.__open()
 
@@ -48,7 +116,7 @@ class DBConnection:
             if params:
                 cursor.executemany(query, params)
             else:
-                cursor.execute(query)
+                cursor.execute(query, args)
             self.__connection.commit()
 
             results = cursor.fetchall()
@@ -67,22 +135,31 @@ class SQLReader:
         self.__logger = logging.getLogger("%s.%s" % (self.__class__.__module__, self.__class__.__name__))
 
         self.mm = mm
+        self.__connection = DBConnection(self.mm.config)
 
         self.__logger.info("Initialised")
 
     async def start_extension(self):
-        self.__connection = DBConnection(self.mm.config)
+        pass
 
     def delete_snapshot_frame(self, frames):
         self.__logger.debug("Deleting snapshot frames from the DB: %s" % frames)
         # If the list contains frames, remove them from the DB
         if frames:
+            self.__connection.create_tables()
+            query = """DELETE
+                       FROM snapshot_timelapse
+                       WHERE camera_id = %s
+                       AND timestamp = %s
+                       AND frame = %s"""
+            self.__connection.run_query(query, frames)
+
             query = """DELETE
                        FROM snapshot_frame
                        WHERE camera_id = %s
                        AND timestamp = %s
                        AND frame = %s"""
-        self.__connection.run_query(query, frames)
+            self.__connection.run_query(query, frames)
 
     def delete_motion_frame(self, frames):
         self.__logger.debug("Deleting motion frames from the DB: %s" % frames)
@@ -99,92 +176,76 @@ class SQLReader:
     def get_timelapse_snapshot_frames(self, cameraId, startTime, minuteCount=0, hourCount=0, dayCount=0, weekCount=0,
                                       monthCount=0):
         self.__logger.debug("Listing snapshots in the DB for timelapse")
-        # Select just the snapshot filenames that are stale
+        if minuteCount:
+            # Every frame within the minutes requested.
+            query = """SELECT camera_id,
+                              timestamp,
+                              frame,
+                              filename
+                       FROM snapshot_frame
+                       WHERE camera_id = %s
+                         AND timestamp >= %s
+                         AND timestamp < adddate(%s, INTERVAL %s MINUTE)
+                       ORDER BY timestamp"""
+            return self.__connection.run_query(query, args=(cameraId, startTime, startTime, minuteCount))
+
+        # Otherwise, one frame per bucket from the timelapse index at the granularity that suits the units.
+        self.__connection.create_tables()
+        if hourCount:
+            granularity, count, unit = TIMELAPSE_MINUTELY, hourCount, "HOUR"
+        elif dayCount:
+            granularity, count, unit = TIMELAPSE_HOURLY, dayCount, "DAY"
+        elif weekCount:
+            granularity, count, unit = TIMELAPSE_SIX_HOURLY, weekCount, "WEEK"
+        elif monthCount:
+            granularity, count, unit = TIMELAPSE_DAILY, monthCount, "MONTH"
+        else:
+            return ()
+
         query = """SELECT camera_id,
                           timestamp,
                           frame,
                           filename
-                   FROM snapshot_frame
-                   WHERE camera_id = {cameraId}
-                     AND {startTime} > subdate(now(), INTERVAL 7 DAY) 
-                     AND timestamp >= {startTime}
-                     AND timestamp < adddate({startTime}, INTERVAL {minuteCount} MINUTE)
-                   UNION
-                     ( SELECT camera_id,
-                              timestamp,
-                              frame,
-                              filename
-                      FROM snapshot_frame
-                      WHERE camera_id = {cameraId}
-                        AND {startTime} > subdate(now(), INTERVAL 7 DAY)
-                        AND timestamp >= {startTime}
-                        AND timestamp < adddate({startTime}, INTERVAL {hourCount} HOUR)
-                      GROUP BY date(timestamp),
-                               hour(timestamp),
-                               minute(timestamp))
-                   UNION
-                     (SELECT camera_id,
-                             timestamp,
-                             frame,
-                             filename
-                      FROM snapshot_frame
-                      WHERE camera_id = {cameraId}
-                        AND {startTime} > subdate(now(), INTERVAL 4 WEEK)
-                        AND timestamp >= {startTime}
-                        AND timestamp < adddate({startTime}, INTERVAL {dayCount} DAY)
-                      GROUP BY date(timestamp),
-                               hour(timestamp))
-                   UNION
-                     (SELECT camera_id,
-                             timestamp,
-                             frame,
-                             filename
-                      FROM snapshot_frame
-                      WHERE camera_id = {cameraId}
-                        AND {startTime} > subdate(now(), INTERVAL 3 MONTH)
-                        AND timestamp >= {startTime}
-                        AND timestamp < adddate({startTime}, INTERVAL {weekCount} WEEK)
-                        AND hour(timestamp) IN (06,
-                                                12,
-                                                18)
-                      GROUP BY date(timestamp),
-                               hour(timestamp))
-                   UNION
-                     (SELECT camera_id,
-                             timestamp,
-                             frame,
-                             filename
-                      FROM snapshot_frame
-                      WHERE camera_id = {cameraId}
-                        AND timestamp >= {startTime}
-                        AND timestamp < adddate({startTime}, INTERVAL {monthCount} MONTH)
-                        AND hour(timestamp) = 12
-                      GROUP BY date(timestamp),
-                               hour(timestamp))""".format(cameraId=cameraId,
-                                                          startTime=startTime,
-                                                          minuteCount=minuteCount,
-                                                          hourCount=hourCount,
-                                                          dayCount=dayCount,
-                                                          weekCount=weekCount,
-                                                          monthCount=monthCount)
-        return self.__connection.run_query(query)
+                   FROM snapshot_timelapse
+                   WHERE camera_id = %s
+                     AND granularity = %s
+                     AND bucket >= %s
+                     AND bucket < adddate(%s, INTERVAL %s {unit})
+                   ORDER BY bucket""".format(unit=unit)
+        return self.__connection.run_query(query, args=(cameraId, granularity, startTime, startTime, count))
+
+    def assign_snapshot_keep_tiers(self):
+        self.__logger.debug("Assigning a retention tier to any snapshot frames without one")
+        tiers = """SET archive = CASE
+                       WHEN minute(timestamp) != 0 THEN %s
+                       WHEN hour(timestamp) = 12 THEN %s
+                       WHEN hour(timestamp) IN (6, 18) THEN %s
+                       ELSE %s
+                   END"""
+        tier_args = (KEEP_TIER_7_DAYS, KEEP_TIER_FOREVER, KEEP_TIER_3_MONTHS, KEEP_TIER_4_WEEKS)
+
+        # The Recorder wrote an archive of 0 for every frame before it recorded the retention tier.  As 0 is also
+        # KEEP_TIER_7_DAYS, those rows are told apart by being on the hour, which no frame in that tier is.  It reads
+        # the whole of the tier, so it's applied only the once, before the first sweep could delete them.
+        query = "UPDATE snapshot_frame " + tiers + " WHERE archive = %s AND minute(timestamp) = 0"
+        self.__connection.upgrade_once("snapshot_frame_keep_tiers", query, args=tier_args + (KEEP_TIER_7_DAYS,))
+
+        # Rows inserted without a tier at all, a range of the (archive, timestamp) index.
+        self.__connection.run_query("UPDATE snapshot_frame " + tiers + " WHERE archive IS NULL", args=tier_args)
 
     def get_stale_snapshot_frames(self):
-        timeNow = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-
-        query = """SELECT camera_id, timestamp, frame, filename FROM snapshot_frame a
-                WHERE (timestamp < subdate(%s, INTERVAL 7 DAY)
-                     AND timestamp >= subdate(%s, INTERVAL 4 WEEK)
-                     AND minute(timestamp) != 0)
-                OR (timestamp < subdate(%s, INTERVAL 4 WEEK)
-                     AND timestamp >= subdate(%s, INTERVAL 3 MONTH)
-                     AND (hour(timestamp) NOT IN (6,12, 18)
-                     AND minute(timestamp) != 0))
-                OR (timestamp < subdate(%s, INTERVAL 3 MONTH)
-                     AND (hour(timestamp) != 12
-                     AND minute(timestamp) != 0))""" % (timeNow, timeNow, timeNow, timeNow, timeNow)
+        time_now = datetime.datetime.now()
 
-        return self.__connection.run_query(query)
+        # Each retention tier is an equality on archive with a range on timestamp, so each branch is a range scan of
+        # the (archive, timestamp) index.  Frames in KEEP_TIER_FOREVER are never stale.
+        query = """SELECT camera_id, timestamp, frame, filename FROM snapshot_frame
+                WHERE (archive = %s AND timestamp < subdate(%s, INTERVAL 7 DAY))
+                OR (archive = %s AND timestamp < subdate(%s, INTERVAL 4 WEEK))
+                OR (archive = %s AND timestamp < subdate(%s, INTERVAL 3 MONTH))"""
+
+        return self.__connection.run_query(query, args=(KEEP_TIER_7_DAYS, time_now,
+                                                        KEEP_TIER_4_WEEKS, time_now,
+                                                        KEEP_TIER_3_MONTHS, time_now))
 
     def get_stale_motion_frames(self):
         self.__logger.debug("Listing stale motion files in the DB")
@@ -251,13 +312,11 @@ class SQLWriter:
         self.__logger = logging.getLogger("%s.%s" % (self.__class__.__module__, self.__class__.__name__))
 
         self.mm = mm
-
+        self.__connection = DBConnection(self.mm.config)
 
         self.__logger.info("Initialised")
 
     async def start_extension(self):
-        self.__connection = DBConnection(self.mm.config)
-
         # We care about camera activity, register a handler.
         self.__remove_listener_func = self.mm.bus.listen(EVENT_MOTION_INTERNAL, self.handle_motion_event)
 
@@ -278,6 +337,32 @@ class SQLWriter:
         return
         self.__connection.run_query(query, frames)
 
+    def populate_snapshot_timelapse(self, since=None):
+        self.__logger.debug("Populating the timelapse index from the snapshot frames since %s" % since)
+        # Indexes the frames missing from the timelapse index, the first frame in a bucket representing it.  Existing
+        # buckets are left alone.  Each sweep indexes the frames taken since the one before, while a full audit reads
+        # every snapshot frame, to catch those inserted before the index existed.  A frame is only indexed once its
+        # retention tier has been assigned, and at the granularities up to it.  Each tier is an equality on archive,
+        # so with a range on timestamp each is a range scan of the (archive, timestamp) index.
+        self.__connection.create_tables()
+        for granularity in (TIMELAPSE_MINUTELY, TIMELAPSE_HOURLY, TIMELAPSE_SIX_HOURLY, TIMELAPSE_DAILY):
+            tiers = list(range(granularity, KEEP_TIER_FOREVER + 1))
+            query = """INSERT
+                       IGNORE INTO snapshot_timelapse (camera_id, granularity, bucket, timestamp, frame, filename)
+                       SELECT camera_id,
+                              %s,
+                              date_format(timestamp, '%%Y-%%m-%%d %%H:%%i:00'),
+                              timestamp,
+                              frame,
+                              filename
+                       FROM snapshot_frame
+                       WHERE archive IN ({tiers})""".format(tiers=", ".join(["%s"] * len(tiers)))
+            args = [granularity] + tiers
+            if since:
+                query += "\nAND timestamp >= %s"
+                args.append(since)
+            self.__connection.run_query(query, args=args)
+
     def insert_motion_frames(self, frames):
         self.__logger.debug("Inserting motion frame to the DB: %s" % frames)
         # Insert the data to the DB.  Ignore any duplicates (as determined by the filename)
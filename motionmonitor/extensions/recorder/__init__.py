@@ -1,24 +1,52 @@
-import json
+import asyncio
 import logging
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
 
+import peewee as pw
 from aiohttp import web
 from aiohttp.web_exceptions import HTTPNotImplemented, HTTPBadRequest
 from peewee import DoesNotExist
 from playhouse.db_url import connect
 
-from motionmonitor.const import EVENT_MOTION_EVENT_START, EVENT_NEW_FRAME, EVENT_NEW_MOTION_FRAME
+import motionmonitor.core
+from motionmonitor import codec, metrics
+from motionmonitor.const import EVENT_JOB, EVENT_MOTION_EVENT_START, EVENT_NEW_FRAME, EVENT_NEW_MOTION_FRAME
 from motionmonitor.extensions.api import BaseAPIView, APIImageView
-from motionmonitor.extensions.recorder import models
-from motionmonitor.extensions.recorder.models import Event, Frame, EventFrame
+from motionmonitor.extensions.recorder import migrations, models
+from motionmonitor.extensions.recorder.models import Event, Frame, EventFrame, format_timestamp
+from motionmonitor.extensions.recorder.partitions import partitioner
+from motionmonitor.extensions.recorder.reader import reader, is_in_memory
+from motionmonitor.extensions.recorder.schema import SNAPSHOTS_QUERY_SCHEMA
 
 _LOGGER = logging.getLogger(__name__)
 
+# The pragmas that each connection to a SQLite database is opened with, tuned for a single node that writes frames
+# continuously while the API reads them: the WAL lets readers and the writer carry on without blocking each other.
+# Each can be overridden by the SQLITE_<PRAGMA> option of the configuration.
+SQLITE_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "busy_timeout": 5000,
+    "cache_size": -65536,
+    "mmap_size": 268435456,
+    "journal_size_limit": 67108864,
+}
+
 
 def get_extension(mm):
     return [Recorder(mm)]
 
 
+def connect_params(url: str, config) -> dict:
+    """The parameters a database is created with, beyond those in its URL, from the RECORDER section of the config."""
+    if not urlparse(url).scheme.startswith("sqlite"):
+        return {}
+    pragmas = [(pragma, config.get("SQLITE_" + pragma.upper(), default)) for (pragma, default) in SQLITE_PRAGMAS.items()]
+    return {"pragmas": pragmas}
+
+
 class Recorder:
     """An extension to record data to a database.  Backend database URL is provided in the configuration
     and could be any database supported by the Peewee ORM.  API endpoints are added to the API extension that
@@ -31,12 +59,36 @@ class Recorder:
     def __init__(self, mm):
         self.mm = mm
         self.__db_url = mm.config["RECORDER"]["URL"]
+        self.__maintenance_interval = float(mm.config["RECORDER"].get("MAINTENANCE_INTERVAL", "300"))
+        self.__retention_days = float(mm.config["RECORDER"].get("RETENTION_DAYS", "0"))
+        self.__background_migrations = mm.config["RECORDER"].get("BACKGROUND_MIGRATIONS", "true").lower() == "true"
+        self.__maintenance_task = None
+        self.__migration_task = None
+        # The rows held back from the database while a migration has it locked, or None when they're written at once
+        self.__queued = None
+
+    def _connect_params(self) -> dict:
+        """The parameters the database is created with, beyond those in its URL."""
+        return connect_params(self.__db_url, self.mm.config["RECORDER"])
 
     async def start_extension(self):
         # Connect to the database and associate it with the models
-        database = connect(self.__db_url)
+        database = connect(self.__db_url, **self._connect_params())
         models.proxy.initialize(database)
-        database.create_tables([models.Event, models.Frame, models.EventFrame], safe=True)
+        # Another thread would see a different in-memory database
+        remaining = migrations.setup(database, self.mm.config["RECORDER"],
+                                     background=self.__background_migrations and not is_in_memory(database))
+        if remaining:
+            self.__migration_task = self.mm.loop.create_task(self.migrate(remaining))
+
+        # The API's reads of the database are made from a pool of threads, off the loop
+        config = self.mm.config["RECORDER"]
+        reader.configure(int(config.get("READ_WORKERS", "4")),
+                         int(config.get("READ_LIMIT", "16")),
+                         float(config.get("READ_TIMEOUT", "10")))
+
+        if self.__maintenance_interval > 0 and not is_in_memory(database):
+            self.__maintenance_task = self.mm.loop.create_task(self.__maintenance_loop())
 
         # Listen for the events we care about
         self.mm.bus.listen(EVENT_MOTION_EVENT_START, self._handle_motion_start)
@@ -47,20 +99,123 @@ class Recorder:
         self.mm.api.register_view(APISnapshotsView)
         self.mm.api.register_view(APISnapshotFrameView)
 
+    def close(self):
+        """Stops the maintenance and any background migration, and cancels the API's reads still waiting for a
+        thread."""
+        for task in (self.__maintenance_task, self.__migration_task):
+            if task is not None:
+                task.cancel()
+        reader.close()
+
+    async def migrate(self, remaining: list):
+        """Applies the remaining migrations, in order, from a thread of its own, as a job."""
+        job = motionmonitor.core.Job("Recorder migration")
+        job.start()
+        database = models.proxy.obj
+        if isinstance(database, pw.SqliteDatabase):
+            # An index build holds SQLite's write lock, which covers the whole database, until it's finished, so the
+            # rows are queued rather than left waiting for it on the loop.
+            self.__queued = []
+        try:
+            for (i, migration) in enumerate(remaining):
+                job.update_status(int(100 * i / len(remaining)),
+                                  "Migrating to version {}: {}".format(migration.version, migration.description))
+                self.mm.bus.fire(EVENT_JOB, job)
+                try:
+                    await self.mm.loop.run_in_executor(None, self._migrate, database, migration)
+                except Exception:
+                    _LOGGER.exception("Migrating the database to version %s failed", migration.version)
+                    job.update_status(job.progress, "Migrating to version {} failed".format(migration.version))
+                    self.mm.bus.fire(EVENT_JOB, job)
+                    return
+        finally:
+            self.__write_queued()
+        job.update_status(100, "Migrated to version {}".format(remaining[-1].version))
+        self.mm.bus.fire(EVENT_JOB, job)
+
+    def __write_queued(self):
+        queued, self.__queued = self.__queued, None
+        if queued:
+            _LOGGER.info("Writing the %s rows queued during the migration", len(queued))
+            for (model, row) in queued:
+                self._flush(model, [row])
+
+    @staticmethod
+    def _migrate(database, migration):
+        # A connection of its own, rather than the writer's, which belongs to the loop's thread.
+        with database.connection_context():
+            migrations.apply(database, migration)
+
+    async def __maintenance_loop(self):
+        while True:
+            await asyncio.sleep(self.__maintenance_interval)
+            try:
+                await self.maintain()
+            except Exception:
+                _LOGGER.exception("Maintenance of the database failed")
+
+    async def maintain(self):
+        """Drops the frames older than the retention, creates the partitions that will be needed next and, on SQLite,
+        checkpoints the WAL into the database and runs PRAGMA optimize.  All from a thread of its own, as a job.
+        """
+        job = motionmonitor.core.Job("Recorder maintenance")
+        job.start()
+        self.mm.bus.fire(EVENT_JOB, job)
+
+        description = await self.mm.loop.run_in_executor(None, self._maintain, models.proxy.obj, datetime.now())
+
+        _LOGGER.debug("Maintenance finished: %s", description)
+        job.update_status(100, description)
+        self.mm.bus.fire(EVENT_JOB, job)
+
+    def _maintain(self, database, now: datetime) -> str:
+        start = time.perf_counter()
+        done = []
+        # A connection of its own, rather than the writer's, which belongs to the loop's thread.
+        with database.connection_context():
+            if self.__retention_days > 0:
+                dropped = partitioner.drop_before(now - timedelta(days=self.__retention_days))
+                done.append("Dropped {} {}".format(dropped, "partitions" if partitioner.partitioned else "frames"))
+            partitioner.prepare(now)
+
+            if isinstance(database, pw.SqliteDatabase):
+                # PASSIVE, so neither the writer nor the readers are waited for; the pages they're using are left for
+                # the next checkpoint.
+                (busy, log, checkpointed) = database.execute_sql("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+                database.execute_sql("PRAGMA optimize")
+                done.append("Checkpointed {} of {} pages".format(checkpointed, log))
+        metrics.RECORDER_MAINTENANCE_SECONDS.observe(time.perf_counter() - start)
+        return ", ".join(done) or "Finished"
+
+    @staticmethod
+    def _flush(model, rows):
+        start = time.perf_counter()
+        for row in rows:
+            partitioner.route(row).save()
+        table = model._meta.table_name
+        metrics.RECORDER_FLUSH_SECONDS.labels(table).observe(time.perf_counter() - start)
+        metrics.RECORDER_FLUSH_ROWS.labels(table).observe(len(rows))
+
+    def __write(self, model, row):
+        if self.__queued is not None:
+            self.__queued.append((model, row))
+            return
+        self._flush(model, [row])
+
     def _handle_motion_start(self, event):
         native_event = event.data
-        _LOGGER.debug("Inserting a motion event: {}".format(native_event))
-        Event.from_native(native_event).save()
+        _LOGGER.debug("Inserting a motion event: %s", native_event)
+        self.__write(Event, Event.from_native(native_event))
 
     def _handle_snapshot_frame(self, event):
         native_frame = event.data
-        _LOGGER.debug("Inserting a snapshot frame: {}".format(native_frame))
-        Frame.from_native(native_frame).save()
+        _LOGGER.debug("Inserting a snapshot frame: %s", native_frame)
+        self.__write(Frame, Frame.from_native(native_frame))
 
     def _handle_motion_frame(self, event):
         native_frame = event.data
-        _LOGGER.debug("Inserting a event frame: {}".format(native_frame))
-        EventFrame.from_native(native_frame).save()
+        _LOGGER.debug("Inserting a event frame: %s", native_frame)
+        self.__write(EventFrame, EventFrame.from_native(native_frame))
 
 
 class APIEventsView:
@@ -72,20 +227,41 @@ class APISnapshotsView(BaseAPIView):
     name = "api:snapshots"
     description = "Lists all snapshot frames in the database.  Recommend filtering by cameraId, dates or pagination " \
                   "is applied."
+    query_schema = SNAPSHOTS_QUERY_SCHEMA
+
+    @staticmethod
+    def _query(start, end):
+        frames = []
+        for model in partitioner.models_for(Frame, start, end):
+            # Only the columns of the (timestamp, camera_id, frame) index, which covers the query, with the timestamps
+            # left as they're stored, to be formatted without a datetime
+            query = model.select(model.camera_id, model.timestamp.coerce(False), model.frame)
+            if start:
+                query = query.where(model.timestamp >= start)
+            if end:
+                query = query.where(model.timestamp <= end)
+            frames.extend(query)
+        return frames
 
     async def get(self, request):
+        self._validate_query(request)
+        (start, end) = [datetime.strptime(request.query[param], "%Y%m%d%H%M%S") if param in request.query else None
+                        for param in ("start", "end")]
+
+        frames = await reader.run("snapshots", self._query, start, end)
+
         response = self.to_entity_repr(request, classes=["snapshots"])
-        for frame in Frame.select():
+        for frame in frames:
             response["entities"].append(APISnapshotFrameView.to_entity_repr(request,
                                                                             classes=["snapshot"],
                                                                             rel=["item"],
                                                                             path_params={
                                                                                 "camera_id": frame.camera_id,
-                                                                                "timestamp": frame.timestamp.strftime(
-                                                                                    "%Y%m%d%H%M%S"),
+                                                                                "timestamp": format_timestamp(
+                                                                                    frame.timestamp),
                                                                                 "frame": frame.frame}))
 
-        return web.Response(text=json.dumps(response), content_type='application/json')
+        return codec.json_response(response)
 
 
 class APISnapshotFrameView(APIImageView):
@@ -93,21 +269,29 @@ class APISnapshotFrameView(APIImageView):
     name = "api:snapshot-frame"
     description = "Returns the snapshot frame for the specified camera_id, timestamp and frame"
 
+    @staticmethod
+    def _query(camera_id, timestamp, frame_num):
+        for model in partitioner.models_for(Frame, timestamp, timestamp):
+            try:
+                return model.get(model.camera_id == camera_id,
+                                 model.timestamp == timestamp,
+                                 model.frame == frame_num)
+            except DoesNotExist:
+                continue
+        return None
+
     async def get(self, request):
         camera_id = request.match_info['camera_id']
         timestamp = datetime.strptime(request.match_info['timestamp'], "%Y%m%d%H%M%S")
         frame_num = request.match_info['frame']
 
-        try:
-            frame = Frame.get(Frame.camera_id == camera_id,
-                              Frame.timestamp == timestamp,
-                              Frame.frame == frame_num)
-        except DoesNotExist:
+        frame = await reader.run("snapshot-frame", self._query, camera_id, timestamp, frame_num)
+        if frame is None:
             raise HTTPBadRequest()
 
         frame_params = {
             "camera_id": frame.camera_id,
-            "timestamp": frame.timestamp.strftime("%Y%m%d%H%M%S"),
+            "timestamp": request.match_info['timestamp'],
             "frame": frame.frame
         }
 
@@ -121,15 +305,17 @@ class APIEventsView(BaseAPIView):
                   "is applied."
 
     async def get(self, request):
+        events = await reader.run("events", list, Event.select(Event.event_id))
+
         response = self.to_entity_repr(request, classes=["events"])
-        for event in Event.select():
+        for event in events:
             response["entities"].append(APIEventEntityView.to_entity_repr(request,
                                                                           classes=["snapshot"],
                                                                           rel=["item"],
                                                                           path_params={
                                                                               "event_id": event.event_id}))
 
-        return web.Response(text=json.dumps(response), content_type='application/json')
+        return codec.json_response(response)
 
 
 class APIEventEntityView(BaseAPIView):
@@ -137,45 +323,61 @@ class APIEventEntityView(BaseAPIView):
     name = "api:event-entity"
     description = "Shows an event in the database."
 
-    async def get(self, request):
-        event_id = request.match_info['event_id']
-
+    @staticmethod
+    def _query(event_id):
+        """Returns the event, its top scoring frame (None if it has no frames) and all of its frames, or None if there's
+        no such event.
+        """
         try:
             event = Event.get(Event.event_id == event_id)
         except DoesNotExist:
+            return None
+
+        frames = []
+        for model in partitioner.models_for(EventFrame, event.start_time):
+            # Only the columns of the (event_id, timestamp, camera_id, frame, score) index, which covers the query
+            frames.extend(model.select(model.camera_id, model.event_id, model.timestamp.coerce(False), model.frame,
+                                       model.score)
+                          .where(model.event_id == event_id).order_by(model.timestamp.asc()))
+        frames.sort(key=lambda frame: frame.timestamp)
+        tsf = max(frames, key=lambda frame: frame.score or 0, default=None)
+        return event, tsf, frames
+
+    async def get(self, request):
+        event_id = request.match_info['event_id']
+
+        result = await reader.run("event-entity", self._query, event_id)
+        if result is None:
             raise HTTPBadRequest()
+        (event, tsf, frames) = result
 
         response = self.to_entity_repr(request, ["event"], path_params={"event_id": event_id})
         response["properties"] = {
             "eventId": event.event_id,
             "cameraId": event.camera_id,
-            "startTime": event.start_time.strftime("%Y%m%d%H%M%S"),
+            "startTime": format_timestamp(event.start_time),
         }
 
-        try:
-            tsf = EventFrame.select().where(EventFrame.event_id == event_id).order_by(EventFrame.score.desc()).limit(1).get()
+        if tsf is not None:
             response["entities"].append(
                 APIEventFrameView.to_link_repr(request,
                                                classes=["frame"],
                                                rel=["http://motion-monitor/rel/top-score-frame"],
                                                path_params={"camera_id": tsf.camera_id,
                                                             "event_id": tsf.event_id,
-                                                            "timestamp": tsf.timestamp.strftime("%Y%m%d%H%M%S"),
+                                                            "timestamp": format_timestamp(tsf.timestamp),
                                                             "frame": tsf.frame}))
 
-            frames = EventFrame.select().where(EventFrame.event_id == event_id).order_by(EventFrame.timestamp.asc())
-            for frame in frames:
-                response["entities"].append(APIEventFrameView.to_link_repr(request,
-                                                                           classes=["frame"],
-                                                                           rel=["http://motion-monitor/rel/frames"],
-                                                                           path_params={"camera_id": frame.camera_id,
-                                                                                        "event_id": frame.event_id,
-                                                                                        "timestamp": frame.timestamp.strftime(
-                                                                                            "%Y%m%d%H%M%S"),
-                                                                                        "frame": frame.frame}))
-        except DoesNotExist:
-            pass
-        return web.Response(text=json.dumps(response), content_type='application/json')
+        for frame in frames:
+            response["entities"].append(APIEventFrameView.to_link_repr(request,
+                                                                       classes=["frame"],
+                                                                       rel=["http://motion-monitor/rel/frames"],
+                                                                       path_params={"camera_id": frame.camera_id,
+                                                                                    "event_id": frame.event_id,
+                                                                                    "timestamp": format_timestamp(
+                                                                                        frame.timestamp),
+                                                                                    "frame": frame.frame}))
+        return codec.json_response(response)
 
     async def delete(self, request):
         raise HTTPNotImplemented()
@@ -186,22 +388,30 @@ class APIEventFrameView(APIImageView):
     name = "api:camera-event-frame"
     description = "Returns a frame from an event as specified by event_id, timestamp and frame"
 
+    @staticmethod
+    def _query(event_id, timestamp, frame_num):
+        for model in partitioner.models_for(EventFrame, timestamp, timestamp):
+            try:
+                return model.select().where(model.event_id == event_id,
+                                            model.timestamp == timestamp,
+                                            model.frame == frame_num).get()
+            except DoesNotExist:
+                continue
+        return None
+
     async def get(self, request):
         event_id = request.match_info['event_id']
         timestamp = datetime.strptime(request.match_info['timestamp'], "%Y%m%d%H%M%S")
         frame_num = request.match_info['frame']
 
-        try:
-            frame = EventFrame.select().where(EventFrame.event_id == event_id,
-                                          EventFrame.timestamp == timestamp,
-                                          EventFrame.frame == frame_num).get()
-        except DoesNotExist:
+        frame = await reader.run("event-frame", self._query, event_id, timestamp, frame_num)
+        if frame is None:
             raise HTTPBadRequest()
 
         frame_params = {
             "camera_id": frame.camera_id,
             "eventId": frame.event_id,
-            "timestamp": frame.timestamp.strftime("%Y%m%d%H%M%S"),
+            "timestamp": request.match_info['timestamp'],
             "score": frame.score,
             "frame": frame.frame
         }
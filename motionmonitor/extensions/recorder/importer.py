@@ -0,0 +1,261 @@
+"""Imports an existing archive of motion's files, beneath TARGET_DIR, into the Recorder's database.  Run as the
+motion-monitor-import command, with motion-monitor stopped, for example:
+
+    motion-monitor-import -c /etc/motion-monitor/motion-monitor.ini
+
+The archive is walked by an ArchiveWalker, a camera's day directory per thread, while the frames it finds are loaded by
+this thread, with insert_many() statements in transactions of many thousands of rows.  The secondary indexes of the
+frame and event tables are dropped before the load, as are those of each partition created during it, and rebuilt once
+it's finished or has failed; the unique indexes are kept, so that rows already in the database are skipped rather than
+duplicated.  Should the import be killed before it can rebuild them, they're rebuilt as the Recorder next starts.
+
+The import can be interrupted and run again: the day directories whose frames have all been committed are recorded in a
+state file, and aren't walked again, while the rows of a directory that was only partly loaded are skipped as
+duplicates.  An event's start time is the earliest of its frames, wherever they were found.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import peewee as pw
+from playhouse.db_url import connect
+
+import motionmonitor.config
+from motionmonitor.archive import ArchiveWalker, FilenameTemplate
+from motionmonitor.extensions.recorder import connect_params, migrations, models
+from motionmonitor.extensions.recorder.models import Event, Frame, EventFrame
+from motionmonitor.extensions.recorder.partitions import partitioner
+from motionmonitor.models import EventFrame as NativeEventFrame
+from motionmonitor.utils import snapshot_keep_tier
+
+_LOGGER = logging.getLogger(__name__)
+
+# The number of directory levels beneath each camera that are named after the date the files were created, as the
+# file_manager's auditor walks them.
+SNAPSHOT_DATE_DEPTH = 4  # YYYY/MM/DD/HH
+MOTION_DATE_DEPTH = 1  # YYYYMMDD
+
+# The columns each model is loaded with, in the order of the rows' values.
+_FRAME_FIELDS = [Frame.camera_id, Frame.timestamp, Frame.frame, Frame.filename, Frame.archive]
+_EVENT_FRAME_FIELDS = [EventFrame.camera_id, EventFrame.event_id, EventFrame.timestamp, EventFrame.frame,
+                       EventFrame.filename, EventFrame.score]
+_EVENT_FIELDS = [Event.event_id, Event.camera_id, Event.start_time]
+
+
+def _rows_per_statement(database, fields: list) -> int:
+    # SQLite compiled before 3.32 allows no more than 999 parameters in a statement
+    if isinstance(database, pw.SqliteDatabase):
+        return 999 // len(fields)
+    return 1000
+
+
+def _secondary_indexes(model) -> [tuple]:
+    """The columns of each of the model's indexes that aren't unique, and so aren't needed to skip duplicates."""
+    return [columns for (columns, unique) in model._meta.indexes if not unique]
+
+
+class Importer:
+    def __init__(self, database, target_dir: str, snapshot_template: FilenameTemplate,
+                 motion_template: FilenameTemplate, state_file: str, workers=8, transaction_rows=100000,
+                 drop_indexes=True):
+        self.database = database
+        self.target_dir = target_dir
+        self.snapshot_template = snapshot_template
+        self.motion_template = motion_template
+        self.state_file = state_file
+        self.workers = workers
+        self.transaction_rows = transaction_rows
+        self.drop_indexes = drop_indexes
+
+        self.__state = {}
+        # The rows waiting for the next transaction, by the model of the table they're loaded into
+        self.__rows = {}
+        self.__pending_rows = 0
+        # The earliest frame of each event that has been loaded, by its (event_id, camera_id), and those changed since
+        # the last transaction
+        self.__events = {}
+        self.__changed_events = set()
+        # The subtrees whose frames are all in the pending rows
+        self.__walked = []
+        # The tables whose secondary indexes have been dropped
+        self.__unindexed = set()
+        self.loaded = 0
+
+    def run(self):
+        """Imports the motion frames, along with their events, then the snapshot frames, then rebuilds the indexes."""
+        start = time.perf_counter()
+        self.__state = self.__load_state()
+        self.__state.setdefault("done", {})
+        if self.drop_indexes:
+            for model in (Frame, EventFrame, Event):
+                for table_model in partitioner.models_for(model):
+                    self.__drop_secondary_indexes(table_model)
+
+        try:
+            self.__import("motion", self.motion_template, MOTION_DATE_DEPTH, self.__add_motion_frames)
+            self.__import("snapshots", self.snapshot_template, SNAPSHOT_DATE_DEPTH, self.__add_snapshot_frames)
+        finally:
+            if self.drop_indexes:
+                _LOGGER.info("Rebuilding the indexes")
+                migrations.restore_indexes(self.database)
+        _LOGGER.info("Imported %s frames in %.0fs", self.loaded, time.perf_counter() - start)
+
+    def __import(self, kind: str, template: FilenameTemplate, date_depth: int, add):
+        done = self.__state["done"].setdefault(kind, [])
+        walker = ArchiveWalker(self.target_dir, template, date_depth, workers=self.workers, batch_size=1000,
+                               skip=set(done), on_done=self.__walked.append)
+        _LOGGER.info("Importing the %s frames, %s directories were imported before", kind, len(done))
+        for frames in walker.walk():
+            add(frames)
+            if self.__pending_rows >= self.transaction_rows:
+                self.__commit(done)
+        self.__commit(done)
+
+    def __add(self, model, row: tuple):
+        table_model = partitioner.model_for(model, row[1] if model is Frame else row[2])
+        rows = self.__rows.get(table_model)
+        if rows is None:
+            rows = self.__rows[table_model] = []
+            if self.drop_indexes and table_model not in self.__unindexed:
+                # A partition created for these rows
+                self.__drop_secondary_indexes(table_model)
+        rows.append(row)
+        self.__pending_rows += 1
+
+    def __add_snapshot_frames(self, frames):
+        for frame in frames:
+            self.__add(Frame, (frame.camera_id, frame.timestamp, frame.frame_num, frame.filename,
+                               snapshot_keep_tier(frame.timestamp)))
+
+    def __add_motion_frames(self, frames):
+        for frame in frames:
+            if not isinstance(frame, NativeEventFrame):
+                _LOGGER.warning("Skipping %s, it has no event", frame.filename)
+                continue
+            self.__add(EventFrame, (frame.camera_id, frame.event_id, frame.timestamp, frame.frame_num,
+                                    frame.filename, frame.score))
+
+            key = (frame.event_id, int(frame.camera_id))
+            start_time = self.__events.get(key)
+            if start_time is None or frame.timestamp < start_time:
+                self.__events[key] = frame.timestamp
+                self.__changed_events.add(key)
+
+    def __commit(self, done: list):
+        if not self.__pending_rows and not self.__walked:
+            return
+        start = time.perf_counter()
+        with self.database.atomic():
+            for (table_model, rows) in self.__rows.items():
+                fields = [getattr(table_model, field.name) for field in
+                          (_FRAME_FIELDS if issubclass(table_model, Frame) else _EVENT_FRAME_FIELDS)]
+                for chunk in pw.chunked(rows, _rows_per_statement(self.database, fields)):
+                    table_model.insert_many(chunk, fields=fields).on_conflict_ignore().execute()
+            self.__save_events()
+        self.loaded += self.__pending_rows
+        _LOGGER.info("Loaded %s frames in %.1fs, %s in all", self.__pending_rows, time.perf_counter() - start,
+                     self.loaded)
+
+        # Only now are the walked subtrees' frames all in the database
+        done.extend(self.__walked)
+        self.__save_state()
+        self.__rows = {}
+        self.__pending_rows = 0
+        # Cleared in place, as the walker appends to it
+        self.__walked.clear()
+
+    def __save_events(self):
+        if not self.__changed_events:
+            return
+        rows = [(event_id, camera_id, self.__events[(event_id, camera_id)])
+                for (event_id, camera_id) in self.__changed_events]
+        for chunk in pw.chunked(rows, _rows_per_statement(self.database, _EVENT_FIELDS)):
+            Event.insert_many(chunk, fields=_EVENT_FIELDS).on_conflict_ignore().execute()
+        # An event found before, in another directory or by the Recorder, may have started later than its frames here
+        for (event_id, camera_id) in self.__changed_events:
+            start_time = self.__events[(event_id, camera_id)]
+            Event.update(start_time=start_time).where(Event.event_id == event_id, Event.camera_id == camera_id,
+                                                      Event.start_time > start_time).execute()
+        self.__changed_events = set()
+
+    def __drop_secondary_indexes(self, table_model):
+        self.__unindexed.add(table_model)
+        table = table_model._meta.table_name
+        secondary = [list(columns) for columns in _secondary_indexes(table_model)]
+        for index in self.database.get_indexes(table):
+            if index.columns in secondary:
+                migrations.drop_index_named(self.database, table, index.name)
+
+    def __load_state(self) -> dict:
+        try:
+            with open(self.state_file) as state_file:
+                return json.load(state_file)
+        except FileNotFoundError:
+            return {}
+
+    def __save_state(self):
+        state_dir = os.path.dirname(self.state_file)
+        if state_dir and not os.path.exists(state_dir):
+            os.makedirs(state_dir)
+
+        # Write to a temporary file first so a failed write can't lose the previous state.
+        temp_file = self.state_file + ".tmp"
+        with open(temp_file, "w") as state_file:
+            json.dump(self.__state, state_file)
+        os.replace(temp_file, self.state_file)
+
+
+def __parse_args(argv):
+    parser = argparse.ArgumentParser(description="Import an archive of motion's files into the Recorder's database. "
+                                                 "Stop motion-monitor first.")
+    parser.add_argument("-c", "--config", type=str, dest="config_file",
+                        help="The config file to read, for TARGET_DIR, the filename templates and the Recorder's URL.")
+    parser.add_argument("--state", type=str,
+                        help="The file that records the progress of the import, so that it can be resumed, "
+                             "overriding IMPORT_STATE in the config.")
+    parser.add_argument("--restart", action="store_true", help="Forget the progress of a previous import.")
+    parser.add_argument("--workers", type=int, help="The threads that walk the archive, overriding IMPORT_WORKERS.")
+    parser.add_argument("--transaction-rows", type=int, default=100000,
+                        help="The frames loaded in each transaction.")
+    parser.add_argument("--keep-indexes", action="store_true",
+                        help="Load with the secondary indexes in place, rather than dropping and rebuilding them.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = __parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    config = motionmonitor.config.ConfigReader().read_config(args.config_file)
+    recorder_config = config["RECORDER"]
+
+    url = recorder_config.get("URL")
+    if not url:
+        _LOGGER.error("There's no database to import into, set URL in the RECORDER section")
+        return 1
+    state_file = args.state or recorder_config.get("IMPORT_STATE", "recorder-import.json")
+    if args.restart and os.path.exists(state_file):
+        os.remove(state_file)
+
+    database = connect(url, **connect_params(url, recorder_config))
+    models.proxy.initialize(database)
+    migrations.setup(database, recorder_config, background=False)
+
+    importer = Importer(database, config["GENERAL"]["TARGET_DIR"],
+                        FilenameTemplate(config["GENERAL"]["SNAPSHOT_FILENAME"]),
+                        FilenameTemplate(config["GENERAL"]["MOTION_FILENAME"]),
+                        state_file,
+                        workers=args.workers or int(recorder_config.get("IMPORT_WORKERS", "8")),
+                        transaction_rows=args.transaction_rows,
+                        drop_indexes=not args.keep_indexes)
+    try:
+        importer.run()
+    finally:
+        database.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
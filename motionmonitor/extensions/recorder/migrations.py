@@ -0,0 +1,180 @@
+"""Brings the schema of an existing database up to models.SCHEMA_VERSION, as the Recorder starts.
+
+The versions applied are recorded in the schema_version table; a database without one has the schema of version 1,
+unless it has no tables at all, in which case it's created at the current version.  Each migration is applied to the
+single tables and to each of their partitions (see motionmonitor.extensions.recorder.partitions).
+
+The migrations are applied in order.  Those that only build or drop indexes can run in the background, once the
+Recorder has started: migrate() applies the migrations up to the first of those, and the rest, which have to follow
+it, are left to apply() from a thread of their own.  On SQLite an index build holds the write lock, which covers the
+whole database, until it has finished, so the Recorder queues the rows it's given meanwhile and writes them once the
+migrations are done; MySQL builds indexes online.  Migrations that rewrite rows do so with update_in_batches(), so a
+writer waiting on the lock never waits for more than a batch.  Every migration is
+written so that it can be applied again, in case it was interrupted.
+"""
+import collections
+import logging
+import time
+from datetime import datetime
+
+import peewee as pw
+
+from motionmonitor.extensions.recorder import models
+from motionmonitor.extensions.recorder.models import SchemaVersion, Event, Frame, EventFrame
+from motionmonitor.extensions.recorder.partitions import partitioner
+
+_LOGGER = logging.getLogger(__name__)
+
+# The rows of each batch of update_in_batches(), and the seconds it pauses between them for the writer.
+BATCH_SIZE = 5000
+BATCH_PAUSE = 0.05
+
+Migration = collections.namedtuple("Migration", ["version", "description", "function", "background"])
+
+
+def _quote(database, name: str) -> str:
+    return database.get_sql_context().sql(pw.Entity(name)).query()[0]
+
+
+def add_index(database, model, columns, unique=False):
+    """Adds an index of the columns to the table of the model, and each of its partitions, unless it already has one."""
+    for table_model in partitioner.models_for(model):
+        indexed = [index.columns for index in database.get_indexes(table_model._meta.table_name)]
+        if list(columns) in indexed:
+            continue
+        _LOGGER.info("Indexing %s of %s", ", ".join(columns), table_model._meta.table_name)
+        database.execute(pw.ModelIndex(table_model, [getattr(table_model, column) for column in columns],
+                                       unique=unique, safe=False))
+
+
+def drop_index_named(database, table: str, name: str):
+    _LOGGER.info("Dropping the index %s of %s", name, table)
+    if isinstance(database, pw.MySQLDatabase):
+        database.execute_sql("DROP INDEX {} ON {}".format(_quote(database, name), _quote(database, table)))
+    else:
+        database.execute_sql("DROP INDEX {}".format(_quote(database, name)))
+
+
+def drop_index(database, model, columns):
+    """Drops the index of exactly the columns from the table of the model, and each of its partitions."""
+    for table_model in partitioner.models_for(model):
+        table = table_model._meta.table_name
+        for index in database.get_indexes(table):
+            if index.columns != list(columns):
+                continue
+            drop_index_named(database, table, index.name)
+
+
+def restore_indexes(database):
+    """Adds any of the models' indexes that their tables, or partitions, are missing, such as those dropped by an import
+    that was interrupted (see motionmonitor.extensions.recorder.importer).
+    """
+    for model in (Event, Frame, EventFrame):
+        for (columns, unique) in model._meta.indexes:
+            add_index(database, model, columns, unique)
+
+
+def update_in_batches(database, model, update: dict, where, batch_size=BATCH_SIZE, pause=BATCH_PAUSE) -> int:
+    """Applies the update to the rows of the model's table that match where, batch_size rows at a time, each batch in a
+    transaction of its own followed by a pause, returning the rows updated.  The update must make the rows stop
+    matching where, so that each batch moves on, and an interrupted update can be picked up again.  Only SQLite is
+    updated in batches, by the rowid; other databases are updated in a single statement.
+    """
+    if not isinstance(database, pw.SqliteDatabase):
+        return model.update(update).where(where).execute()
+
+    total = 0
+    rowid = pw.SQL("rowid")
+    while True:
+        with database.atomic():
+            batch = model.select(rowid).where(where).limit(batch_size)
+            updated = model.update(update).where(rowid.in_(batch)).execute()
+        total += updated
+        if updated < batch_size:
+            return total
+        _LOGGER.debug("Updated %s rows of %s", total, model._meta.table_name)
+        time.sleep(pause)
+
+
+def _index_lookups(database):
+    add_index(database, Frame, ("timestamp", "camera_id", "frame"))
+    drop_index(database, Frame, ("timestamp", "camera_id"))
+    add_index(database, EventFrame, ("event_id", "timestamp", "camera_id", "frame", "score"))
+    drop_index(database, EventFrame, ("event_id",))
+
+
+# The migrations, in order, each as the version it brings the schema to, a description, the function that applies it to
+# a database and whether it can run in the background.  The last version is models.SCHEMA_VERSION.
+MIGRATIONS = [
+    Migration(2, "Index each of the API's lookups", _index_lookups, True),
+]
+
+
+def stored_timestamps(database):
+    """How the timestamps of an existing database are stored, as models.TIMESTAMPS_DATETIME or TIMESTAMPS_EPOCH, or
+    None if it has no frames table yet.
+    """
+    if not Frame.table_exists():
+        return None
+    for column in database.get_columns(Frame._meta.table_name):
+        if column.name == "timestamp":
+            return models.TIMESTAMPS_EPOCH if "INT" in column.data_type.upper() else models.TIMESTAMPS_DATETIME
+    return None
+
+
+def schema_version(database) -> int:
+    """The version of the database's schema, 0 if it has no tables at all."""
+    if SchemaVersion.table_exists():
+        return SchemaVersion.select(pw.fn.MAX(SchemaVersion.version)).scalar() or 1
+    return 1 if database.get_tables() else 0
+
+
+def apply(database, migration: Migration):
+    _LOGGER.info("Migrating the database to version %s: %s", migration.version, migration.description)
+    start = time.perf_counter()
+    migration.function(database)
+    SchemaVersion.create(version=migration.version, applied=datetime.now())
+    _LOGGER.info("Migrated the database to version %s in %.1fs", migration.version, time.perf_counter() - start)
+
+
+def migrate(database, version: int, background=True) -> [Migration]:
+    """Applies the migrations that a database of the version needs, once any missing tables have been created, up to
+    the first that can run in the background.  Returns the migrations that remain, to be passed to apply() in order.
+    """
+    SchemaVersion.create_table(safe=True)
+    if version == 0:
+        # Created by create_tables() at the current version
+        SchemaVersion.create(version=models.SCHEMA_VERSION, applied=datetime.now())
+        return []
+
+    pending = [migration for migration in MIGRATIONS if migration.version > version]
+    while pending and not (background and pending[0].background):
+        apply(database, pending.pop(0))
+    return pending
+
+
+def setup(database, config, background=True) -> [Migration]:
+    """Creates the missing tables of a database that the models have been initialised with, partitions them and
+    migrates them, as configured by the RECORDER section of the config.  Returns the migrations left to the background,
+    as migrate() does.
+    """
+    version = schema_version(database)
+    # The timestamps of a database are stored as it was created
+    storage = config.get("TIMESTAMPS", models.TIMESTAMPS_DATETIME).lower()
+    stored = stored_timestamps(database)
+    if stored is not None and stored != storage:
+        _LOGGER.warning("The database stores its timestamps as %s rather than %s, which only applies to new "
+                        "databases", stored, storage)
+        storage = stored
+    models.set_timestamp_storage(storage)
+
+    # Only the missing tables, as the indexes of those that exist are left to the migrations
+    database.create_tables([model for model in (Event, Frame, EventFrame) if not model.table_exists()])
+    partitioner.configure(database, config.get("PARTITION_PERIOD", "").lower(),
+                          convert_existing=config.get("PARTITION_EXISTING", "false").lower() == "true")
+    remaining = migrate(database, version, background=background)
+    if not remaining:
+        # Once the schema is current, only an import can have left the tables without their indexes
+        restore_indexes(database)
+    partitioner.prepare(datetime.now())
+    return remaining
@@ -1,20 +1,98 @@
+import calendar
+import functools
 import logging
+import time
+from datetime import datetime, timedelta
 
 import peewee as pw
 
 import motionmonitor
+from motionmonitor.utils import snapshot_keep_tier
 
 proxy = pw.DatabaseProxy()
 
-SCHEMA_VERSION = 1
+# The version of the schema that the models describe; see motionmonitor.extensions.recorder.migrations.
+SCHEMA_VERSION = 2
 _LOGGER = logging.getLogger(__name__)
 
 
+TIMESTAMPS_DATETIME = "datetime"
+TIMESTAMPS_EPOCH = "epoch"
+TIMESTAMP_STORAGES = (TIMESTAMPS_DATETIME, TIMESTAMPS_EPOCH)
+
+_EPOCH = datetime(1970, 1, 1)
+_API_FORMAT = "%Y%m%d%H%M%S"
+# Deletes the separators from a timestamp as SQLite stores a DATETIME, 2020-06-01 12:00:00, to give 20200601120000.
+_DATETIME_SEPARATORS = str.maketrans("", "", "- :")
+
+
+class TimestampField(pw.DateTimeField):
+    """A naive datetime, stored either as a DATETIME or as an integer number of seconds since the epoch, which is
+    smaller, in the rows and their indexes, and needs no parsing.  The seconds are those of the wall-clock time read as
+    though it were UTC, so that every timestamp round trips, even in the hour repeated as the clocks go back.  Either
+    is read back as a datetime.  The storage is chosen for every table at once, with set_timestamp_storage().
+    """
+    epoch = False
+
+    @property
+    def field_type(self):
+        return "BIGINT" if TimestampField.epoch else "DATETIME"
+
+    def db_value(self, value):
+        if TimestampField.epoch and isinstance(value, datetime):
+            return calendar.timegm(value.timetuple())
+        return super().db_value(value)
+
+    def python_value(self, value):
+        if isinstance(value, int):
+            return _EPOCH + timedelta(seconds=value)
+        return super().python_value(value)
+
+
+def set_timestamp_storage(storage: str):
+    """Stores the timestamps of every model as DATETIMEs or as integer seconds since the epoch (see TimestampField)."""
+    if storage not in TIMESTAMP_STORAGES:
+        raise ValueError("Unknown timestamp storage: {}".format(storage))
+    TimestampField.epoch = storage == TIMESTAMPS_EPOCH
+
+
+def timestamp_storage() -> str:
+    return TIMESTAMPS_EPOCH if TimestampField.epoch else TIMESTAMPS_DATETIME
+
+
+@functools.lru_cache(maxsize=4096)
+def _format_epoch(seconds: int) -> str:
+    # Cached, as the frames of a second, and of a camera's event, share their timestamps.
+    return time.strftime(_API_FORMAT, time.gmtime(seconds))
+
+
+def format_timestamp(value) -> str:
+    """Formats a timestamp for the API, as 20200601120000, from either a datetime or the value of a TimestampField
+    selected without its conversion to a datetime (as field.coerce(False)): integer seconds, SQLite's text, or a
+    datetime from the drivers that convert DATETIMEs themselves.
+    """
+    if isinstance(value, int):
+        return _format_epoch(value)
+    if isinstance(value, str):
+        return value[:19].translate(_DATETIME_SEPARATORS)
+    return value.strftime(_API_FORMAT)
+
+
 class BaseModel(pw.Model):
     class Meta:
         database = proxy
 
 
+class SchemaVersion(BaseModel):
+    # schema_version: a row for each version of the schema that has been applied to the database.
+
+    version = pw.IntegerField(primary_key=True)
+    applied = pw.DateTimeField()
+
+    class Meta:
+        table_name = 'schema_version'
+
+
 class Event(BaseModel):
     # motion_event:
     # +------------+-------------+------+-----+---------+-------+
@@ -27,7 +105,7 @@ class Event(BaseModel):
 
     camera_id = pw.IntegerField()
     event_id = pw.CharField()
-    start_time = pw.DateTimeField()
+    start_time = TimestampField()
 
     class Meta:
         table_name = 'motion_event'
@@ -58,11 +136,13 @@ class Frame(BaseModel):
     # | timestamp | datetime     | NO   | MUL | NULL    |       |
     # | frame     | int(11)      | YES  |     | NULL    |       |
     # | filename  | varchar(100) | YES  | UNI | NULL    |       |
-    # | archive   | tinyint(1)   | YES  |     | NULL    |       |
+    # | archive   | tinyint(1)   | YES  | MUL | NULL    |       |
     # +-----------+--------------+------+-----+---------+-------+
+    #
+    # The archive column holds the retention tier of the frame (see motionmonitor.const.KEEP_TIER_*).
 
     camera_id = pw.IntegerField()
-    timestamp = pw.DateTimeField()
+    timestamp = TimestampField()
     frame = pw.IntegerField(null=True)
     filename = pw.CharField(null=True, unique=True)
     archive = pw.IntegerField(null=True)
@@ -70,7 +150,9 @@ class Frame(BaseModel):
     class Meta:
         table_name = 'snapshot_frame'
         indexes = (
-            (('timestamp', 'camera_id'), False),
+            # Covers the listing of the frames in a range of time, and serves a frame's lookup by all three
+            (('timestamp', 'camera_id', 'frame'), False),
+            (('archive', 'timestamp'), False),
         )
         primary_key = False
 
@@ -80,7 +162,7 @@ class Frame(BaseModel):
                      timestamp=frame.timestamp,
                      frame=frame.frame_num,
                      filename=frame.filename,
-                     archive=0)
+                     archive=snapshot_keep_tier(frame.timestamp))
 
     def to_native(self) -> motionmonitor.models.Frame:
         return motionmonitor.models.Frame(self.camera_id,
@@ -103,16 +185,18 @@ class EventFrame(BaseModel):
     # +-----------+--------------+------+-----+---------+-------+
 
     camera_id = pw.IntegerField()
-    event_id = pw.CharField(index=True)
+    event_id = pw.CharField()
     filename = pw.CharField(null=True)
     frame = pw.IntegerField(null=True)
     score = pw.IntegerField(null=True)
-    timestamp = pw.DateTimeField()
+    timestamp = TimestampField()
 
     class Meta:
         table_name = 'motion_frame'
         indexes = (
             (('event_id', 'camera_id', 'timestamp', 'frame'), True),
+            # Covers the listing of an event's frames in order, with their scores, and a frame's lookup
+            (('event_id', 'timestamp', 'camera_id', 'frame', 'score'), False),
         )
         primary_key = False
 
@@ -0,0 +1,235 @@
+"""Partitions the frame tables by the day or the week of their frames, so that old frames are dropped a partition at a
+time rather than deleted row by row, and a query for a range of time only reads the partitions that overlap it.
+
+On SQLite each period is a table of its own, named after the table and the first day of the period, such as
+snapshot_frame_20200601, with a model created for it on demand.  On MySQL the tables use native RANGE partitions, named
+such as p20200601, that the optimizer prunes itself; MySQL requires the partitioning column in every unique key, so the
+unique key of snapshot_frame is widened to (filename, timestamp).  Other databases, and an empty period, keep a single
+table, which retention deletes from.  The single SQLite tables are kept alongside the partitions, for the rows written
+before the tables were partitioned, and are read and deleted from as before.
+
+Partitioning an existing MySQL table rebuilds it, copying every row while writes to it wait, which can take hours for a
+table of many millions of frames.  So tables that already hold rows are only partitioned when that is asked for
+explicitly, with convert_existing, and should be while recording is stopped; empty tables are partitioned straight away.
+"""
+import calendar
+import logging
+import re
+import threading
+from datetime import date, datetime, timedelta
+
+import peewee as pw
+
+from motionmonitor.extensions.recorder.models import Frame, EventFrame, TimestampField
+
+_LOGGER = logging.getLogger(__name__)
+
+PERIOD_NONE = ""
+PERIOD_DAY = "day"
+PERIOD_WEEK = "week"
+PERIODS = (PERIOD_NONE, PERIOD_DAY, PERIOD_WEEK)
+
+# The models that are partitioned, each by its timestamp.
+PARTITIONED = (Frame, EventFrame)
+
+_SUFFIX_FORMAT = "%Y%m%d"
+
+
+def period_start(timestamp, period: str) -> date:
+    """The first day of the period that the timestamp falls in."""
+    day = timestamp.date() if isinstance(timestamp, datetime) else timestamp
+    if period == PERIOD_WEEK:
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def period_end(start: date, period: str) -> date:
+    """The first day after the period that starts on the given day."""
+    return start + timedelta(days=7 if period == PERIOD_WEEK else 1)
+
+
+class Partitioner:
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.configure(None, PERIOD_NONE)
+
+    def configure(self, database, period: str, convert_existing=False):
+        """Partitions the tables of the database by the period, finding the partitions that already exist.  MySQL tables
+        that hold rows, but aren't partitioned yet, are only partitioned with convert_existing.
+        """
+        if period not in PERIODS:
+            raise ValueError("Unknown partition period: {}".format(period))
+        self.database = database
+        self.period = period
+        self.native = period != PERIOD_NONE and isinstance(database, pw.MySQLDatabase)
+        self.tables = period != PERIOD_NONE and isinstance(database, pw.SqliteDatabase)
+        # The partitions of each model, by the first day of their period.  On SQLite these are the models of the
+        # partitions' tables, on MySQL the names of the native partitions.
+        self.__partitions = {model: {} for model in PARTITIONED}
+
+        if period != PERIOD_NONE and not (self.native or self.tables):
+            _LOGGER.warning("Partitions aren't supported by %s, keeping single tables", type(database).__name__)
+        if self.tables:
+            self.__find_tables()
+        elif self.native:
+            self.native = self.__partition_natively(convert_existing)
+
+    @property
+    def partitioned(self) -> bool:
+        return self.native or self.tables
+
+    def partitions(self, model) -> [date]:
+        """The first days of the periods of the model's partitions, oldest first."""
+        with self.__lock:
+            return sorted(self.__partitions.get(model, {}))
+
+    def route(self, row):
+        """The row itself, or a copy of it for the partition that it's written to."""
+        model = type(row)
+        if not self.tables or model not in PARTITIONED:
+            return row
+        return self.model_for(model, row.timestamp)(**row.__data__)
+
+    def model_for(self, model, timestamp: datetime):
+        """The model that a row of the model with the timestamp is written to, creating its partition if need be."""
+        if not self.tables or model not in PARTITIONED:
+            return model
+        start = period_start(timestamp, self.period)
+        partition = self.__partitions[model].get(start)
+        if partition is None:
+            partition = self.__create_table(model, start)
+        return partition
+
+    def models_for(self, model, start: datetime = None, end: datetime = None) -> list:
+        """The models to query for the rows of the model between start and end, either of which may be None for no
+        bound: the single table, followed by the partitions that exist, oldest first.
+        """
+        if not self.tables or model not in PARTITIONED:
+            return [model]
+        first = period_start(start, self.period) if start else None
+        last = period_start(end, self.period) if end else None
+        with self.__lock:
+            return [model] + [partition for (day, partition) in sorted(self.__partitions[model].items())
+                              if (first is None or day >= first) and (last is None or day <= last)]
+
+    def prepare(self, now: datetime):
+        """Creates the partitions of the current and the next period ahead of their first rows."""
+        if not self.partitioned:
+            return
+        current = period_start(now, self.period)
+        for start in (current, period_end(current, self.period)):
+            for model in PARTITIONED:
+                if start in self.__partitions[model]:
+                    continue
+                if self.tables:
+                    self.__create_table(model, start)
+                else:
+                    self.__add_native_partition(model, start)
+
+    def drop_before(self, cutoff: datetime) -> int:
+        """Drops the rows older than the cutoff, a whole partition at a time when partitioned, in which case the
+        partition that the cutoff falls in is kept.  Returns the partitions dropped, or the rows deleted if not.
+        """
+        if not self.partitioned:
+            return sum(model.delete().where(model.timestamp < cutoff).execute() for model in PARTITIONED)
+
+        dropped = 0
+        if self.tables:
+            for model in PARTITIONED:
+                model.delete().where(model.timestamp < cutoff).execute()
+        for model in PARTITIONED:
+            for start in self.partitions(model):
+                if period_end(start, self.period) > cutoff.date():
+                    break
+                if self.tables:
+                    self.__partitions[model][start].drop_table(safe=True)
+                else:
+                    self.database.execute_sql("ALTER TABLE `{}` DROP PARTITION {}".format(
+                        model._meta.table_name, self.__partitions[model][start]))
+                with self.__lock:
+                    del self.__partitions[model][start]
+                _LOGGER.info("Dropped the %s partition of %s", start, model._meta.table_name)
+                dropped += 1
+        return dropped
+
+    @staticmethod
+    def __table_model(model, start: date):
+        suffix = start.strftime(_SUFFIX_FORMAT)
+
+        class Meta:
+            table_name = "{}_{}".format(model._meta.table_name, suffix)
+
+        return type("{}_{}".format(model.__name__, suffix), (model,), {"Meta": Meta, "__module__": model.__module__})
+
+    def __create_table(self, model, start: date):
+        partition = self.__table_model(model, start)
+        partition.create_table(safe=True)
+        with self.__lock:
+            # Another thread may have created it first, in which case its model is kept.
+            partition = self.__partitions[model].setdefault(start, partition)
+        _LOGGER.debug("Created the partition %s", partition._meta.table_name)
+        return partition
+
+    def __find_tables(self):
+        for model in PARTITIONED:
+            pattern = re.compile(r"^{}_([0-9]{{8}})$".format(re.escape(model._meta.table_name)))
+            for table in self.database.get_tables():
+                match = pattern.match(table)
+                if match:
+                    start = datetime.strptime(match.group(1), _SUFFIX_FORMAT).date()
+                    self.__partitions[model][start] = self.__table_model(model, start)
+
+    def __partition_natively(self, convert_existing: bool) -> bool:
+        """Partitions the tables that aren't yet, unless one holds rows and convert_existing isn't set, in which case
+        none are and False is returned.
+        """
+        existing = {}
+        for model in PARTITIONED:
+            cursor = self.database.execute_sql(
+                "SELECT PARTITION_NAME FROM information_schema.PARTITIONS WHERE TABLE_SCHEMA = DATABASE() AND "
+                "TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL", (model._meta.table_name,))
+            existing[model] = [row[0] for row in cursor.fetchall()]
+
+        if not convert_existing:
+            unconverted = [model._meta.table_name for model in PARTITIONED if not existing[model] and
+                           self.database.execute_sql("SELECT 1 FROM `{}` LIMIT 1".format(
+                               model._meta.table_name)).fetchone() is not None]
+            if unconverted:
+                _LOGGER.warning("Not partitioning %s, as rebuilding a table that holds rows blocks writes to it until "
+                                "it's finished; set PARTITION_EXISTING to do so, keeping single tables",
+                                ", ".join(unconverted))
+                return False
+
+        for model in PARTITIONED:
+            table = model._meta.table_name
+            names = existing[model]
+            if not names:
+                _LOGGER.info("Partitioning %s by %s", table, self.period)
+                if model is Frame:
+                    self.database.execute_sql(
+                        "ALTER TABLE `{0}` DROP INDEX `frame_filename`, "
+                        "ADD UNIQUE INDEX `frame_filename_timestamp` (`filename`, `timestamp`)".format(table))
+                expression = "`timestamp`" if TimestampField.epoch else "TO_DAYS(`timestamp`)"
+                self.database.execute_sql("ALTER TABLE `{}` PARTITION BY RANGE ({}) "
+                                          "(PARTITION pmax VALUES LESS THAN MAXVALUE)".format(table, expression))
+                names = ["pmax"]
+            for name in names:
+                if name != "pmax":
+                    self.__partitions[model][datetime.strptime(name[1:], _SUFFIX_FORMAT).date()] = name
+        return True
+
+    def __add_native_partition(self, model, start: date):
+        # Periods are only ever added after the newest, so are split off the catch-all pmax partition.
+        name = "p" + start.strftime(_SUFFIX_FORMAT)
+        end = period_end(start, self.period)
+        # Integer timestamps are partitioned by their seconds, DATETIMEs by their days
+        bound = calendar.timegm(end.timetuple()) if TimestampField.epoch else "TO_DAYS('{}')".format(end.isoformat())
+        self.database.execute_sql(
+            "ALTER TABLE `{}` REORGANIZE PARTITION pmax INTO (PARTITION {} VALUES LESS THAN ({}), "
+            "PARTITION pmax VALUES LESS THAN MAXVALUE)".format(model._meta.table_name, name, bound))
+        with self.__lock:
+            self.__partitions[model][start] = name
+
+
+# Shared by the Recorder, which configures it, and its views.
+partitioner = Partitioner()
@@ -0,0 +1,128 @@
+"""Runs the Recorder's read queries on a pool of threads, so that a slow query holds up only the request that made it,
+rather than the loop that ingests motion's messages and serves every other request.
+
+Each thread of the pool opens its own connection to the database, the first time it is used, and makes it read only;
+with a SQLite database in WAL mode, these readers and the writer don't block each other.  The queries in flight,
+running or waiting for a thread, are limited; a request over the limit is refused with a 503 rather than queued, and
+one whose query takes longer than the timeout is answered with a 504.  A query that has timed out can't be stopped,
+so it counts towards the limit until it finishes.
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import peewee as pw
+from aiohttp.web_exceptions import HTTPGatewayTimeout, HTTPServiceUnavailable
+
+from motionmonitor import metrics
+from motionmonitor.extensions.recorder import models
+
+_LOGGER = logging.getLogger(__name__)
+
+# The statement that makes a connection read only, for each kind of database.
+_READ_ONLY = (
+    (pw.SqliteDatabase, "PRAGMA query_only = 1"),
+    (pw.MySQLDatabase, "SET SESSION TRANSACTION READ ONLY"),
+    (pw.PostgresqlDatabase, "SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY"),
+)
+
+
+def is_in_memory(database) -> bool:
+    """Whether the database is an in-memory SQLite database, which only the connection that created it can see."""
+    if not isinstance(database, pw.SqliteDatabase):
+        return False
+    name = database.database
+    return name in (":memory:", "") or "mode=memory" in name or name.startswith("file::memory:")
+
+
+class DatabaseReader:
+    def __init__(self, workers=4, limit=16, timeout=10.0):
+        self.__executor = None
+        self.__lock = threading.Lock()
+        self.__in_flight = 0
+        # The futures of the queries in flight, so that close() can cancel those still waiting for a thread
+        self.__futures = set()
+        self.configure(workers, limit, timeout)
+        metrics.RECORDER_QUERIES_IN_FLIGHT.set_function(lambda: self.__in_flight)
+
+    @property
+    def in_flight(self) -> int:
+        return self.__in_flight
+
+    def configure(self, workers: int, limit: int, timeout: float):
+        """Sets the number of threads, the limit on the queries in flight and the seconds each may take."""
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False)
+        self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="recorder-db")
+        self.workers = workers
+        self.limit = limit
+        self.timeout = timeout
+
+    def close(self):
+        # Rather than shutdown(cancel_futures=True), which needs Python 3.9
+        with self.__lock:
+            futures = list(self.__futures)
+        for future in futures:
+            future.cancel()
+        self.__executor.shutdown(wait=False)
+
+    async def run(self, name: str, function, *args):
+        """Returns the result of calling function(*args), from a thread of the pool.  Raises HTTPServiceUnavailable if
+        too many queries are already in flight, or HTTPGatewayTimeout if the query takes too long.
+        """
+        if is_in_memory(models.proxy.obj):
+            # Another thread would see a different, empty, database.
+            return self.__timed(name, function, *args)
+
+        with self.__lock:
+            if self.__in_flight >= self.limit:
+                metrics.RECORDER_QUERIES_REJECTED.labels("overloaded").inc()
+                _LOGGER.warning("Refusing a %s query, %s are already in flight", name, self.__in_flight)
+                raise HTTPServiceUnavailable(text="Too many database queries are in flight",
+                                             headers={"Retry-After": "1"})
+            self.__in_flight += 1
+
+        future = self.__executor.submit(self.__read, name, function, *args)
+        with self.__lock:
+            self.__futures.add(future)
+        # Released when the query finishes, or is cancelled before it starts, not when its request gives up.
+        future.add_done_callback(self.__done)
+        try:
+            # On a timeout the future is cancelled, which drops a query that is still waiting for a thread.
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            metrics.RECORDER_QUERIES_REJECTED.labels("timeout").inc()
+            _LOGGER.warning("A %s query took longer than %ss", name, self.timeout)
+            raise HTTPGatewayTimeout(text="The database query took too long") from None
+
+    @classmethod
+    def __read(cls, name: str, function, *args):
+        """Runs in a thread of the pool."""
+        database = models.proxy.obj
+        if database.is_closed():
+            # This thread's connection, which is kept open for the next query.
+            database.connect()
+            for (database_class, statement) in _READ_ONLY:
+                if isinstance(database, database_class):
+                    database.execute_sql(statement)
+                    break
+        return cls.__timed(name, function, *args)
+
+    @staticmethod
+    def __timed(name: str, function, *args):
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            metrics.RECORDER_QUERY_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+    def __done(self, future):
+        with self.__lock:
+            self.__in_flight -= 1
+            self.__futures.discard(future)
+
+
+# Shared by the Recorder, which configures it, and its views.
+reader = DatabaseReader()
@@ -0,0 +1,9 @@
+# The query parameters of the /snapshots view, each a string as it arrives in the URL.
+SNAPSHOTS_QUERY_SCHEMA = {
+    "$schema": "http://json-schema.org/draft-04/schema#",
+    "type": "object",
+    "properties": {
+        "start": {"type": "string", "pattern": "^[0-9]{14}$"},
+        "end": {"type": "string", "pattern": "^[0-9]{14}$"},
+    },
+}
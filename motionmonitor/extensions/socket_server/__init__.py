@@ -5,14 +5,17 @@ Created on 24/07/2013
 '''
 
 import asyncio
-import json
 import logging
-from datetime import datetime
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
 
-from motionmonitor.models import EventFrame, Event, Frame
+from motionmonitor import codec, ingest, metrics
+from motionmonitor.sequence import ReorderBuffer, sequence_key
 from motionmonitor.const import (
     EVENT_MOTION_INTERNAL,
-    EVENT_MANAGEMENT_ACTIVITY,
     EVENT_NEW_FRAME,
     EVENT_NEW_MOTION_FRAME,
     EVENT_MOTION_EVENT_START,
@@ -20,6 +23,16 @@ from motionmonitor.const import (
 )
 
 
+TRANSPORT_UDP = "udp"
+TRANSPORT_UNIX_DGRAM = "unix_dgram"
+TRANSPORT_TCP = "tcp"
+TRANSPORT_UNIX_STREAM = "unix_stream"
+TRANSPORTS = (TRANSPORT_UDP, TRANSPORT_UNIX_DGRAM, TRANSPORT_TCP, TRANSPORT_UNIX_STREAM)
+
+# The seconds to wait before replacing a worker process that has exited, so that one that can't start doesn't spin.
+WORKER_RESPAWN_DELAY = 1.0
+
+
 def get_extension(mm):
     return SocketListener(mm)
 
@@ -30,123 +43,291 @@ class SocketListener:
 
         self.mm = mm
         self.transport = None
+        self.protocol = None
+        self.server = None
+        self.stream_handler = None
+        self.workers = []
+        self.__worker_args = None
+        self.__worker_dir = None
+        self.__path = None
 
     async def start_extension(self):
         config = self.mm.config
+        transport = config["SOCKET_SERVER"].get("TRANSPORT", TRANSPORT_UDP)
+        workers = int(config["SOCKET_SERVER"].get("WORKERS", "0"))
+        reorder_window = float(config["SOCKET_SERVER"].get("REORDER_WINDOW_MS", "0")) / 1000
+        validate = config["SOCKET_SERVER"].get("VALIDATE_MESSAGES", "true").lower() == "true"
+
+        protocol = self.protocol = SocketHandler(self.mm, reorder_window=reorder_window, validate=validate)
+
+        if transport not in TRANSPORTS:
+            raise ValueError("Unknown [SOCKET_SERVER] TRANSPORT '{}', expected one of {}".format(
+                transport, ", ".join(TRANSPORTS)))
+
+        if transport != TRANSPORT_UDP:
+            if workers > 0:
+                self.__logger.warning("WORKERS is only supported by the udp transport, decoding in the main process")
+            await self.__start_local_transport(transport, protocol)
+            return
+
         address = config["SOCKET_SERVER"]["ADDRESS"]
         port = int(config["SOCKET_SERVER"]["PORT"])
-        self.__logger.debug("binding to %s:%d" % (address, port))
 
-        loop = self.mm.loop
-        protocol = SocketHandler(self.mm)
+        if workers > 0:
+            await self.__start_workers(address, port, workers, protocol)
+            return
+
+        self.__logger.debug("binding to %s:%d", address, port)
 
         # One protocol instance will be created to serve all client requests
-        socket_listener = loop.create_datagram_endpoint(
+        socket_listener = self.mm.loop.create_datagram_endpoint(
             lambda: protocol, local_addr=(address, port))
         self.transport, p1 = await socket_listener
         # self.transport, p1 = loop.run_until_complete(socket_listener)
         self.__logger.info("Listening...")
 
+    async def __start_local_transport(self, transport, protocol):
+        loop = self.mm.loop
+        config = self.mm.config
+
+        if transport == TRANSPORT_TCP:
+            address = config["SOCKET_SERVER"]["ADDRESS"]
+            port = int(config["SOCKET_SERVER"]["PORT"])
+            self.stream_handler = StreamMessageHandler(protocol)
+            self.server = await asyncio.start_server(self.stream_handler.handle_connection, address, port,
+                                                     limit=ingest.MAX_STREAM_MESSAGE_SIZE)
+            self.__logger.info("Listening for streams on %s:%d...", address, port)
+            return
+
+        self.__path = config["SOCKET_SERVER"]["PATH"]
+        # A socket left behind by an earlier run would stop us binding.
+        if os.path.exists(self.__path):
+            os.unlink(self.__path)
+
+        if transport == TRANSPORT_UNIX_DGRAM:
+            self.transport, p1 = await loop.create_datagram_endpoint(lambda: protocol, local_addr=self.__path,
+                                                                     family=socket.AF_UNIX)
+        else:
+            self.stream_handler = StreamMessageHandler(protocol)
+            self.server = await asyncio.start_unix_server(self.stream_handler.handle_connection, self.__path,
+                                                          limit=ingest.MAX_STREAM_MESSAGE_SIZE)
+        self.__logger.info("Listening for %s on %s...", transport, self.__path)
+
+    async def __start_workers(self, address, port, workers, protocol):
+        # The workers forward their records to a socket in a directory only this user can access.
+        self.__worker_dir = tempfile.mkdtemp(prefix="motion-monitor-")
+        forward_path = os.path.join(self.__worker_dir, "ingest.sock")
+        forward_sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        forward_sock.bind(forward_path)
+        self.transport, p1 = await self.mm.loop.create_datagram_endpoint(lambda: WorkerRecordHandler(protocol),
+                                                                         sock=forward_sock)
+
+        log_level = logging.getLogger("motionmonitor").getEffectiveLevel()
+        self.__worker_args = (address, port, forward_path, log_level, codec.NAME, protocol.validate)
+        self.workers = [None] * workers
+        for i in range(workers):
+            self.__spawn_worker(i)
+        self.__logger.info("Listening on %s:%d with %d worker processes...", address, port, workers)
+
+    def __spawn_worker(self, i):
+        if self.__worker_args is None:
+            # Closed while waiting to respawn
+            return
+        worker = multiprocessing.get_context("spawn").Process(target=ingest.ingest_worker, args=self.__worker_args,
+                                                              name="IngestWorker-{}".format(i), daemon=True)
+        worker.start()
+        self.workers[i] = worker
+        # The sentinel becomes readable when the process ends, however it ends.
+        self.mm.loop.add_reader(worker.sentinel, self.__worker_exited, i, worker)
+
+    def __worker_exited(self, i, worker):
+        self.mm.loop.remove_reader(worker.sentinel)
+        worker.join()
+        metrics.INGEST_WORKER_RESTARTS.inc()
+        self.__logger.error("%s exited with code %s, starting another in %ss", worker.name, worker.exitcode,
+                            WORKER_RESPAWN_DELAY)
+        self.mm.loop.call_later(WORKER_RESPAWN_DELAY, self.__spawn_worker, i)
+
     def close(self):
+        self.__worker_args = None
+        for worker in self.workers:
+            if worker is not None:
+                self.mm.loop.remove_reader(worker.sentinel)
+                worker.terminate()
+        for worker in self.workers:
+            if worker is not None:
+                worker.join()
+        self.workers = []
+
         if self.transport:
             self.__logger.info("Closing the transport.")
             self.transport.close()
 
+        if self.server:
+            self.__logger.info("Closing the stream server.")
+            self.server.close()
+            self.stream_handler.close()
+            self.server = None
+
+        if self.__path:
+            if os.path.exists(self.__path):
+                os.unlink(self.__path)
+            self.__path = None
+
+        if self.protocol:
+            self.protocol.close()
+
+        if self.__worker_dir:
+            shutil.rmtree(self.__worker_dir, ignore_errors=True)
+            self.__worker_dir = None
+
+
+class WorkerRecordHandler(asyncio.DatagramProtocol):
+    """Receives the records forwarded by the ingest workers, which have already been decoded and validated."""
+
+    def __init__(self, socket_handler):
+        self.__logger = logging.getLogger("%s.%s" % (self.__class__.__module__, self.__class__.__name__))
+        self.socket_handler = socket_handler
+
+    def datagram_received(self, data, addr):
+        metrics.DATAGRAMS_RECEIVED.inc()
+        try:
+            msg = ingest.decode_record(data)
+            event_type, event_data = ingest.decode_msg(msg)
+        except Exception as e:
+            metrics.DATAGRAMS_INVALID.inc()
+            self.__logger.error("Unable to decode a worker's record: %s", e)
+            return
+        metrics.DATAGRAMS_DECODED.inc()
+        self.socket_handler.dispatch(msg, event_type, event_data)
+
+
+class StreamMessageHandler:
+    """Reads newline delimited messages from the connections of the stream transports, handing each to the
+    SocketHandler as if it were a datagram.  A connection is only read from as quickly as its messages are handled, so
+    a fast sender is held back by the kernel rather than having its messages dropped.
+    """
+
+    def __init__(self, socket_handler):
+        self.__logger = logging.getLogger("%s.%s" % (self.__class__.__module__, self.__class__.__name__))
+        self.socket_handler = socket_handler
+        self.writers = set()
+
+    async def handle_connection(self, reader, writer):
+        peer = writer.get_extra_info("peername") or "a local client"
+        self.__logger.debug("Connection from %s", peer)
+        self.writers.add(writer)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # The rest of the message can't be told apart from the next, so give up on the connection.
+                    metrics.DATAGRAMS_INVALID.inc()
+                    self.__logger.error("A message from %s is longer than %d bytes, closing the connection", peer,
+                                        ingest.MAX_STREAM_MESSAGE_SIZE)
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    self.socket_handler.datagram_received(line, peer)
+                except ValueError as e:
+                    self.__logger.error("Dropping an invalid message from %s: %s", peer, e)
+                except Exception:
+                    # Whatever goes wrong with one message, the connection carries on with the next.
+                    self.__logger.exception("Unable to handle a message from %s", peer)
+        except ConnectionError as e:
+            self.__logger.debug("Connection from %s lost: %s", peer, e)
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    def close(self):
+        for writer in list(self.writers):
+            writer.close()
+
 
 class SocketHandler(asyncio.DatagramProtocol):
-    FTYPE_IMAGE = 1
-    FTYPE_IMAGE_SNAPSHOT = 2
-    FTYPE_IMAGE_MOTION = 4
-    FTYPE_MPEG = 8
-    FTYPE_MPEG_MOTION = 16
-    FTYPE_MPEG_TIMELAPSE = 32
+    FTYPE_IMAGE = ingest.FTYPE_IMAGE
+    FTYPE_IMAGE_SNAPSHOT = ingest.FTYPE_IMAGE_SNAPSHOT
+    FTYPE_IMAGE_MOTION = ingest.FTYPE_IMAGE_MOTION
+    FTYPE_MPEG = ingest.FTYPE_MPEG
+    FTYPE_MPEG_MOTION = ingest.FTYPE_MPEG_MOTION
+    FTYPE_MPEG_TIMELAPSE = ingest.FTYPE_MPEG_TIMELAPSE
 
-    def __init__(self, mm):
+    def __init__(self, mm, reorder_window=0.0, validate=False):
         self.mm = mm
         self.__logger = logging.getLogger("%s.%s" % (self.__class__.__module__, self.__class__.__name__))
-        self.mm.bus.listen(EVENT_MOTION_INTERNAL, self.handle_motion_message)
+        # Whether each message is validated against the schema of its type.
+        self.validate = validate
+
+        # With a window, frames are held for that long so that any that arrive out of order can be put back in order.
+        self.reorder_buffer = None
+        if reorder_window > 0:
+            self.reorder_buffer = ReorderBuffer(mm.loop, reorder_window, self.mm.bus.fire)
+            metrics.REORDER_BUFFER_FRAMES.set_function(lambda: len(self.reorder_buffer))
         self.__logger.debug("Handler configured")
 
     def connection_made(self, transport):
         self.transport = transport
 
-    def __validate_msg(self, msg):
-        assert type(msg) == dict, "Message should be a dictionary: %s" % msg
-        assert "type" in msg, "Message does not specify what type it is: %s" % msg
+    def datagram_received(self, data, addr):
+        metrics.DATAGRAMS_RECEIVED.inc()
+        try:
+            if self.__logger.isEnabledFor(logging.DEBUG):
+                self.__logger.debug('Received %r from %s', data, addr)
 
-        self.__logger.debug("Got a message type of '%s'" % msg["type"])
+            msg = codec.loads(data)
+            event_type, event_data = ingest.decode_msg(msg, self.validate)
+        except ValueError:
+            # Including a UnicodeDecodeError or an InvalidMessage
+            metrics.DATAGRAMS_INVALID.inc()
+            raise
+        except Exception as e:
+            metrics.DATAGRAMS_INVALID.inc()
+            raise ingest.InvalidMessage("Unable to decode %r: %r" % (data, e)) from e
+        metrics.DATAGRAMS_DECODED.inc()
+        self.dispatch(msg, event_type, event_data)
 
-        if msg["type"] in ["area_detected",
-                           "camera_lost",
-                           "event_end",
-                           "event_start",
-                           "motion_detected",
-                           "movie_end",
-                           "movie_start",
-                           "picture_save"]:
-            return EVENT_MOTION_INTERNAL
+    def dispatch(self, msg, event_type, event_data):
+        """Fires the event decoded from a message, the one bus hop for each message.  The message itself is only fired,
+        as an EVENT_MOTION_INTERNAL, while something still listens for motion's raw messages.
+        """
+        if self.mm.bus.has_listeners(EVENT_MOTION_INTERNAL) and msg["type"] in ingest.MOTION_MESSAGE_TYPES:
+            self.mm.bus.fire(EVENT_MOTION_INTERNAL, msg)
 
-        if msg["type"] in ["sweep", "audit"]:
-            return EVENT_MANAGEMENT_ACTIVITY
+        if event_type is None:
+            return
 
-        assert False, "Unknown message type: %s" % msg["type"]
+        if event_type == EVENT_NEW_FRAME or event_type == EVENT_NEW_MOTION_FRAME:
+            self.dispatch_frame(event_type, event_data)
+            return
 
-    def datagram_received(self, data, addr):
-        line = data.decode()
-        self.__logger.debug('Received %r from %s' % (line, addr))
-
-        msg = json.loads(line)
-        msg_type = self.__validate_msg(msg)
-        self.mm.bus.fire(msg_type, msg)
-
-    @staticmethod
-    def decode_event_msg(msg):
-        # self.__logger.debug("Creating Event from socket message: %s" % msg)
-        event_id = msg["event"]
-        camera_id = msg["camera"]
-        start_time = datetime.strptime(msg["timestamp"], "%Y%m%d%H%M%S")
-        return Event(event_id, camera_id, start_time)
-
-    @staticmethod
-    def decode_frame_msg(msg):
-        # self.__logger.debug("Creating Frame from socket message: %s" % msg)
-        camera_id = msg["camera"]
-        timestamp = datetime.strptime(msg["timestamp"], "%Y%m%d%H%M%S")
-        frame_num = msg["frame"]
-        filename = msg["file"]
-        return Frame(camera_id, timestamp, frame_num, filename)
-
-    @staticmethod
-    def decode_event_frame_msg(msg):
-        # self.__logger.debug("Creating EventFrame from socket message: %s" % msg)
-        camera_id = msg["camera"]
-        event_id = msg["event"]
-        timestamp = datetime.strptime(msg["timestamp"], "%Y%m%d%H%M%S")
-        frame_num = msg["frame"]
-        filename = msg["file"]
-        score = msg["score"]
-        return EventFrame(camera_id, event_id, timestamp, frame_num, filename, score)
-
-    def handle_motion_message(self, event):
-        msg = event.data
-        if msg["type"] in ["picture_save"]:
-            file_type = int(msg["filetype"])
-            if file_type == self.FTYPE_IMAGE_SNAPSHOT:
-                self.__logger.debug("Handling a snapshot")
-                frame = SocketHandler.decode_frame_msg(msg)
-                self.mm.bus.fire(EVENT_NEW_FRAME, frame)
-
-            if file_type == self.FTYPE_IMAGE:
-                self.__logger.debug("Handling motion image")
-                event_frame = SocketHandler.decode_event_frame_msg(msg)
-                self.mm.bus.fire(EVENT_NEW_MOTION_FRAME, event_frame)
-
-        if msg["type"] == "event_start":
-            # We need an Event
-            new_event = SocketHandler.decode_event_msg(msg)
-            self.__logger.info("Created new event for start: %s" % new_event)
-            self.mm.bus.fire(EVENT_MOTION_EVENT_START, new_event)
-        if msg["type"] == "event_end":
-            new_event = SocketHandler.decode_event_msg(msg)
-            self.__logger.info("Created new event for end: %s" % new_event)
-            self.mm.bus.fire(EVENT_MOTION_EVENT_END, new_event)
+        if event_type == EVENT_MOTION_EVENT_START or event_type == EVENT_MOTION_EVENT_END:
+            self.__logger.info("Created new event for %s: %s", msg["type"], event_data)
+        self.mm.bus.fire(event_type, event_data)
+
+    def dispatch_frame(self, event_type, frame):
+        """Fires a frame on the bus, by way of the reorder buffer if there is one.  Duplicates are dropped, as are the
+        frames the file watcher has already fired."""
+        if not self.mm.sequences.observe(frame):
+            self.__logger.debug("Dropping a duplicate of %s", frame)
+            return
+        if not self.mm.sequences.deliver(frame, "socket server"):
+            return
+
+        if self.reorder_buffer is None:
+            self.mm.bus.fire(event_type, frame)
+            return
+
+        key = sequence_key(frame)
+        if key is None:
+            self.mm.bus.fire(event_type, frame)
+            return
+        self.reorder_buffer.add(key, event_type, frame)
+
+    def close(self):
+        if self.reorder_buffer is not None:
+            self.reorder_buffer.close()
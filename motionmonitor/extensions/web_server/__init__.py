@@ -5,7 +5,6 @@ Created on 11/08/2013
 '''
 import base64
 import datetime
-import json
 import logging
 from io import BytesIO
 from extensions.web_server.stream.handlers import SnapshotFrameHandler, MotionFrameHandler, LiveFrameHandler, LiveVideoHandler
@@ -13,11 +12,15 @@ from extensions.web_server.stream.handlers import SnapshotFrameHandler, MotionFr
 from PIL import Image as PILImage
 from aiohttp import web
 
+from motionmonitor import codec
+
 import extensions.mysql_db_server.__init__
 from models import Frame, Event, EventFrame
 
 
 def get_extension(mm):
+    if mm.config["WEB_SERVER"].get("ENABLED", "true").lower() != "true":
+        return []
     return JSONInterface(mm)
 
 
@@ -194,8 +197,8 @@ class JSONInterface:
 
     async def media_post_data_received(self, request):
         self.__logger.debug("Need to handle MEDIA POST request.")
-        self.__logger.debug(request.json())
-        msg = await request.json()
+        msg = await request.json(loads=codec.loads)
+        self.__logger.debug(msg)
         return await self.media_data_received(request, msg)
 
     async def media_data_received(self, request, msg):
@@ -251,8 +254,8 @@ class JSONInterface:
 
     async def json_post_data_received(self, request):
         self.__logger.debug("Need to handle JSON POST request.")
-        self.__logger.debug(await request.json())
-        msg = await request.json()
+        msg = await request.json(loads=codec.loads)
+        self.__logger.debug(msg)
         return await self.json_data_received(msg)
 
     async def json_data_received(self, msg):
@@ -310,7 +313,7 @@ class JSONInterface:
             response["error"] = error
 
         self.__logger.debug(response)
-        return web.Response(text=json.dumps(response), content_type='application/json')
+        return codec.json_response(response)
 
     @staticmethod
     def snapshot_get(sqlreader, params):
@@ -0,0 +1,202 @@
+"""The decoding of motion's datagrams, shared by the SocketHandler and the ingest worker processes.
+
+With [SOCKET_SERVER] WORKERS set, each worker process binds the socket server's address with SO_REUSEPORT, so the
+kernel spreads the datagrams across them.  A worker decodes and validates each datagram then forwards a compact
+record of it to the main process over a Unix datagram socket, leaving the main process to dispatch it on the bus.
+The workers live in this module, rather than in the socket_server extension, so that they can be imported by the
+processes that are spawned.
+"""
+import logging
+import marshal
+import socket
+from datetime import datetime
+
+from motionmonitor import codec
+from motionmonitor.const import (
+    EVENT_MANAGEMENT_ACTIVITY,
+    EVENT_MOTION_EVENT_START,
+    EVENT_MOTION_EVENT_END,
+    EVENT_NEW_FRAME,
+    EVENT_NEW_MOTION_FRAME
+)
+from motionmonitor.models import Event, EventFrame, Frame
+from motionmonitor.validation import compile_schema
+
+_LOGGER = logging.getLogger(__name__)
+
+MOTION_MESSAGE_TYPES = {"area_detected",
+                        "camera_lost",
+                        "event_end",
+                        "event_start",
+                        "motion_detected",
+                        "movie_end",
+                        "movie_start",
+                        "picture_save"}
+MANAGEMENT_MESSAGE_TYPES = {"sweep", "audit"}
+# The message types that are dispatched by the type of file they are about, as motion's %n, so need one.  The movie
+# messages say what type of file they are about too, but have nothing to fire whatever it is.
+FILETYPE_MESSAGE_TYPES = {"picture_save"}
+
+FTYPE_IMAGE = 1
+FTYPE_IMAGE_SNAPSHOT = 2
+FTYPE_IMAGE_MOTION = 4
+FTYPE_MPEG = 8
+FTYPE_MPEG_MOTION = 16
+FTYPE_MPEG_TIMELAPSE = 32
+
+# The largest datagram that is read from the socket.
+MAX_DATAGRAM_SIZE = 65535
+# The longest line that is read from the stream transports, which aren't limited by the size of a datagram.
+MAX_STREAM_MESSAGE_SIZE = 1024 * 1024
+
+
+class InvalidMessage(ValueError):
+    """A message that isn't one of motion's, or is missing what its type needs."""
+
+
+def _parse_timestamp(msg):
+    return datetime.strptime(msg["timestamp"], "%Y%m%d%H%M%S")
+
+
+def decode_frame(msg) -> Frame:
+    return Frame(msg["camera"], _parse_timestamp(msg), msg["frame"], msg["file"])
+
+
+def decode_event_frame(msg) -> EventFrame:
+    return EventFrame(msg["camera"], msg["event"], _parse_timestamp(msg), msg["frame"], msg["file"], msg["score"])
+
+
+def decode_event(msg) -> Event:
+    return Event(msg["event"], msg["camera"], _parse_timestamp(msg))
+
+
+def decode_management(msg):
+    return msg
+
+
+# The schemas of the messages that are decoded, which motion's on_* commands fill with strings, or numbers for the ids.
+_ID = {"type": ["string", "integer"], "minLength": 1}
+_NUMBER = {"type": ["string", "integer"], "pattern": "^[0-9]+$"}
+_TIMESTAMP = {"type": "string", "pattern": "^[0-9]{14}$"}
+
+FRAME_SCHEMA = {
+    "type": "object",
+    "required": ["camera", "timestamp", "frame", "file"],
+    "properties": {
+        "camera": _ID,
+        "timestamp": _TIMESTAMP,
+        "frame": _NUMBER,
+        "file": {"type": "string", "minLength": 1},
+    }
+}
+EVENT_FRAME_SCHEMA = {
+    "type": "object",
+    "required": FRAME_SCHEMA["required"] + ["event", "score"],
+    "properties": dict(FRAME_SCHEMA["properties"], event=_ID, score={"type": ["string", "number"]})
+}
+EVENT_SCHEMA = {
+    "type": "object",
+    "required": ["camera", "event", "timestamp"],
+    "properties": {
+        "camera": _ID,
+        "event": _ID,
+        "timestamp": _TIMESTAMP,
+    }
+}
+
+# The event fired for each (type, filetype) of message, the function that decodes the message into its data and the
+# schema that the message is validated against, if any.  The filetype is None for the types of message that don't have
+# one.  The motion messages that aren't here are valid but have nothing to fire.
+DISPATCH_TABLE = {
+    ("picture_save", FTYPE_IMAGE): (EVENT_NEW_MOTION_FRAME, decode_event_frame, compile_schema(EVENT_FRAME_SCHEMA)),
+    ("picture_save", FTYPE_IMAGE_SNAPSHOT): (EVENT_NEW_FRAME, decode_frame, compile_schema(FRAME_SCHEMA)),
+    ("event_start", None): (EVENT_MOTION_EVENT_START, decode_event, compile_schema(EVENT_SCHEMA)),
+    ("event_end", None): (EVENT_MOTION_EVENT_END, decode_event, compile_schema(EVENT_SCHEMA)),
+    ("audit", None): (EVENT_MANAGEMENT_ACTIVITY, decode_management, None),
+    ("sweep", None): (EVENT_MANAGEMENT_ACTIVITY, decode_management, None),
+}
+
+
+def decode_msg(msg, validate=False):
+    """Returns the (event_type, data) to fire for a message, or (None, None) for a valid message that has nothing to
+    fire.  Raises InvalidMessage if it isn't valid.  With validate, the message is also validated against the schema of
+    its type, rather than only checked for what its decoder needs.
+    """
+    if type(msg) is not dict:
+        raise InvalidMessage("Message should be a dictionary: %r" % (msg,))
+    msg_type = msg.get("type")
+    if msg_type is None:
+        raise InvalidMessage("Message does not specify what type it is: %r" % (msg,))
+    if type(msg_type) is not str:
+        # Nor could it be looked up, if it were a list or a dict
+        raise InvalidMessage("Message type should be a string: %r" % (msg,))
+
+    filetype = None
+    if msg_type in FILETYPE_MESSAGE_TYPES:
+        filetype = msg.get("filetype")
+        if type(filetype) is not str and type(filetype) is not int:
+            raise InvalidMessage("A %s message needs a numeric filetype: %r" % (msg_type, msg))
+        try:
+            filetype = int(filetype)
+        except ValueError:
+            raise InvalidMessage("A %s message needs a numeric filetype: %r" % (msg_type, msg)) from None
+
+    entry = DISPATCH_TABLE.get((msg_type, filetype))
+    if entry is None:
+        if msg_type in MOTION_MESSAGE_TYPES:
+            return None, None
+        raise InvalidMessage("Unknown message type: %s" % msg_type)
+
+    event_type, decoder, schema = entry
+    if validate and schema is not None:
+        error = schema.error(msg)
+        if error is not None:
+            raise InvalidMessage("A %s message isn't valid, %s: %r" % (msg_type, error, msg))
+    try:
+        return event_type, decoder(msg)
+    except KeyError as e:
+        raise InvalidMessage("A %s message is missing %s: %r" % (msg_type, e, msg)) from None
+    except (TypeError, ValueError) as e:
+        raise InvalidMessage("A %s message isn't valid, %s: %r" % (msg_type, e, msg)) from None
+
+
+def encode_record(msg) -> bytes:
+    # marshal is the quickest to load of the serialisers, the records only ever come from our own workers.
+    return marshal.dumps(msg)
+
+
+def decode_record(data: bytes):
+    """Returns the msg of a record forwarded by a worker."""
+    return marshal.loads(data)
+
+
+def ingest_worker(address: str, port: int, forward_path: str, log_level: int, codec_name: str, validate: bool):
+    """The main loop of a worker process; decodes the datagrams sent to address:port and forwards them to the Unix
+    datagram socket at forward_path, until the process is terminated.
+    """
+    logging.basicConfig(level=log_level, format='%(asctime)s - %(name)s - %(processName)s - %(levelname)s - '
+                                                '%(message)s')
+    codec.select(codec_name)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((address, port))
+
+    forward = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    forward.connect(forward_path)
+    _LOGGER.info("Worker listening on %s:%d", address, port)
+
+    while True:
+        data = sock.recv(MAX_DATAGRAM_SIZE)
+        try:
+            msg = codec.loads(data)
+            # Only to validate it, the models can't be forwarded.
+            decode_msg(msg, validate)
+        except ValueError as e:
+            _LOGGER.error("Dropping an invalid datagram: %s", e)
+            continue
+        except Exception:
+            # Whatever is wrong with one datagram mustn't stop the worker.
+            _LOGGER.exception("Dropping a datagram that couldn't be decoded: %r", data)
+            continue
+        forward.send(encode_record(msg))
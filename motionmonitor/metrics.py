@@ -0,0 +1,255 @@
+"""A minimal metrics registry, rendered in the Prometheus text exposition format.
+
+Metrics are created once, at import time, and each distinct set of label values is resolved to a child with
+labels(...).  The children are cached, so a hot path that keeps hold of its children pays only for a lock and an
+addition per update.
+"""
+import threading
+from bisect import bisect_left
+
+# Latency buckets, in seconds, from 50us up to 10s.
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, _escape(value)) for (name, value) in labels.items()) + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _CounterChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+        self._function = None
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set_function(self, function):
+        """The value will be read from the function whenever the metrics are collected."""
+        self._function = function
+
+    def get(self):
+        return self._function() if self._function else self.value
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        # Counts are kept per bucket and only made cumulative when they're rendered.
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name: str, description: str, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+    def labels(self, *values):
+        """Returns the child for these label values, in the order of the labelnames."""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError("{} expects the labels {}, got {}".format(self.name, self.labelnames, values))
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _samples(self):
+        """Yields the (suffix, labels, value) samples of each child."""
+        raise NotImplementedError()
+
+    def render(self) -> [str]:
+        lines = ["# HELP {} {}".format(self.name, _escape(self.description)),
+                 "# TYPE {} {}".format(self.name, self.type_name)]
+        for (suffix, labels, value) in self._samples():
+            lines.append("{}{}{} {}".format(self.name, suffix, _format_labels(labels), _format_value(value)))
+        return lines
+
+    def _label_dict(self, key):
+        return dict(zip(self.labelnames, key))
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        for (key, child) in list(self._children.items()):
+            yield ("_total" if not self.name.endswith("_total") else "", self._label_dict(key), child.value)
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function):
+        self.labels().set_function(function)
+
+    def _samples(self):
+        for (key, child) in list(self._children.items()):
+            yield ("", self._label_dict(key), child.get())
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, description: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, description, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _samples(self):
+        for (key, child) in list(self._children.items()):
+            labels = self._label_dict(key)
+            with child._lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for (bound, count) in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield ("_bucket", dict(labels, le=_format_value(float(bound))), cumulative)
+            yield ("_sum", labels, total)
+            yield ("_count", labels, cumulative)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError("A metric named {} is already registered".format(metric.name))
+            self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> _Metric:
+        return self._metrics[name]
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, description: str, labelnames=()) -> Counter:
+    return REGISTRY.register(Counter(name, description, labelnames))
+
+
+def gauge(name: str, description: str, labelnames=()) -> Gauge:
+    return REGISTRY.register(Gauge(name, description, labelnames))
+
+
+def histogram(name: str, description: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, description, labelnames, buckets))
+
+
+# The metrics are all created here, rather than alongside the code they measure, as the extension loader may execute
+# an extension's module more than once and a metric can only be registered once.
+EVENTS_FIRED = counter("motionmonitor_bus_events_fired_total", "Events fired on the bus", ["event_type"])
+LISTENER_SECONDS = histogram("motionmonitor_bus_listener_seconds", "Time taken by each listener to handle an event",
+                             ["event_type", "listener"])
+
+DATAGRAMS_RECEIVED = counter("motionmonitor_datagrams_received_total", "Datagrams received by the socket server")
+DATAGRAMS_DECODED = counter("motionmonitor_datagrams_decoded_total", "Datagrams decoded into a valid message")
+DATAGRAMS_INVALID = counter("motionmonitor_datagrams_invalid_total", "Datagrams that could not be decoded")
+INGEST_WORKER_RESTARTS = counter("motionmonitor_ingest_worker_restarts_total",
+                                 "Ingest worker processes replaced after exiting")
+
+FRAMES = counter("motionmonitor_camera_frames_total", "Frames received for each camera", ["camera_id", "kind"])
+FRAME_SEQUENCE_ANOMALIES = counter("motionmonitor_camera_frame_sequence_anomalies_total",
+                                   "Frames that arrived out of sequence, by the kind of anomaly", ["camera_id", "anomaly"])
+REORDER_BUFFER_FRAMES = gauge("motionmonitor_reorder_buffer_frames", "Frames held by the reorder buffer")
+CACHE_LOOKUPS = counter("motionmonitor_cache_lookups_total", "Lookups of the in-memory frames and events",
+                        ["cache", "result"])
+
+IMAGE_CONVERSION_SECONDS = histogram("motionmonitor_image_conversion_seconds", "Time taken to convert a frame",
+                                     ["format", "scale"])
+IMAGE_ANIMATION_SECONDS = histogram("motionmonitor_image_animation_seconds", "Time taken to animate frames",
+                                    ["scale"])
+
+RECORDER_FLUSH_SECONDS = histogram("motionmonitor_recorder_flush_seconds", "Time taken to write rows to the database",
+                                   ["table"])
+RECORDER_FLUSH_ROWS = histogram("motionmonitor_recorder_flush_rows", "Rows written to the database in each flush",
+                                ["table"], buckets=(1, 10, 50, 100, 250, 500, 1000, 5000))
+RECORDER_MAINTENANCE_SECONDS = histogram("motionmonitor_recorder_maintenance_seconds",
+                                         "Time taken to checkpoint and optimize the database")
+RECORDER_QUERY_SECONDS = histogram("motionmonitor_recorder_query_seconds", "Time taken by each read of the database",
+                                   ["query"])
+RECORDER_QUERIES_IN_FLIGHT = gauge("motionmonitor_recorder_queries_in_flight",
+                                   "Reads of the database running or waiting for a thread")
+RECORDER_QUERIES_REJECTED = counter("motionmonitor_recorder_queries_rejected_total",
+                                    "Reads of the database refused or given up on", ["reason"])
@@ -5,8 +5,10 @@ from motionmonitor.utils import FixedSizeOrderedDict
 
 
 class Frame:
+    # The loggers are per class rather than per instance, a Frame is created for every datagram.
+    __logger = logging.getLogger("%s.Frame" % __name__)
+
     def __init__(self, camera_id, timestamp, frame_num, filename):
-        self.__logger = logging.getLogger("%s.Frame" % __name__)
         self._camera_id = camera_id
         self._timestamp = timestamp
         self._frame_num = frame_num
@@ -50,9 +52,9 @@ class Frame:
 
 
 class EventFrame(Frame):
+    __logger = logging.getLogger("%s.EventFrame" % __name__)
 
     def __init__(self, camera_id, event_id, timestamp, frame_num, filename, score):
-        self.__logger = logging.getLogger("%s.EventFrame" % __name__)
         Frame.__init__(self, camera_id, timestamp, frame_num, filename)
         self._event_id = event_id
         self._score = score
@@ -77,9 +79,9 @@ class EventFrame(Frame):
 
 
 class Event:
+    __logger = logging.getLogger("%s.Event" % __name__)
 
     def __init__(self, event_id, camera_id, start_time):
-        self.__logger = logging.getLogger("%s.Event" % __name__)
         self._event_id = event_id
         self._camera_id = camera_id
         self._start_time = start_time
@@ -110,7 +112,7 @@ class Event:
         return self._frames
 
     def append_frame(self, event_frame):
-        self.__logger.debug("Got a new event frame: {}".format(event_frame))
+        self.__logger.debug("Got a new event frame: %s", event_frame)
         # See if this is the highest scoring frame
         if not self._top_score_frame or (self._top_score_frame and
                                          event_frame.score > self._top_score_frame.score):
@@ -180,7 +182,7 @@ class Camera:
         self.__recent_snapshots[Frame.create_id(frame.timestamp, frame.frame_num)] = frame
 
     def to_json(self):
-        self.__logger.debug("Getting JSON for camera: {}".format(self))
+        self.__logger.debug("Getting JSON for camera: %s", self)
 
         recent_motion_json = []
         for event in self.__recent_motion:
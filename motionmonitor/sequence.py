@@ -0,0 +1,214 @@
+"""Tracking of the order that each camera's frames arrive in, and the optional buffering that restores it.
+
+A frame's place in its camera's sequence is its (timestamp, frame number), motion numbering the frames of each second
+from 1 (its %q).  A camera's snapshots and its motion frames are numbered independently, so each kind of frame is a
+sequence of its own.  Motion's messages are sent as datagrams so can be lost, duplicated or reordered on their way here;
+the SequenceTracker counts each of these as it happens.  A gap can only be seen between two frames of the same second,
+as the number of frames in a second isn't known, so the gaps counted are a lower bound.
+"""
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import deque, OrderedDict
+
+from motionmonitor import metrics
+from motionmonitor.models import EventFrame
+
+_LOGGER = logging.getLogger(__name__)
+
+# The number of each camera's most recent frames that are remembered, to recognise a duplicate.
+DUPLICATE_WINDOW = 1000
+
+# The number of the most recently delivered frame files that are remembered, while deliveries are tracked.
+DELIVERED_WINDOW = 10000
+
+
+def frame_kind(frame) -> str:
+    """The sequence of its camera that a frame belongs to, "motion" or "snapshot"."""
+    return "motion" if isinstance(frame, EventFrame) else "snapshot"
+
+
+def sequence_key(frame):
+    """The place of a frame in its camera's sequence, or None if it isn't numbered."""
+    try:
+        return frame.timestamp, int(frame.frame_num)
+    except (TypeError, ValueError):
+        return None
+
+
+class _Stream:
+    """The recent frames of one kind from one camera."""
+
+    def __init__(self):
+        self.latest = None
+        self.recent = set()
+        self.recent_order = deque()
+
+
+class CameraSequence:
+    """The frames seen so far from one camera."""
+
+    def __init__(self, camera_id):
+        self.camera_id = camera_id
+        self.frames = 0
+        self.gaps = 0
+        self.missed = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.missed_event_starts = 0
+        self.__streams = {}
+
+    def observe(self, key, kind="snapshot"):
+        """Records the arrival of the frame of the kind with the given key, returning the anomaly it shows, if any."""
+        stream = self.__streams.get(kind)
+        if stream is None:
+            stream = self.__streams[kind] = _Stream()
+
+        if key in stream.recent:
+            self.duplicates += 1
+            return "duplicate"
+
+        self.frames += 1
+        stream.recent.add(key)
+        stream.recent_order.append(key)
+        if len(stream.recent_order) > DUPLICATE_WINDOW:
+            stream.recent.discard(stream.recent_order.popleft())
+
+        latest = stream.latest
+        if latest is not None and key < latest:
+            self.reordered += 1
+            return "reordered"
+
+        stream.latest = key
+        if latest is not None and key[0] == latest[0] and key[1] > latest[1] + 1:
+            self.gaps += 1
+            self.missed += key[1] - latest[1] - 1
+            return "gap"
+        return None
+
+    def to_json(self):
+        return {"cameraId": self.camera_id,
+                "frames": self.frames,
+                "gaps": self.gaps,
+                "missedFrames": self.missed,
+                "duplicates": self.duplicates,
+                "reordered": self.reordered,
+                "missedEventStarts": self.missed_event_starts}
+
+
+class SequenceTracker:
+    """Counts the gaps, duplicates and reordering in the sequence of each camera's frames."""
+
+    def __init__(self):
+        self.cameras = {}
+        # The source that fired each recent frame file onto the bus, once track_deliveries() has been called.
+        self.__delivered = None
+
+    def __camera(self, camera_id) -> CameraSequence:
+        sequence = self.cameras.get(camera_id)
+        if sequence is None:
+            sequence = self.cameras[camera_id] = CameraSequence(camera_id)
+        return sequence
+
+    def observe(self, frame) -> bool:
+        """Records the arrival of a frame, returning False if it is a duplicate that should be dropped."""
+        key = sequence_key(frame)
+        if key is None:
+            return True
+
+        anomaly = self.__camera(frame.camera_id).observe(key, frame_kind(frame))
+        if anomaly is not None:
+            metrics.FRAME_SEQUENCE_ANOMALIES.labels(frame.camera_id, anomaly).inc()
+            _LOGGER.debug("Frame %s of camera %s is a %s", key[1], frame.camera_id, anomaly)
+        return anomaly != "duplicate"
+
+    def track_deliveries(self):
+        """Starts remembering the files of the frames delivered, for when frames reach the bus by more than one
+        route."""
+        if self.__delivered is None:
+            self.__delivered = OrderedDict()
+
+    def deliver(self, frame, source: str) -> bool:
+        """Records that the source is firing a frame onto the bus, returning False if a source has already fired the
+        same file, in which case it should be dropped.  Until track_deliveries() is called, every frame is delivered.
+        """
+        if self.__delivered is None:
+            return True
+        filename = os.path.normpath(frame.filename)
+        fired_by = self.__delivered.get(filename)
+        if fired_by is not None:
+            _LOGGER.debug("Dropping %s from the %s, the %s already fired it", filename, source, fired_by)
+            return False
+        self.__delivered[filename] = source
+        if len(self.__delivered) > DELIVERED_WINDOW:
+            self.__delivered.popitem(last=False)
+        return True
+
+    def missed_event_start(self, camera_id):
+        self.__camera(camera_id).missed_event_starts += 1
+        metrics.FRAME_SEQUENCE_ANOMALIES.labels(camera_id, "missed_event_start").inc()
+
+    def to_json(self):
+        return [sequence.to_json() for sequence in self.cameras.values()]
+
+
+class ReorderBuffer:
+    """Holds each camera's frames for up to window seconds, so that those that arrive out of order can be released
+    in order.  A frame that arrives after a later one has been released can't be put back in its place, it is released
+    as soon as it is due.
+    """
+
+    def __init__(self, loop, window: float, release):
+        self.loop = loop
+        self.window = window
+        self.release = release
+        self.__heaps = {}
+        self.__deadlines = {}
+        self.__held = set()
+        self.__counter = itertools.count()
+        self.__timer = None
+
+    def __len__(self):
+        return sum(len(heap) for heap in self.__heaps.values())
+
+    def add(self, key, event_type, frame):
+        """Buffers a frame until it is released, in order of its key, by a call to release(event_type, frame)."""
+        camera_id = frame.camera_id
+        seq = next(self.__counter)
+        self.__held.add(seq)
+        heapq.heappush(self.__heaps.setdefault(camera_id, []), (key, seq, event_type, frame))
+        self.__deadlines.setdefault(camera_id, deque()).append((time.monotonic() + self.window, seq))
+        if self.__timer is None:
+            self.__timer = self.loop.call_later(self.window, self.flush)
+
+    def flush(self, everything=False):
+        """Releases every frame that has been held for the window, along with those that come before them."""
+        self.__timer = None
+        now = time.monotonic()
+        next_deadline = None
+        for camera_id, deadlines in self.__deadlines.items():
+            heap = self.__heaps[camera_id]
+            due = set()
+            while deadlines and (everything or deadlines[0][0] <= now):
+                seq = deadlines.popleft()[1]
+                # Those released early, ahead of a frame that was due, are no longer held.
+                if seq in self.__held:
+                    due.add(seq)
+            while due:
+                (key, seq, event_type, frame) = heapq.heappop(heap)
+                due.discard(seq)
+                self.__held.discard(seq)
+                self.release(event_type, frame)
+            if deadlines and (next_deadline is None or deadlines[0][0] < next_deadline):
+                next_deadline = deadlines[0][0]
+
+        if next_deadline is not None:
+            self.__timer = self.loop.call_later(max(0.0, next_deadline - now), self.flush)
+
+    def close(self):
+        """Releases every frame that is held."""
+        if self.__timer is not None:
+            self.__timer.cancel()
+        self.flush(everything=True)
@@ -1,9 +1,14 @@
 import logging
+import time
 from collections import OrderedDict
+from datetime import datetime
 from io import BytesIO
 
 from PIL import Image
 
+from motionmonitor import metrics
+from motionmonitor.const import KEEP_TIER_7_DAYS, KEEP_TIER_4_WEEKS, KEEP_TIER_3_MONTHS, KEEP_TIER_FOREVER
+
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -21,10 +26,11 @@ class FixedSizeOrderedDict(OrderedDict):
 
 
 def animate_frames(frames: [], scale=None) -> bytes:
-    _LOGGER.debug("Have {} frames to animate.".format(len(frames)))
+    _LOGGER.debug("Have %d frames to animate.", len(frames))
+    start = time.perf_counter()
     images = []
     for frame in frames:
-        _LOGGER.debug("Working through {}".format(frame))
+        _LOGGER.debug("Working through %s", frame)
         path = frame.filename
 
         with open(path, "rb") as image_file:
@@ -33,22 +39,27 @@ def animate_frames(frames: [], scale=None) -> bytes:
             (width, height) = (im.width, im.height)
             if scale:
                 (width, height) = (int(im.width * scale), int(im.height * scale))
-                _LOGGER.debug("Original size is {}wx{}h, new size is {}wx{}h".format(im.width, im.height,
-                                                                                     width, height))
+                _LOGGER.debug("Original size is %dwx%dh, new size is %dwx%dh", im.width, im.height, width, height)
                 im = im.resize([width, height])
             images.append(im)
     animated_img = BytesIO()
     im = Image.new('RGB', (width, height))
     im.save(animated_img, format="GIF", save_all=True, append_images=images, optimize=False, duration=10, loop=0)
+    metrics.IMAGE_ANIMATION_SECONDS.labels(_scale_label(scale)).observe(time.perf_counter() - start)
     return animated_img.getvalue()
 
 
+def _scale_label(scale) -> str:
+    return "%g" % scale if scale else "1"
+
+
 def convert_frames(frame, img_format: str, scale=None) -> bytes:
     """Given an Frame object, will return the bytes of that Frame's file.  If provided, will also scale
     the size of the image and convert to the required format.
     """
 
     path = frame.filename
+    start = time.perf_counter()
 
     with open(path, "rb") as image_file:
         im = Image.open(image_file)
@@ -56,10 +67,34 @@ def convert_frames(frame, img_format: str, scale=None) -> bytes:
         if scale:
             _LOGGER.debug("Scaling the image")
             (width, height) = (int(im.width * scale), int(im.height * scale))
-            _LOGGER.debug("Original size is {}wx{}h, new size is {}wx{}h".format(im.width, im.height, width, height))
+            _LOGGER.debug("Original size is %dwx%dh, new size is %dwx%dh", im.width, im.height, width, height)
             im = im.resize([width, height])
         im.save(converted_img, img_format)
-        return converted_img.getvalue()
+    metrics.IMAGE_CONVERSION_SECONDS.labels(img_format.upper(), _scale_label(scale)).observe(
+        time.perf_counter() - start)
+    return converted_img.getvalue()
+
+
+def snapshot_keep_tier(timestamp: datetime) -> int:
+    """Given the timestamp of a snapshot frame, returns the retention tier it belongs to.  Frames on the hour outlive
+    the rest, those on the hour at 06:00, 12:00 and 18:00 are kept longer again and the midday frame is kept forever.
+    """
+    if timestamp.minute != 0:
+        return KEEP_TIER_7_DAYS
+    if timestamp.hour == 12:
+        return KEEP_TIER_FOREVER
+    if timestamp.hour in (6, 18):
+        return KEEP_TIER_3_MONTHS
+    return KEEP_TIER_4_WEEKS
+
+
+def snapshot_timelapse_buckets(timestamp: datetime) -> [tuple]:
+    """Given the timestamp of a snapshot frame, returns the (granularity, bucket) pairs it is a candidate for in the
+    timelapse index.  Only frames on the hour qualify beyond the minutely granularity, so every bucket is simply the
+    timestamp truncated to the minute.
+    """
+    bucket = timestamp.replace(second=0, microsecond=0)
+    return [(granularity, bucket) for granularity in range(snapshot_keep_tier(timestamp) + 1)]
 
 
 def stringify_dict(d: dict) -> dict:
@@ -0,0 +1,117 @@
+"""JSON schema validation, with each schema's validator compiled once and cached.
+
+jsonschema.validate() checks the schema and builds a new validator on every call, which costs far more than the
+validation itself.  compile_schema() does that once for each schema, so should be called as a module is imported.
+
+Even a validator that's been built costs several times the decoding of a message, so a schema that only uses the
+simpler keywords (type, required, properties, pattern and the lengths) is also compiled into a plain Python predicate.
+An instance the predicate accepts is valid; one it doesn't is most often missing a required property, which is rejected
+straight away, and only the rest are handed to jsonschema, for its verdict and a description of the error.
+"""
+import re
+
+import jsonschema
+
+# The compiled schemas, keyed by the id of the schema.  The schema is kept alongside, so that its id isn't reused.
+_COMPILED = {}
+
+_TYPES = {
+    "object": {dict},
+    "array": {list},
+    "string": {str},
+    "integer": {int},
+    "number": {int, float},
+    "boolean": {bool},
+    "null": {type(None)},
+}
+# The keywords the predicates understand, along with those that don't affect validation.
+_PREDICATE_KEYWORDS = {"type", "required", "properties", "pattern", "minLength", "maxLength", "$schema", "id", "$id",
+                       "title", "description"}
+
+
+def _predicate(schema: dict):
+    """Returns a function that is True for the instances valid against the schema, or None if the schema uses keywords
+    that it can't be built from.  The function may be stricter than the schema, but never more lenient.
+    """
+    if type(schema) is not dict or not _PREDICATE_KEYWORDS.issuperset(schema):
+        return None
+
+    types = None
+    if "type" in schema:
+        names = [schema["type"]] if type(schema["type"]) is str else schema["type"]
+        if not all(name in _TYPES for name in names):
+            return None
+        types = frozenset().union(*[_TYPES[name] for name in names])
+
+    search = re.compile(schema["pattern"]).search if "pattern" in schema else None
+    min_length = schema.get("minLength")
+    max_length = schema.get("maxLength")
+    required = frozenset(schema["required"]) if "required" in schema else None
+
+    properties = None
+    if "properties" in schema:
+        properties = [(name, _predicate(subschema)) for (name, subschema) in schema["properties"].items()]
+        if any(check is None for (name, check) in properties):
+            return None
+
+    # One closure for the whole schema, as this is called for every message.
+    def check(value):
+        value_type = type(value)
+        if types is not None and value_type not in types:
+            return False
+        if value_type is str:
+            if search is not None and search(value) is None:
+                return False
+            if min_length is not None and len(value) < min_length:
+                return False
+            if max_length is not None and len(value) > max_length:
+                return False
+        elif value_type is dict:
+            if required is not None and not required.issubset(value.keys()):
+                return False
+            if properties is not None:
+                for (name, property_check) in properties:
+                    if name in value and not property_check(value[name]):
+                        return False
+        return True
+
+    return check
+
+
+class CompiledSchema:
+    def __init__(self, schema: dict):
+        validator_class = jsonschema.validators.validator_for(schema)
+        validator_class.check_schema(schema)
+        self.schema = schema
+        self.validator = validator_class(schema)
+        self.accepts = _predicate(schema)
+
+        self.required = None
+        if schema.get("type") == "object":
+            self.required = frozenset(schema.get("required", ()))
+
+    def error(self, instance):
+        """Returns a description of why the instance isn't valid, or None if it is."""
+        if self.accepts is not None and self.accepts(instance):
+            return None
+
+        if self.required is not None:
+            if type(instance) is not dict:
+                return "%r is not of type 'object'" % (instance,)
+            if not self.required.issubset(instance.keys()):
+                return "missing %s" % ", ".join(sorted(self.required.difference(instance.keys())))
+
+        for error in self.validator.iter_errors(instance):
+            return error.message
+        return None
+
+    def is_valid(self, instance) -> bool:
+        return self.error(instance) is None
+
+
+def compile_schema(schema: dict) -> CompiledSchema:
+    """Returns the CompiledSchema of a schema, compiling it only the first time."""
+    compiled = _COMPILED.get(id(schema))
+    if compiled is None:
+        compiled = _COMPILED[id(schema)] = CompiledSchema(schema)
+    return compiled
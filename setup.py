@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 
-from distutils.core import setup
+try:
+    from setuptools import setup
+except ImportError:
+    from distutils.core import setup
 
 version = '0.02'
 
@@ -11,9 +14,11 @@ data = dict(
     author = 'David Whyte',
     author_email = 'david@thewhytehouse.org',
     packages =      ['motionmonitor', 'motionmonitor.stream', 'motionmonitor.extensions'],
-    scripts = ['motion-monitor'],
+    scripts = ['motion-monitor', 'motion-monitor-import'],
     data_files = [('/etc/init', ['motion-monitor.conf']),
                   ('/etc/motion-monitor', ['motion-monitor.ini', 'motion-monitor.ini.default']),],
+    # The faster JSON codecs, either of which motionmonitor.codec uses when it's installed
+    extras_require = {'orjson': ['orjson'], 'ujson': ['ujson']},
     )
 
 
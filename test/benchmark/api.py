@@ -0,0 +1,188 @@
+"""API latency benchmark for the Siren views.
+
+Pre-populates MotionMonitor.cameras with realistic volumes (by default the 1800 snapshots and 100 events a Camera
+holds, for 1, 8 and 64 cameras) then drives each view concurrently with aiohttp's test client.  The requests per
+second, the latency percentiles and the response size are reported for each endpoint.  Run from the root of the
+repository, for example:
+
+    python -m test.benchmark.api --cameras 1,8,64 --concurrency 16 --requests 500 --output api.json
+
+--codec compares the JSON codecs.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer, TestClient
+
+from motionmonitor import codec
+from motionmonitor.const import KEY_MM
+from motionmonitor.extensions.api import APIRootView, APICamerasView, APICameraEntityView, \
+    APICameraSnapshotFramesView, APICameraSnapshotFrameView, APICameraSnapshotTimelapseView, APICameraEventsView, \
+    APICameraEventsTimelapseView, APICameraEventEntityView, APICameraEventFramesView, APICameraEventFrameView, \
+    APICameraEventTimelapseView, APIJobsView, APIJobEntityView
+from motionmonitor.models import Camera, Frame, Event, EventFrame
+from test.benchmark.utils import configure_logging, summarise, write_results, compare_to_baseline
+from test.unit.utils import create_image_file
+
+# Registered in the same order as API.start_extension, the views link to each other by name.
+VIEWS = [APIRootView, APICamerasView, APICameraEntityView, APICameraSnapshotFramesView, APICameraSnapshotFrameView,
+         APICameraSnapshotTimelapseView, APICameraEventsView, APICameraEventsTimelapseView, APICameraEventEntityView,
+         APICameraEventFramesView, APICameraEventFrameView, APICameraEventTimelapseView, APIJobsView,
+         APIJobEntityView]
+
+START_TIME = datetime(2020, 6, 1, 12, 0, 0)
+
+
+class BenchmarkMonitor:
+    """The parts of MotionMonitor that the API views rely on."""
+
+    def __init__(self):
+        self.cameras = {}
+        self.jobs = OrderedDict()
+
+
+def populate(mm, cameras: int, snapshots: int, events: int, event_frames: int, image_file: str):
+    """Fills mm.cameras, every frame sharing the one image file so that the image endpoints can be driven too."""
+    for camera_num in range(1, cameras + 1):
+        camera_id = str(camera_num)
+        camera = Camera(camera_id)
+        mm.cameras[camera_id] = camera
+
+        for i in range(snapshots):
+            camera.append_snapshot_frame(Frame(camera_id, START_TIME + timedelta(seconds=i * 60), 0, image_file))
+
+        for i in range(events):
+            start_time = START_TIME + timedelta(seconds=i * 600)
+            event = Event("{}-{}".format(start_time.strftime("%Y%m%d%H%M"), camera_id), camera_id, start_time)
+            for frame_num in range(event_frames):
+                event.append_frame(EventFrame(camera_id, event.id, start_time + timedelta(seconds=frame_num // 10),
+                                              frame_num % 10, image_file, frame_num))
+            camera.recent_motion[event.id] = event
+
+
+def endpoints(mm):
+    """The endpoints driven, as (name, path), the camera, event and frame picked being the most recent of each."""
+    camera = mm.cameras[str(len(mm.cameras))]
+    snapshot = list(camera.recent_snapshots.values())[-1]
+    event = list(camera.recent_motion.values())[-1]
+    event_frame = list(event.frames.values())[-1]
+
+    snapshot_path = "/cameras/{}/snapshots/{}/{}".format(camera.id, snapshot.timestamp.strftime("%Y%m%d%H%M%S"),
+                                                         snapshot.frame_num)
+    event_path = "/cameras/{}/events/{}".format(camera.id, event.id)
+    event_frame_path = "{}/frames/{}/{}".format(event_path, event_frame.timestamp.strftime("%Y%m%d%H%M%S"),
+                                                event_frame.frame_num)
+    return [
+        ("root", "/"),
+        ("cameras", "/cameras"),
+        ("camera", "/cameras/{}".format(camera.id)),
+        ("snapshots", "/cameras/{}/snapshots".format(camera.id)),
+        ("snapshot", snapshot_path),
+        ("snapshot_jpeg_thumbnail", snapshot_path + "?format=jpeg&scale=0.2"),
+        ("events", "/cameras/{}/events".format(camera.id)),
+        ("event", event_path),
+        ("event_frames", event_path + "/frames"),
+        ("event_frame", event_frame_path),
+        ("jobs", "/jobs"),
+    ]
+
+
+async def drive(client, path: str, requests: int, concurrency: int) -> dict:
+    """Makes the requests of one endpoint from concurrency workers, returning the throughput, latency and size."""
+    latencies = []
+    sizes = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            async with client.get(path) as response:
+                body = await response.read()
+            latencies.append(time.perf_counter() - start)
+            sizes.append(len(body))
+            if response.status != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    return {"requests": len(latencies),
+            "errors": errors,
+            "requests_per_second": len(latencies) / elapsed if elapsed else 0,
+            "latency_ms": summarise(latencies),
+            "response_bytes": sum(sizes) // len(sizes) if sizes else 0}
+
+
+async def run_scenario(args, cameras: int, image_file: str) -> dict:
+    mm = BenchmarkMonitor()
+    populate(mm, cameras, args.snapshots, args.events, args.event_frames, image_file)
+
+    app = web.Application()
+    app[KEY_MM] = mm
+    for view in VIEWS:
+        view().register(app.router)
+
+    results = {}
+    async with TestClient(TestServer(app)) as client:
+        for name, path in endpoints(mm):
+            if args.endpoints and name not in args.endpoints:
+                continue
+            # Warm up, so that the first requests' costs don't skew the percentiles.
+            await drive(client, path, args.concurrency, args.concurrency)
+            results[name] = await drive(client, path, args.requests, args.concurrency)
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the latency of the API's views.")
+    parser.add_argument("--cameras", default="1,8,64", help="A comma separated list of the camera counts to run.")
+    parser.add_argument("--snapshots", type=int, default=1800, help="Snapshot frames per camera.")
+    parser.add_argument("--events", type=int, default=100, help="Motion events per camera.")
+    parser.add_argument("--event-frames", type=int, default=50, help="Frames per motion event.")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once.")
+    parser.add_argument("--endpoints", type=lambda s: s.split(","), help="Only drive these endpoints.")
+    parser.add_argument("--codec", choices=codec.available(), help="The JSON codec, rather than the fastest installed.")
+    parser.add_argument("--log-level", default="WARNING", help="The level of the motionmonitor loggers.")
+    parser.add_argument("--output", help="Write the JSON results to this file, rather than stdout.")
+    parser.add_argument("--baseline", help="Compare the results to this earlier output, exiting 1 on a regression.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    configure_logging(args.log_level)
+    codec.select(args.codec)
+    args.codec = codec.NAME
+
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        image_file = os.path.join(temp_dir, "frame.jpg")
+        create_image_file(image_file)
+
+        loop = asyncio.new_event_loop()
+        for cameras in (int(c) for c in args.cameras.split(",")):
+            results["{}_cameras".format(cameras)] = loop.run_until_complete(run_scenario(args, cameras, image_file))
+        loop.close()
+
+    write_results("api", vars(args), results, args.output)
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline)
+        for regression in regressions:
+            print("Regression: {}".format(regression))
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
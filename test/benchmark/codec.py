@@ -0,0 +1,81 @@
+"""Cost of the JSON codecs on motion-monitor's payloads.
+
+Decodes synthetic datagrams, as the SocketHandler does, and encodes a Siren response the size of a camera's snapshot
+listing, as the API does, with each of the JSON codecs that are installed.  Run from the root of the repository, for
+example:
+
+    python -m test.benchmark.codec --datagrams 100000 --responses 200 --output codec.json
+"""
+import argparse
+import time
+
+from motionmonitor import codec
+from test.benchmark.ingest import synthetic_messages
+from test.benchmark.utils import write_results, compare_to_baseline
+
+
+def snapshot_listing(frames: int) -> dict:
+    """A response shaped like that of the /cameras/{camera_id}/snapshots view."""
+    return {"class": ["snapshots"],
+            "rel": ["self"],
+            "properties": {},
+            "entities": [{"class": ["snapshot"],
+                          "rel": ["item"],
+                          "href": "/cameras/1/snapshots/20200601120000_{}".format(i),
+                          "properties": {"cameraId": "1", "timestamp": "20200601120000", "frame": str(i),
+                                         "filename": "/data/motion/snapshots/camera1/{}.jpg".format(i)}}
+                         for i in range(frames)],
+            "links": [{"rel": ["self"], "href": "/cameras/1/snapshots"}]}
+
+
+def run(name: str, datagrams: [bytes], response: dict, responses: int) -> dict:
+    codec.select(name)
+
+    start = time.perf_counter()
+    for data in datagrams:
+        codec.loads(data)
+    loads_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(responses):
+        body = codec.dumps(response)
+    dumps_elapsed = time.perf_counter() - start
+
+    return {"loads_per_second": len(datagrams) / loads_elapsed,
+            "dumps_per_second": responses / dumps_elapsed,
+            "response_bytes": len(body)}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the JSON codecs that are installed.")
+    parser.add_argument("--datagrams", type=int, default=100000, help="Datagrams decoded with each codec.")
+    parser.add_argument("--responses", type=int, default=200, help="Responses encoded with each codec.")
+    parser.add_argument("--frames", type=int, default=1800, help="Snapshots in each response.")
+    parser.add_argument("--cameras", type=int, default=4, help="The number of cameras to simulate.")
+    parser.add_argument("--output", help="Write the JSON results to this file, rather than stdout.")
+    parser.add_argument("--baseline", help="Compare the results to this earlier output, exiting 1 on a regression.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # Encoded with the standard library, so that every codec decodes the same bytes.
+    codec.select("json")
+    messages = synthetic_messages(args.cameras)
+    datagrams = [codec.dumps(next(messages)) for _ in range(args.datagrams)]
+    response = snapshot_listing(args.frames)
+
+    results = {name: run(name, datagrams, response, args.responses) for name in codec.available()}
+    write_results("codec", vars(args), results, args.output)
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline)
+        for regression in regressions:
+            print("Regression: {}".format(regression))
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
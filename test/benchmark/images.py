@@ -0,0 +1,121 @@
+"""Image pipeline benchmark for convert_frames and animate_frames.
+
+Generates a corpus of JPEGs at common camera resolutions, in the manner of test/unit/utils.create_image_file, then
+times convert_frames at each scale and format and animate_frames at several frame counts.  The wall and CPU time of
+each call are summarised over the iterations, and the peak memory is taken from one further, traced, call.  The peak
+is of the Python heap (tracemalloc), it includes the bytes returned but not Pillow's own image buffers.  Run from the
+root of the repository, for example:
+
+    python -m test.benchmark.images --resolutions 640x480,1920x1080 --iterations 20 --output images.json
+"""
+import argparse
+import os
+import tempfile
+import tracemalloc
+
+from PIL import Image
+
+from motionmonitor.models import Frame
+from motionmonitor.utils import convert_frames, animate_frames
+from test.benchmark.utils import configure_logging, summarise, write_results, compare_to_baseline, Stopwatch
+from test.unit.utils import create_image_file
+
+RESOLUTIONS = "640x480,1280x720,1920x1080,2560x1440"
+FORMATS = "JPEG,PNG,GIF,BMP"
+SCALES = "1,0.5,0.2"
+FRAME_COUNTS = "10,50,100"
+
+
+def create_corpus(target_dir: str, size: (int, int), count: int) -> [Frame]:
+    """Creates count JPEGs of the given size, with noise so that they compress and decode like a camera's would."""
+    frames = []
+    noise = Image.effect_noise(size, 64).convert("RGB")
+    for i in range(count):
+        filename = os.path.join(target_dir, "{}x{}".format(*size), "{:04d}.jpg".format(i))
+        create_image_file(filename, size)
+        with Image.open(filename) as img:
+            Image.blend(img, noise, 0.3).save(filename, "JPEG", quality=85)
+        frames.append(Frame("1", None, i, filename))
+    return frames
+
+
+def measure(func, iterations: int) -> dict:
+    walls = []
+    cpus = []
+    size = 0
+    for _ in range(iterations):
+        with Stopwatch() as stopwatch:
+            size = len(func())
+        walls.append(stopwatch.wall)
+        cpus.append(stopwatch.cpu)
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"wall": summarise(walls),
+            "cpu": summarise(cpus),
+            "calls_per_second": len(walls) / sum(walls) if sum(walls) else 0,
+            "peak_mb": peak / (1024 * 1024),
+            "output_bytes": size}
+
+
+def parse_scale(scale: str):
+    # A scale of 1 is passed as None, as the API does when no scale is requested.
+    return None if float(scale) == 1 else float(scale)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the conversion and animation of frames.")
+    parser.add_argument("--resolutions", default=RESOLUTIONS, help="A comma separated list of WIDTHxHEIGHT.")
+    parser.add_argument("--formats", default=FORMATS, help="The formats to convert frames to.")
+    parser.add_argument("--scales", default=SCALES, help="The scales to convert and animate frames at.")
+    parser.add_argument("--frame-counts", default=FRAME_COUNTS, help="The numbers of frames to animate.")
+    parser.add_argument("--iterations", type=int, default=10, help="The times each conversion is timed.")
+    parser.add_argument("--animate-iterations", type=int, default=3, help="The times each animation is timed.")
+    parser.add_argument("--log-level", default="WARNING", help="The level of the motionmonitor loggers.")
+    parser.add_argument("--output", help="Write the JSON results to this file, rather than stdout.")
+    parser.add_argument("--baseline", help="Compare the results to this earlier output, exiting 1 on a regression.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    configure_logging(args.log_level)
+
+    formats = args.formats.split(",")
+    scales = args.scales.split(",")
+    frame_counts = [int(count) for count in args.frame_counts.split(",")]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for resolution in args.resolutions.split(","):
+            size = tuple(int(dimension) for dimension in resolution.split("x"))
+            frames = create_corpus(temp_dir, size, max(frame_counts))
+            results[resolution] = {"convert_frames": {}, "animate_frames": {}}
+
+            for img_format in formats:
+                for scale in scales:
+                    key = "{}_scale_{}".format(img_format, scale)
+                    results[resolution]["convert_frames"][key] = measure(
+                        lambda: convert_frames(frames[0], img_format, parse_scale(scale)), args.iterations)
+
+            for count in frame_counts:
+                for scale in scales:
+                    key = "{}_frames_scale_{}".format(count, scale)
+                    results[resolution]["animate_frames"][key] = measure(
+                        lambda: animate_frames(frames[:count], parse_scale(scale)), args.animate_iterations)
+
+    write_results("images", vars(args), results, args.output)
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline)
+        for regression in regressions:
+            print("Regression: {}".format(regression))
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
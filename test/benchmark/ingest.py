@@ -0,0 +1,266 @@
+"""Ingestion load generator and throughput benchmark.
+
+Replays synthetic (or recorded) motion traffic for a number of cameras, at a given rate, into the SocketHandler and
+reports the datagrams handled per second, the latency until each frame is dispatched on the bus, the datagrams
+dropped and the RSS over time.  Run from the root of the repository, for example:
+
+    python -m test.benchmark.ingest --cameras 8 --rate 2000 --duration 10 --mode udp --output ingest.json
+
+In 'udp' mode datagrams are sent to a real socket from another thread, in 'inprocess' mode they are handed straight
+to the protocol so only the decoding and dispatching is measured.  The 'unix_dgram', 'tcp' and 'unix_stream' modes
+send over the socket server's other transports.  A recording is a file with one datagram (a JSON message) per line,
+such as those captured from motion's on_picture_save script.  --codec compares the JSON codecs,
+--no-validate measures the cost of validating each message.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from unittest.mock import Mock
+from datetime import datetime
+
+from motionmonitor import codec
+from motionmonitor.cameramonitor import CameraMonitor
+from motionmonitor.const import EVENT_JOB, EVENT_NEW_FRAME, EVENT_NEW_MOTION_FRAME
+from motionmonitor.core import EventBus
+from motionmonitor.extensions.socket_server import SocketListener, SocketHandler
+from motionmonitor.sequence import SequenceTracker
+from test.benchmark.utils import configure_logging, summarise, rss_mb, write_results, compare_to_baseline
+
+# Every this many frames, a camera's frame is part of a motion event rather than a snapshot.
+MOTION_EVERY = 4
+
+
+class BenchmarkMonitor:
+    """The parts of MotionMonitor that ingestion relies on, without loading any extensions."""
+
+    def __init__(self, config, loop):
+        self.config = config
+        self.loop = loop
+        self.bus = EventBus(self)
+        self.jobs = OrderedDict()
+        self.cameras = {}
+        self.sequences = SequenceTracker()
+        self.bus.listen(EVENT_JOB, lambda event: None)
+        self.camera_monitor = CameraMonitor(self)
+
+
+def synthetic_messages(cameras: int):
+    """An endless generator of picture_save messages (with the occasional event_start), round-robin across cameras.
+    Each frame's file is unique, so that it can be matched when it is dispatched on the bus.
+    """
+    seq = 0
+    events = {}
+    while True:
+        camera_id = str(seq % cameras + 1)
+        now = datetime.now()
+        timestamp = now.strftime("%Y%m%d%H%M%S")
+        msg = {"type": "picture_save",
+               "camera": camera_id,
+               "timestamp": timestamp,
+               "frame": str(seq // cameras),
+               "score": "0",
+               "file": "/benchmark/{}/{}.jpg".format(camera_id, seq)}
+
+        if seq // cameras % MOTION_EVERY == 0:
+            # A motion frame, belonging to an event that changes every minute.
+            event_id = now.strftime("%Y%m%d%H%M")
+            if events.get(camera_id) != event_id:
+                events[camera_id] = event_id
+                yield {"type": "event_start", "camera": camera_id, "event": event_id, "timestamp": timestamp}
+            msg.update({"filetype": str(SocketHandler.FTYPE_IMAGE), "event": event_id})
+        else:
+            msg.update({"filetype": str(SocketHandler.FTYPE_IMAGE_SNAPSHOT), "event": ""})
+
+        seq += 1
+        yield msg
+
+
+def recorded_messages(filename: str):
+    """An endless generator of the messages in a recording, the file of each frame is made unique on every loop."""
+    with open(filename) as recording:
+        messages = [json.loads(line) for line in recording if line.strip()]
+    loop_num = 0
+    while True:
+        for msg in messages:
+            msg = dict(msg)
+            if "file" in msg:
+                msg["file"] = "{}#{}".format(msg["file"], loop_num)
+            yield msg
+        loop_num += 1
+
+
+class IngestBenchmark:
+    def __init__(self, args):
+        self.args = args
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.path = os.path.join(tempfile.mkdtemp(prefix="ingest-benchmark-"), "ingest.sock")
+        transport = args.mode if args.mode != "inprocess" else "udp"
+        config = {"SOCKET_SERVER": {"TRANSPORT": transport, "ADDRESS": args.address, "PORT": str(args.port),
+                                    "PATH": self.path, "WORKERS": str(args.workers),
+                                    "VALIDATE_MESSAGES": str(args.validate).lower()}}
+        self.mm = BenchmarkMonitor(config, self.loop)
+        self.mm.bus.listen(EVENT_NEW_FRAME, self.handle_frame)
+        self.mm.bus.listen(EVENT_NEW_MOTION_FRAME, self.handle_frame)
+
+        if args.recorder:
+            from motionmonitor.extensions.recorder import Recorder
+            self.mm.config["RECORDER"] = {"URL": args.recorder}
+            self.mm.api = Mock()
+            recorder = Recorder(self.mm)
+            self.loop.run_until_complete(recorder.start_extension())
+
+        self.sent = {}
+        self.latencies = []
+        self.sent_count = 0
+        self.received = 0
+        self.last_received = None
+        self.rss = []
+
+    def handle_frame(self, event):
+        sent_time = self.sent.pop(event.data.filename, None)
+        if sent_time is not None:
+            self.last_received = time.perf_counter()
+            self.latencies.append(self.last_received - sent_time)
+            self.received += 1
+
+    def messages(self):
+        if self.args.replay:
+            return recorded_messages(self.args.replay)
+        return synthetic_messages(self.args.cameras)
+
+    def paced(self):
+        """Yields the encoded datagrams at the requested rate, until the duration is up."""
+        interval = 1.0 / self.args.rate
+        start = time.perf_counter()
+        deadline = start + self.args.duration
+        next_send = start
+        for msg in self.messages():
+            now = time.perf_counter()
+            if now >= deadline:
+                return
+            if next_send > now:
+                time.sleep(next_send - now)
+            next_send += interval
+            data = json.dumps(msg).encode()
+            if "file" in msg and msg["type"] == "picture_save":
+                self.sent[msg["file"]] = time.perf_counter()
+                self.sent_count += 1
+            yield data
+
+    def sample_rss(self, start, stop_event):
+        while not stop_event.is_set():
+            self.rss.append((round(time.perf_counter() - start, 2), round(rss_mb(), 2)))
+            stop_event.wait(0.5)
+
+    def run(self):
+        if self.args.mode != "inprocess":
+            listener = SocketListener(self.mm)
+            self.loop.run_until_complete(listener.start_extension())
+            if self.args.workers:
+                # Let the workers bind before anything is sent.
+                self.loop.run_until_complete(asyncio.sleep(1))
+
+        start = time.perf_counter()
+        stop_sampling = threading.Event()
+        sampler = threading.Thread(target=self.sample_rss, args=(start, stop_sampling), daemon=True)
+        sampler.start()
+
+        if self.args.mode == "inprocess":
+            protocol = SocketHandler(self.mm, validate=self.args.validate)
+            addr = (self.args.address, 0)
+            for data in self.paced():
+                protocol.datagram_received(data, addr)
+        else:
+            sender = threading.Thread(target=self.send)
+            sender.start()
+
+            async def wait_for_sender():
+                while sender.is_alive():
+                    await asyncio.sleep(0.05)
+                # Give the last of the datagrams a chance to arrive.
+                await asyncio.sleep(1)
+
+            self.loop.run_until_complete(wait_for_sender())
+            listener.close()
+        os.rmdir(os.path.dirname(self.path))
+
+        # The throughput is up until the last datagram was handled, not including the wait for stragglers.
+        elapsed = (self.last_received or time.perf_counter()) - start
+        stop_sampling.set()
+        sampler.join()
+
+        return {
+            "sent": self.sent_count,
+            "received": self.received,
+            "dropped": self.sent_count - self.received,
+            "elapsed": elapsed,
+            "datagrams_per_second": self.received / elapsed if elapsed else 0,
+            "latency_ms": summarise(self.latencies),
+            "final_rss_mb": rss_mb(),
+            "rss_mb": self.rss,
+        }
+
+    def send(self):
+        if self.args.mode in ("udp", "unix_dgram"):
+            sock = socket.socket(socket.AF_INET if self.args.mode == "udp" else socket.AF_UNIX, socket.SOCK_DGRAM)
+            target = (self.args.address, self.args.port) if self.args.mode == "udp" else self.path
+            for data in self.paced():
+                sock.sendto(data, target)
+        else:
+            if self.args.mode == "tcp":
+                sock = socket.create_connection((self.args.address, self.args.port))
+            else:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(self.path)
+            for data in self.paced():
+                sock.sendall(data + b"\n")
+        sock.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the ingestion of motion's datagrams.")
+    parser.add_argument("--mode", choices=["udp", "unix_dgram", "tcp", "unix_stream", "inprocess"], default="udp")
+    parser.add_argument("--cameras", type=int, default=4, help="The number of cameras to simulate.")
+    parser.add_argument("--rate", type=float, default=1000, help="Datagrams per second, across all cameras.")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to send datagrams for.")
+    parser.add_argument("--replay", help="Replay the datagrams recorded in this file, rather than synthetic ones.")
+    parser.add_argument("--workers", type=int, default=0, help="Decode in this many worker processes ('udp' mode).")
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18888)
+    parser.add_argument("--recorder", help="Also record the frames with the Recorder, to this database URL.")
+    parser.add_argument("--codec", choices=codec.available(), help="The JSON codec, rather than the fastest installed.")
+    parser.add_argument("--no-validate", dest="validate", action="store_false",
+                        help="Don't validate the messages against their schemas.")
+    parser.add_argument("--log-level", default="WARNING", help="The level of the motionmonitor loggers.")
+    parser.add_argument("--output", help="Write the JSON results to this file, rather than stdout.")
+    parser.add_argument("--baseline", help="Compare the results to this earlier output, exiting 1 on a regression.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    configure_logging(args.log_level)
+    codec.select(args.codec)
+    args.codec = codec.NAME
+
+    results = IngestBenchmark(args).run()
+    write_results("ingest", vars(args), results, args.output)
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline)
+        for regression in regressions:
+            print("Regression: {}".format(regression))
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
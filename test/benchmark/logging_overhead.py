@@ -0,0 +1,76 @@
+"""Per-datagram cost of logging, at each logging level.
+
+Hands synthetic datagrams straight to the SocketHandler, as the ingest benchmark's 'inprocess' mode does, once for
+each logging level.  The log records go to /dev/null through a formatting handler, so the cost of building the
+messages is measured but not that of the disk or terminal.  Run from the root of the repository, for example:
+
+    python -m test.benchmark.logging_overhead --datagrams 20000 --levels DEBUG,INFO --output logging.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+from motionmonitor.extensions.socket_server import SocketHandler
+from test.benchmark.ingest import BenchmarkMonitor, synthetic_messages
+from test.benchmark.utils import summarise, write_results, compare_to_baseline
+
+
+def run(level: str, datagrams: int, cameras: int) -> dict:
+    logger = logging.getLogger('motionmonitor')
+    logger.setLevel(logging.getLevelName(level))
+
+    loop = asyncio.new_event_loop()
+    mm = BenchmarkMonitor({}, loop)
+    protocol = SocketHandler(mm)
+    messages = synthetic_messages(cameras)
+    data = [json.dumps(next(messages)).encode() for _ in range(datagrams)]
+    addr = ("127.0.0.1", 0)
+
+    durations = []
+    start = time.perf_counter()
+    for datagram in data:
+        datagram_start = time.perf_counter()
+        protocol.datagram_received(datagram, addr)
+        durations.append(time.perf_counter() - datagram_start)
+    elapsed = time.perf_counter() - start
+    loop.close()
+
+    return {"datagrams_per_second": datagrams / elapsed,
+            "latency_ms": summarise(durations)}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the per-datagram overhead of each logging level.")
+    parser.add_argument("--levels", default="DEBUG,INFO,WARNING", help="The logging levels to compare.")
+    parser.add_argument("--datagrams", type=int, default=20000, help="Datagrams handled at each level.")
+    parser.add_argument("--cameras", type=int, default=4, help="The number of cameras to simulate.")
+    parser.add_argument("--output", help="Write the JSON results to this file, rather than stdout.")
+    parser.add_argument("--baseline", help="Compare the results to this earlier output, exiting 1 on a regression.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    with open(os.devnull, "w") as devnull:
+        handler = logging.StreamHandler(devnull)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        logging.getLogger('motionmonitor').addHandler(handler)
+
+        results = {level: run(level, args.datagrams, args.cameras) for level in args.levels.split(",")}
+
+    write_results("logging_overhead", vars(args), results, args.output)
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline)
+        for regression in regressions:
+            print("Regression: {}".format(regression))
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
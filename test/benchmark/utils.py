@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+import platform
+import resource
+import time
+from datetime import datetime
+
+
+def configure_logging(level="WARNING"):
+    logger = logging.getLogger('motionmonitor')
+    logger.setLevel(logging.getLevelName(level))
+    console_handler = logging.StreamHandler()
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    console_handler.setFormatter(formatter)
+    logger.addHandler(console_handler)
+    return logger
+
+
+def percentile(samples: [], pct: float):
+    """Returns the pct percentile of the samples, using the nearest-rank method."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def summarise(samples: []) -> dict:
+    """Summarises a list of latencies, given in seconds, as milliseconds."""
+    if not samples:
+        return {"count": 0}
+    return {"count": len(samples),
+            "mean": 1000 * sum(samples) / len(samples),
+            "p50": 1000 * percentile(samples, 50),
+            "p90": 1000 * percentile(samples, 90),
+            "p99": 1000 * percentile(samples, 99),
+            "max": 1000 * max(samples)}
+
+
+def rss_mb() -> float:
+    """Returns the current resident set size of this process, falling back to the peak where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (IOError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def write_results(name: str, params: dict, results: dict, output=None) -> dict:
+    """Writes the results of a benchmark as JSON to the output file, or stdout."""
+    document = {
+        "benchmark": name,
+        "timestamp": datetime.now().strftime("%Y%m%d%H%M%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "params": params,
+        "results": results,
+    }
+    text = json.dumps(document, indent=2, sort_keys=True)
+    if output:
+        with open(output, "w") as output_file:
+            output_file.write(text)
+    else:
+        print(text)
+    return document
+
+
+# The results where lower is better, compared by compare_to_baseline.  Those ending with 'per_second' are better higher.
+LOWER_IS_BETTER = {"mean", "p50", "p90", "p99", "max", "wall", "cpu", "peak_mb", "final_rss_mb"}
+
+
+def compare_to_baseline(results: dict, baseline_file: str, tolerance=0.1) -> [str]:
+    """Compares the results with those in a baseline file written by write_results.  Returns a description of each
+    result that is more than tolerance worse than the baseline.
+    """
+    with open(baseline_file) as f:
+        baseline = json.load(f)["results"]
+
+    regressions = []
+
+    def compare(path, current, previous):
+        if isinstance(current, dict) and isinstance(previous, dict):
+            for key in current:
+                if key in previous:
+                    compare(path + [key], current[key], previous[key])
+        elif isinstance(current, (int, float)) and isinstance(previous, (int, float)) and previous:
+            higher_is_better = path[-1].endswith("per_second")
+            if not higher_is_better and path[-1] not in LOWER_IS_BETTER:
+                return
+            change = (current - previous) / previous
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append("{}: {:.3f} -> {:.3f} ({:+.1%})".format(".".join(path), previous, current, change))
+
+    compare([], results, baseline)
+    return regressions
+
+
+class Stopwatch:
+    """Times a block of code, in both wall and CPU time."""
+
+    def __enter__(self):
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        return self
+
+    def __exit__(self, *args):
+        self.wall = time.perf_counter() - self.wall_start
+        self.cpu = time.process_time() - self.cpu_start
@@ -9,17 +9,18 @@ from unittest import mock
 from unittest.mock import Mock, ANY
 
 import aiohttp
-import jsonschema
 from aiohttp.test_utils import make_mocked_request
 
+from motionmonitor import validation
 from motionmonitor.const import KEY_MM
-from motionmonitor.core import Job
+from motionmonitor.core import Job, EventBus
 from motionmonitor.extensions.api import API, APICameraSnapshotFramesView, APICamerasView, APICameraEntityView, \
     APICameraSnapshotFrameView, APICameraSnapshotTimelapseView, APICameraEventsView, APICameraEventsTimelapseView, \
     APICameraEventEntityView, APICameraEventFramesView, APICameraEventFrameView, APICameraEventTimelapseView, \
-    APIJobsView, APIJobEntityView, APIRootView
+    APIJobsView, APIJobEntityView, APIRootView, APIMetricsView, APIBusView, APISequencesView
 from motionmonitor.extensions.api.schema import JSONSCHEMA
 from motionmonitor.models import Camera, Frame, EventFrame, Event
+from motionmonitor.sequence import SequenceTracker
 
 CAMERA_ID = 1
 EVENT_ID = "202006011200-1"
@@ -79,7 +80,7 @@ class TestAPIBase(unittest.TestCase):
         self.assertEqual(200, response.status)
         self.assertEqual("application/json", response.content_type)
         json_data = json.loads(response.body)
-        jsonschema.validate(json_data, schema=JSONSCHEMA)
+        validation.compile_schema(JSONSCHEMA).validator.validate(json_data)
         return json_data
 
     def is_valid_gif(self, response):
@@ -275,8 +276,11 @@ class TestAPICameraSnapshotFrameView(TestAPIBase):
                                                        "frame": self.frame_num})
         self.request.app[KEY_MM] = self.mm
 
-        response = self.loop.run_until_complete(APICameraSnapshotFrameView().get(self.request))
-        self.assertEqual(400, response.status)
+        with self.assertRaises(aiohttp.web_exceptions.HTTPBadRequest) as cm:
+            self.loop.run_until_complete(APICameraSnapshotFrameView().get(self.request))
+        self.assertEqual(400, cm.exception.status)
+        self.assertIn("BAD_FORMAT", cm.exception.text)
+        mock_convert_frames.assert_not_called()
 
     @mock.patch('motionmonitor.extensions.api.convert_frames')
     def test_get_snapshot_invalid_scale(self, mock_convert_frames):
@@ -293,6 +297,22 @@ class TestAPICameraSnapshotFrameView(TestAPIBase):
         with self.assertRaises(aiohttp.web_exceptions.HTTPBadRequest):
             response = self.loop.run_until_complete(APICameraSnapshotFrameView().get(self.request))
 
+    @mock.patch('motionmonitor.extensions.api.convert_frames')
+    def test_get_snapshot_query_case_insensitive(self, mock_convert_frames):
+        mock_convert_frames.return_value = self.mocked_bytes
+        self.add_camera(CAMERA_ID)
+        self.add_frames(1, CAMERA_ID, self.timestamp, self.frame_num)
+
+        for query in ["?format=png&scale=.5", "?format=Jpeg&scale=2"]:
+            with self.subTest(query=query):
+                self.request = make_mocked_request("GET", APICameraSnapshotFrameView.url + query,
+                                                   match_info={"camera_id": CAMERA_ID,
+                                                               "timestamp": self.timestamp,
+                                                               "frame": self.frame_num})
+                self.request.app[KEY_MM] = self.mm
+                response = self.loop.run_until_complete(APICameraSnapshotFrameView().get(self.request))
+                self.assertEqual(200, response.status)
+
     def test_delete(self):
         with self.assertRaises(aiohttp.web_exceptions.HTTPNotImplemented):
             response = self.loop.run_until_complete(APICameraSnapshotFrameView().delete(self.request))
@@ -629,5 +649,65 @@ class TestAPIJobEntityView(TestAPIBase):
             response = self.loop.run_until_complete(APIJobEntityView().get(self.request))
 
 
+class TestAPIMetricsView(TestAPIBase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.request = make_mocked_request("GET", APIMetricsView.url)
+        self.request.app[KEY_MM] = self.mm
+
+    def test_get_metrics(self):
+        response = self.loop.run_until_complete(APIMetricsView().get(self.request))
+        self.assertEqual(200, response.status)
+        self.assertEqual("text/plain", response.content_type)
+        self.assertIn("# TYPE motionmonitor_bus_events_fired_total counter", response.body.decode())
+
+
+class TestAPIBusView(TestAPIBase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.mm.bus = EventBus(self.mm)
+        self.request = make_mocked_request("GET", APIBusView.url)
+        self.request.app[KEY_MM] = self.mm
+
+    def test_get_no_listeners(self):
+        response = self.loop.run_until_complete(APIBusView().get(self.request))
+        json_data = self.is_valid_json(response)
+        self.assertEqual({}, json_data["properties"]["listeners"])
+        self.assertEqual(0, len(json_data["entities"]))
+
+    def test_get_listener(self):
+        self.mm.bus.listen("test:bus", lambda event: None)
+        self.mm.bus.fire("test:bus")
+        response = self.loop.run_until_complete(APIBusView().get(self.request))
+        json_data = self.is_valid_json(response)
+        self.assertEqual({"test:bus": 1}, json_data["properties"]["listeners"])
+        self.assertEqual(1, len(json_data["entities"]))
+        self.assertEqual("test:bus", json_data["entities"][0]["properties"]["eventType"])
+        self.assertEqual(1, json_data["entities"][0]["properties"]["calls"])
+
+
+class TestAPISequencesView(TestAPIBase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.mm.sequences = SequenceTracker()
+        self.request = make_mocked_request("GET", APISequencesView.url)
+        self.request.app[KEY_MM] = self.mm
+
+    def test_get_no_cameras(self):
+        response = self.loop.run_until_complete(APISequencesView().get(self.request))
+        json_data = self.is_valid_json(response)
+        self.assertEqual(0, len(json_data["entities"]))
+
+    def test_get_camera(self):
+        timestamp = datetime.now()
+        for frame_num in [1, 2, 5, 4, 4]:
+            self.mm.sequences.observe(Frame("1", timestamp, str(frame_num), "/tmp/{}.jpg".format(frame_num)))
+        response = self.loop.run_until_complete(APISequencesView().get(self.request))
+        json_data = self.is_valid_json(response)
+        self.assertEqual(1, len(json_data["entities"]))
+        self.assertEqual({"cameraId": "1", "frames": 4, "gaps": 1, "missedFrames": 2, "duplicates": 1,
+                          "reordered": 1, "missedEventStarts": 0}, json_data["entities"][0]["properties"])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+import motionmonitor
+from motionmonitor.const import EVENT_NEW_FRAME, EVENT_NEW_MOTION_FRAME
+from motionmonitor.core import EventBus
+from motionmonitor.extensions.file_watcher import FileWatcher, get_extension
+from motionmonitor.extensions.socket_server import SocketHandler
+from motionmonitor.sequence import SequenceTracker
+
+SNAPSHOT_FILENAME = "snapshots/camera%t/%Y/%m/%d/%H/%M/%S-snapshot"
+MOTION_FILENAME = "motion/camera%t/%Y%m%d/%C/%Y%m%d-%H%M%S-%q"
+
+
+class FileWatcherTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.target_dir = tempfile.mkdtemp()
+        Path(self.target_dir, "snapshots", "camera1", "2020", "06", "01").mkdir(parents=True)
+        Path(self.target_dir, "motion", "camera1").mkdir(parents=True)
+
+        self.mm = Mock()
+        self.mm.config = {"GENERAL": {"TARGET_DIR": self.target_dir,
+                                      "SNAPSHOT_FILENAME": SNAPSHOT_FILENAME,
+                                      "MOTION_FILENAME": MOTION_FILENAME},
+                          "FILE_WATCHER": {"ENABLED": "true", "GRACE_PERIOD": "0.1"}}
+        self.mm.bus = EventBus(self.mm)
+        self.mm.loop = asyncio.new_event_loop()
+        self.mm.sequences = SequenceTracker()
+
+        self.fired = []
+        self.mm.bus.listen(EVENT_NEW_FRAME, self.fired.append)
+        self.mm.bus.listen(EVENT_NEW_MOTION_FRAME, self.fired.append)
+
+        self.watcher = FileWatcher(self.mm)
+        self.mm.loop.run_until_complete(self.watcher.start_extension())
+
+    def tearDown(self) -> None:
+        self.watcher.close()
+        self.mm.loop.close()
+        shutil.rmtree(self.target_dir)
+
+    def write_file(self, relpath):
+        path = os.path.join(self.target_dir, relpath)
+        Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"jpeg")
+        return path
+
+    def run_loop(self, seconds=0.5):
+        self.mm.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def test_get_extension_disabled(self):
+        self.mm.config["FILE_WATCHER"]["ENABLED"] = "false"
+        self.assertEqual([], get_extension(self.mm))
+
+    def test_new_snapshot(self):
+        path = self.write_file("snapshots/camera1/2020/06/01/12/30/15-snapshot.jpg")
+        self.run_loop()
+
+        self.assertEqual(1, len(self.fired))
+        self.assertEqual(EVENT_NEW_FRAME, self.fired[0].event_type)
+        self.assertEqual(path, self.fired[0].data.filename)
+        self.assertEqual(datetime(2020, 6, 1, 12, 30, 15), self.fired[0].data.timestamp)
+
+    def test_ignores_motion_frames(self):
+        # The event's text in the path needn't be the id motion sends, the audit picks up any that were lost
+        self.write_file("motion/camera1/20200601/20200601123000/20200601-123015-01.jpg")
+        self.run_loop()
+        self.assertEqual(0, len(self.fired))
+
+    def test_ignores_other_files(self):
+        self.write_file("snapshots/camera1/lastsnap.jpg")
+        self.run_loop()
+        self.assertEqual(0, len(self.fired))
+
+    def test_deduplicated_against_socket(self):
+        path = self.write_file("snapshots/camera1/2020/06/01/12/30/15-snapshot.jpg")
+
+        # The socket server delivers the same frame within the grace period.
+        frame = motionmonitor.models.Frame("1", datetime(2020, 6, 1, 12, 30, 15), "1", path)
+        SocketHandler(self.mm).dispatch_frame(EVENT_NEW_FRAME, frame)
+        self.run_loop()
+
+        self.assertEqual([frame], [event.data for event in self.fired])
+
+    def test_socket_deduplicated_against_watcher(self):
+        path = self.write_file("snapshots/camera1/2020/06/01/12/30/15-snapshot.jpg")
+        self.run_loop()
+
+        # The datagram arrives after the grace period, once the watcher has fired the frame.
+        frame = motionmonitor.models.Frame("1", datetime(2020, 6, 1, 12, 30, 15), "1", path)
+        SocketHandler(self.mm).dispatch_frame(EVENT_NEW_FRAME, frame)
+
+        self.assertEqual(1, len(self.fired))
+        self.assertIsNot(frame, self.fired[0].data)
+
+    def test_unlistable_directory(self):
+        scandir = os.scandir
+
+        def failing_scandir(path):
+            if os.path.basename(path) == "13":
+                raise PermissionError("Permission denied: {}".format(path))
+            return scandir(path)
+
+        with patch("motionmonitor.extensions.file_watcher.os.scandir", failing_scandir):
+            Path(self.target_dir, "snapshots", "camera1", "2020", "06", "01", "13").mkdir()
+            path = self.write_file("snapshots/camera1/2020/06/01/12/30/15-snapshot.jpg")
+            self.run_loop()
+
+        # The events after the one for the directory that couldn't be listed are still handled
+        self.assertEqual([path], [event.data.filename for event in self.fired])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
 import asyncio
 import base64
+import os
+import tempfile
+import threading
 import unittest
 from datetime import datetime
 from unittest import mock
@@ -7,14 +10,15 @@ from unittest.mock import Mock, ANY
 
 import peewee as pw
 from aiohttp.test_utils import make_mocked_request
-from aiohttp.web_exceptions import HTTPBadRequest, HTTPNotImplemented
+from aiohttp.web_exceptions import HTTPBadRequest, HTTPNotImplemented, HTTPServiceUnavailable, HTTPGatewayTimeout
 
 import motionmonitor
-from motionmonitor.const import KEY_MM
+from motionmonitor.const import KEY_MM, EVENT_JOB
 from motionmonitor.core import EventBus
 from motionmonitor.extensions.recorder import Recorder, APISnapshotsView, APISnapshotFrameView, APIEventsView, \
     APIEventEntityView, APIEventFrameView
 from motionmonitor.extensions.recorder import models as db_models
+from motionmonitor.extensions.recorder.reader import DatabaseReader, is_in_memory, reader
 from test.unit.motionmonitor.extensions.test_api import TestAPIBase
 
 CAMERA_ID = 1
@@ -59,6 +63,75 @@ class RecorderTests(unittest.TestCase):
         self.assertEqual(1, db_models.EventFrame.select().count())
 
 
+class RecorderSqliteProfileTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.mm = Mock()
+        self.mm.config = {"RECORDER": {"URL": "sqlite:///" + os.path.join(self.directory.name, "recorder.db"),
+                                       "SQLITE_CACHE_SIZE": "-1024", "MAINTENANCE_INTERVAL": "0"}}
+        self.mm.bus = EventBus(self.mm)
+        self.mm.loop = asyncio.new_event_loop()
+        self.recorder = Recorder(self.mm)
+        self.mm.loop.run_until_complete(self.recorder.start_extension())
+        self.database = db_models.proxy.obj
+
+    def tearDown(self) -> None:
+        self.database.close()
+        self.mm.loop.close()
+        self.directory.cleanup()
+
+    def pragma(self, name):
+        return self.database.execute_sql("PRAGMA " + name).fetchone()[0]
+
+    def test_pragmas(self):
+        self.assertEqual("wal", self.pragma("journal_mode"))
+        # NORMAL
+        self.assertEqual(1, self.pragma("synchronous"))
+        self.assertEqual(5000, self.pragma("busy_timeout"))
+        self.assertEqual(-1024, self.pragma("cache_size"))
+
+    def test_other_databases(self):
+        self.mm.config["RECORDER"]["URL"] = "mysql://motion@localhost/motion"
+        self.assertEqual({}, Recorder(self.mm)._connect_params())
+
+    def test_maintain(self):
+        jobs = []
+        self.mm.bus.listen(EVENT_JOB, lambda event: jobs.append(event.data.progress))
+        descriptions = []
+        self.mm.bus.listen(EVENT_JOB, lambda event: descriptions.append(event.data.progress_description))
+        self.mm.bus.fire(motionmonitor.const.EVENT_NEW_FRAME,
+                         motionmonitor.models.Frame("1", datetime.now(), 0, "filename.jpg"))
+
+        self.mm.loop.run_until_complete(self.recorder.maintain())
+        self.assertEqual([0, 100], jobs)
+        self.assertRegex(descriptions[-1], r"^Checkpointed [0-9]+ of [0-9]+ pages$")
+        self.assertEqual(1, db_models.Frame.select().count())
+
+    def test_close(self):
+        self.mm.config["RECORDER"]["MAINTENANCE_INTERVAL"] = "60"
+        recorder = Recorder(self.mm)
+        self.mm.loop.run_until_complete(recorder.start_extension())
+        self.assertEqual(1, len(asyncio.all_tasks(self.mm.loop)))
+
+        with mock.patch.object(reader, "close") as close:
+            recorder.close()
+        close.assert_called_once_with()
+        # The maintenance loop is cancelled
+        self.mm.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(set(), asyncio.all_tasks(self.mm.loop))
+        db_models.proxy.obj.close()
+
+    def test_readers_are_read_only(self):
+        def write():
+            db_models.Frame.create(camera_id=1, timestamp=datetime.now(), frame=0, filename="filename.jpg")
+
+        with self.assertRaises(pw.OperationalError):
+            self.mm.loop.run_until_complete(reader.run("write", write))
+        # The writer isn't
+        write()
+        self.assertEqual(1, self.mm.loop.run_until_complete(reader.run("count", db_models.Frame.select().count)))
+
+
 class RecorderAPISnapshotsViewTests(TestAPIBase):
     def setUp(self) -> None:
         super().setUp()
@@ -260,5 +333,101 @@ class RecorderAPIEventFrameViewTests(TestAPIBase):
             self.loop.run_until_complete(APIEventFrameView().delete(self.request))
 
 
+class DatabaseReaderTests(TestAPIBase):
+    def setUp(self) -> None:
+        super().setUp()
+
+        # A file, rather than in memory, so that the pool's threads see the same database
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = pw.SqliteDatabase(os.path.join(self.directory.name, "recorder.db"))
+        db_models.proxy.initialize(self.database)
+        self.database.create_tables([db_models.Event, db_models.EventFrame], safe=False)
+        self.reader = DatabaseReader(workers=2, limit=2, timeout=5)
+        self.release = threading.Event()
+
+    def tearDown(self) -> None:
+        self.release.set()
+        self.reader.close()
+        self.database.close()
+        self.directory.cleanup()
+        super().tearDown()
+
+    def blocked(self):
+        self.release.wait(5)
+        return threading.current_thread().name
+
+    def test_in_memory(self):
+        self.assertTrue(is_in_memory(pw.SqliteDatabase(":memory:")))
+        self.assertTrue(is_in_memory(pw.SqliteDatabase("file:recorder?mode=memory&cache=shared", uri=True)))
+        self.assertFalse(is_in_memory(self.database))
+
+    def test_runs_off_the_loop(self):
+        thread = self.loop.run_until_complete(self.reader.run("thread", lambda: threading.current_thread().name))
+        self.assertTrue(thread.startswith("recorder-db"))
+
+        db_models.Event(event_id=EVENT_ID, camera_id=CAMERA_ID, start_time=datetime.now()).save()
+        events = self.loop.run_until_complete(self.reader.run("events", list, db_models.Event.select()))
+        self.assertEqual([EVENT_ID], [event.event_id for event in events])
+        self.assertEqual(0, self.reader.in_flight)
+
+    def test_in_memory_runs_on_the_loop(self):
+        db_models.proxy.initialize(pw.SqliteDatabase(":memory:"))
+        thread = self.loop.run_until_complete(self.reader.run("thread", lambda: threading.current_thread().name))
+        self.assertEqual(threading.current_thread().name, thread)
+
+    def test_limit(self):
+        async def run():
+            queries = [asyncio.ensure_future(self.reader.run("blocked", self.blocked)) for _ in range(2)]
+            await asyncio.sleep(0)
+            with self.assertRaises(HTTPServiceUnavailable):
+                await self.reader.run("blocked", self.blocked)
+            self.release.set()
+            return await asyncio.gather(*queries)
+
+        self.assertEqual(2, len(self.loop.run_until_complete(run())))
+        self.assertEqual(0, self.reader.in_flight)
+
+    def test_timeout(self):
+        self.reader.configure(workers=1, limit=2, timeout=0.05)
+        with self.assertRaises(HTTPGatewayTimeout):
+            self.loop.run_until_complete(self.reader.run("blocked", self.blocked))
+
+        # Still running, so still counted against the limit
+        self.assertEqual(1, self.reader.in_flight)
+        self.release.set()
+        thread = self.loop.run_until_complete(self.reader.run("thread", lambda: threading.current_thread().name))
+        self.assertTrue(thread.startswith("recorder-db"))
+        self.assertEqual(0, self.reader.in_flight)
+
+    def test_close_cancels_waiting(self):
+        self.reader.configure(workers=1, limit=2, timeout=5)
+
+        async def run():
+            running = asyncio.ensure_future(self.reader.run("blocked", self.blocked))
+            waiting = asyncio.ensure_future(self.reader.run("blocked", self.blocked))
+            await asyncio.sleep(0)
+            self.reader.close()
+            self.release.set()
+            return await asyncio.gather(running, waiting, return_exceptions=True)
+
+        (running, waiting) = self.loop.run_until_complete(run())
+        self.assertTrue(running.startswith("recorder-db"))
+        self.assertIsInstance(waiting, asyncio.CancelledError)
+        self.assertEqual(0, self.reader.in_flight)
+
+    def test_view(self):
+        now = datetime.strptime("20200601120000", "%Y%m%d%H%M%S")
+        db_models.Event(event_id=EVENT_ID, camera_id=CAMERA_ID, start_time=now).save()
+        db_models.EventFrame(event_id=EVENT_ID, camera_id=CAMERA_ID, timestamp=now, frame=1, score=100,
+                             filename="filename.jpg").save()
+
+        request = make_mocked_request("GET", APIEventEntityView.url, match_info={"event_id": EVENT_ID})
+        request.app[KEY_MM] = self.mm
+        response = self.loop.run_until_complete(APIEventEntityView().get(request))
+        json_data = self.is_valid_json(response)
+        self.assertEqual(2, len(json_data["entities"]))
+        self.assertEqual(0, reader.in_flight)
+
+
 if __name__ == '__main__':
     unittest.main()
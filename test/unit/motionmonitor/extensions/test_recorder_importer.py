@@ -0,0 +1,143 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from pathlib import Path
+from unittest.mock import patch
+
+import peewee as pw
+
+from motionmonitor.archive import FilenameTemplate
+from motionmonitor.extensions.recorder import importer, migrations, models as db_models
+from motionmonitor.extensions.recorder.partitions import partitioner, PERIOD_DAY, PERIOD_NONE
+
+SNAPSHOT_FILENAME = "snapshots/camera%t/%Y/%m/%d/%H/%M/%S-snapshot"
+MOTION_FILENAME = "motion/camera%t/%Y%m%d/%C/%Y%m%d-%H%M%S-%q"
+
+
+def index_columns(database, table):
+    return sorted(index.columns for index in database.get_indexes(table))
+
+
+class ImporterTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.target_dir = os.path.join(self.directory.name, "archive")
+        self.state_file = os.path.join(self.directory.name, "import.json")
+        self.database = pw.SqliteDatabase(os.path.join(self.directory.name, "recorder.db"))
+        db_models.proxy.initialize(self.database)
+
+        for camera in ("1", "2"):
+            for day in ("01", "02"):
+                for second in ("00", "30"):
+                    self.create_file("snapshots/camera{}/2020/06/{}/12/00/{}-snapshot.jpg".format(camera, day, second))
+        # An event that runs past midnight, into a second date directory
+        self.create_file("motion/camera1/20200601/event1/20200601-235959-01.jpg")
+        self.create_file("motion/camera1/20200602/event1/20200602-000000-01.jpg")
+        self.create_file("motion/camera1/20200602/event1/20200602-000000-02.jpg")
+        self.create_file("motion/camera2/20200601/event2/20200601-120000-01.jpg")
+
+    def tearDown(self) -> None:
+        partitioner.configure(None, PERIOD_NONE)
+        self.database.close()
+        self.directory.cleanup()
+
+    def create_file(self, relpath):
+        path = Path(self.target_dir, relpath)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+
+    def run_importer(self, partition_period=PERIOD_NONE, **kwargs):
+        migrations.setup(self.database, {"PARTITION_PERIOD": partition_period}, background=False)
+        instance = importer.Importer(self.database, self.target_dir, FilenameTemplate(SNAPSHOT_FILENAME),
+                                     FilenameTemplate(MOTION_FILENAME), self.state_file, workers=2, **kwargs)
+        instance.run()
+        return instance
+
+    def count(self, model):
+        return sum(table_model.select().count() for table_model in partitioner.models_for(model))
+
+    def test_import(self):
+        instance = self.run_importer(transaction_rows=3)
+        self.assertEqual(12, instance.loaded)
+        self.assertEqual(8, self.count(db_models.Frame))
+        self.assertEqual(4, self.count(db_models.EventFrame))
+        self.assertEqual({("event1", 1, datetime(2020, 6, 1, 23, 59, 59)), ("event2", 2, datetime(2020, 6, 1, 12))},
+                         {(event.event_id, event.camera_id, event.start_time) for event in db_models.Event.select()})
+        frame = db_models.Frame.get(db_models.Frame.filename.endswith("camera2/2020/06/02/12/00/30-snapshot.jpg"))
+        self.assertEqual(datetime(2020, 6, 2, 12, 0, 30), frame.timestamp)
+
+        # The indexes are rebuilt
+        self.assertEqual([["archive", "timestamp"], ["filename"], ["timestamp", "camera_id", "frame"]],
+                         index_columns(self.database, "snapshot_frame"))
+        self.assertEqual([["event_id", "camera_id", "timestamp", "frame"],
+                          ["event_id", "timestamp", "camera_id", "frame", "score"]],
+                         index_columns(self.database, "motion_frame"))
+
+        with open(self.state_file) as state_file:
+            done = json.load(state_file)["done"]
+        self.assertEqual(["snapshots/camera1/2020/06/01", "snapshots/camera1/2020/06/02", "snapshots/camera2/2020/06/01",
+                          "snapshots/camera2/2020/06/02"], sorted(done["snapshots"]))
+        self.assertEqual(["motion/camera1/20200601", "motion/camera1/20200602", "motion/camera2/20200601"],
+                         sorted(done["motion"]))
+
+    def test_resume(self):
+        # As though camera 1's snapshots had been imported before
+        with open(self.state_file, "w") as state_file:
+            json.dump({"done": {"snapshots": ["snapshots/camera1/2020"]}}, state_file)
+        self.run_importer()
+        self.assertEqual(4, self.count(db_models.Frame))
+        self.assertEqual(0, db_models.Frame.select().where(db_models.Frame.camera_id == 1).count())
+
+        # Frames already in the database are skipped
+        os.remove(self.state_file)
+        self.run_importer()
+        self.assertEqual(8, self.count(db_models.Frame))
+        self.assertEqual(4, self.count(db_models.EventFrame))
+        self.assertEqual(2, db_models.Event.select().count())
+
+    def test_partitions(self):
+        self.run_importer(partition_period=PERIOD_DAY)
+        self.assertEqual(0, db_models.Frame.select().count())
+        self.assertEqual(4, partitioner.model_for(db_models.Frame, datetime(2020, 6, 2)).select().count())
+        self.assertEqual([["archive", "timestamp"], ["filename"], ["timestamp", "camera_id", "frame"]],
+                         index_columns(self.database, "snapshot_frame_20200601"))
+
+    def test_failure_rebuilds_indexes(self):
+        def fail(timestamp):
+            raise RuntimeError("Disk full")
+
+        with patch.object(importer, "snapshot_keep_tier", fail), self.assertRaises(RuntimeError):
+            self.run_importer()
+        self.assertEqual([["archive", "timestamp"], ["filename"], ["timestamp", "camera_id", "frame"]],
+                         index_columns(self.database, "snapshot_frame"))
+
+    def test_setup_restores_indexes(self):
+        # As though an import had been killed before it could rebuild them
+        migrations.setup(self.database, {}, background=False)
+        migrations.drop_index(self.database, db_models.Frame, ("archive", "timestamp"))
+        migrations.drop_index(self.database, db_models.EventFrame, ("event_id", "timestamp", "camera_id", "frame",
+                                                                    "score"))
+
+        migrations.setup(self.database, {}, background=False)
+        self.assertEqual([["archive", "timestamp"], ["filename"], ["timestamp", "camera_id", "frame"]],
+                         index_columns(self.database, "snapshot_frame"))
+        self.assertEqual([["event_id", "camera_id", "timestamp", "frame"],
+                          ["event_id", "timestamp", "camera_id", "frame", "score"]],
+                         index_columns(self.database, "motion_frame"))
+
+    def test_keep_indexes(self):
+        dropped = []
+        original = migrations.drop_index_named
+        migrations.drop_index_named = lambda *args: dropped.append(args)
+        try:
+            self.run_importer(drop_indexes=False)
+        finally:
+            migrations.drop_index_named = original
+        self.assertEqual([], dropped)
+        self.assertEqual(8, self.count(db_models.Frame))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,289 @@
+import asyncio
+import logging
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from unittest.mock import Mock, patch
+
+import peewee as pw
+
+import motionmonitor
+
+from motionmonitor.const import EVENT_JOB
+from motionmonitor.core import EventBus
+from motionmonitor.extensions.recorder import Recorder, APISnapshotsView, APISnapshotFrameView, APIEventEntityView, \
+    APIEventFrameView
+from motionmonitor.extensions.recorder import migrations, models as db_models
+from motionmonitor.extensions.recorder.partitions import partitioner, PERIOD_DAY, PERIOD_NONE
+
+# The schema as it was at version 1, before schema_version
+SCHEMA_1 = [
+    'CREATE TABLE "motion_event" ("id" INTEGER NOT NULL PRIMARY KEY, "camera_id" INTEGER NOT NULL, '
+    '"event_id" VARCHAR(255) NOT NULL, "start_time" DATETIME NOT NULL)',
+    'CREATE UNIQUE INDEX "event_event_id_camera_id" ON "motion_event" ("event_id", "camera_id")',
+    'CREATE INDEX "event_start_time_camera_id" ON "motion_event" ("start_time", "camera_id")',
+    'CREATE TABLE "snapshot_frame" ("camera_id" INTEGER NOT NULL, "timestamp" DATETIME NOT NULL, "frame" INTEGER, '
+    '"filename" VARCHAR(255), "archive" INTEGER)',
+    'CREATE UNIQUE INDEX "frame_filename" ON "snapshot_frame" ("filename")',
+    'CREATE INDEX "frame_timestamp_camera_id" ON "snapshot_frame" ("timestamp", "camera_id")',
+    'CREATE INDEX "frame_archive_timestamp" ON "snapshot_frame" ("archive", "timestamp")',
+    'CREATE TABLE "motion_frame" ("camera_id" INTEGER NOT NULL, "event_id" VARCHAR(255) NOT NULL, '
+    '"filename" VARCHAR(255), "frame" INTEGER, "score" INTEGER, "timestamp" DATETIME NOT NULL)',
+    'CREATE INDEX "eventframe_event_id" ON "motion_frame" ("event_id")',
+    'CREATE UNIQUE INDEX "eventframe_event_id_camera_id_timestamp_frame" ON "motion_frame" '
+    '("event_id", "camera_id", "timestamp", "frame")',
+]
+
+
+def index_columns(database, table):
+    return sorted(index.columns for index in database.get_indexes(table))
+
+
+class DatabaseTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "recorder.db")
+        self.mm = Mock()
+        self.mm.config = {"RECORDER": {"URL": "sqlite:///" + self.path, "MAINTENANCE_INTERVAL": "0"}}
+        self.mm.bus = EventBus(self.mm)
+        self.mm.loop = asyncio.new_event_loop()
+
+    def tearDown(self) -> None:
+        partitioner.configure(None, PERIOD_NONE)
+        db_models.set_timestamp_storage(db_models.TIMESTAMPS_DATETIME)
+        if db_models.proxy.obj is not None:
+            db_models.proxy.obj.close()
+        self.mm.loop.close()
+        self.directory.cleanup()
+
+    def start(self):
+        self.mm.loop.run_until_complete(Recorder(self.mm).start_extension())
+        # The migrations left to the background
+        pending = asyncio.all_tasks(self.mm.loop)
+        if pending:
+            self.mm.loop.run_until_complete(asyncio.gather(*pending))
+        return db_models.proxy.obj
+
+    def create_version_1(self):
+        database = pw.SqliteDatabase(self.path)
+        for statement in SCHEMA_1:
+            database.execute_sql(statement)
+        database.execute_sql('INSERT INTO "snapshot_frame" VALUES (1, \'2020-06-01 12:00:00\', 3, \'1.jpg\', 0)')
+        return database
+
+
+class MigrationTests(DatabaseTestCase):
+    def test_fresh(self):
+        database = self.start()
+        self.assertEqual(db_models.SCHEMA_VERSION, migrations.schema_version(database))
+        self.assertIn(["timestamp", "camera_id", "frame"], index_columns(database, "snapshot_frame"))
+
+    def test_from_version_1(self):
+        self.create_version_1().close()
+        jobs = []
+        self.mm.bus.listen(EVENT_JOB, lambda event: jobs.append((event.data.progress, event.data.progress_description)))
+
+        database = self.start()
+        self.assertEqual(db_models.SCHEMA_VERSION, migrations.schema_version(database))
+        self.assertEqual([["archive", "timestamp"], ["filename"], ["timestamp", "camera_id", "frame"]],
+                         index_columns(database, "snapshot_frame"))
+        self.assertEqual([["event_id", "camera_id", "timestamp", "frame"],
+                          ["event_id", "timestamp", "camera_id", "frame", "score"]],
+                         index_columns(database, "motion_frame"))
+        self.assertEqual(1, db_models.Frame.select().count())
+
+        # Nothing left to apply
+        self.assertEqual([], migrations.migrate(database, migrations.schema_version(database)))
+        # Applied in the background, as a job
+        self.assertEqual((100, "Migrated to version 2"), jobs[-1])
+
+    def test_foreground(self):
+        self.create_version_1().close()
+        self.mm.config["RECORDER"]["BACKGROUND_MIGRATIONS"] = "false"
+        self.mm.loop.run_until_complete(Recorder(self.mm).start_extension())
+        self.assertEqual(set(), asyncio.all_tasks(self.mm.loop))
+        self.assertEqual(db_models.SCHEMA_VERSION, migrations.schema_version(db_models.proxy.obj))
+
+    def test_write_during_background_migration(self):
+        self.create_version_1().close()
+        started = threading.Event()
+        release = threading.Event()
+        apply = migrations.apply
+
+        def blocked_apply(database, migration):
+            # Holds the write lock, as an index build does, until the frame has been written
+            with database.atomic("IMMEDIATE"):
+                started.set()
+                release.wait(10)
+                apply(database, migration)
+
+        async def write_frame():
+            while not started.is_set():
+                await asyncio.sleep(0.01)
+            self.mm.bus.fire(motionmonitor.const.EVENT_NEW_FRAME,
+                             motionmonitor.models.Frame("1", datetime(2020, 6, 2, 12), 1, "2.jpg"))
+            release.set()
+
+        with patch.object(migrations, "apply", blocked_apply):
+            self.mm.loop.run_until_complete(Recorder(self.mm).start_extension())
+            self.mm.loop.create_task(write_frame())
+            self.mm.loop.run_until_complete(asyncio.gather(*asyncio.all_tasks(self.mm.loop)))
+
+        database = db_models.proxy.obj
+        self.assertEqual(db_models.SCHEMA_VERSION, migrations.schema_version(database))
+        self.assertEqual(["1.jpg", "2.jpg"], [frame.filename for frame in
+                                              db_models.Frame.select().order_by(db_models.Frame.timestamp)])
+
+    def test_background_pending(self):
+        database = self.create_version_1()
+        db_models.proxy.initialize(database)
+        remaining = migrations.migrate(database, migrations.schema_version(database))
+        self.assertEqual([2], [migration.version for migration in remaining])
+        # Recorded as applied only once it is
+        self.assertEqual(1, migrations.schema_version(database))
+        migrations.apply(database, remaining[0])
+        self.assertEqual(2, migrations.schema_version(database))
+
+    def test_update_in_batches(self):
+        database = self.create_version_1()
+        db_models.proxy.initialize(database)
+        database.execute_sql('INSERT INTO "snapshot_frame" VALUES (1, \'2020-06-01 12:00:01\', 4, \'2.jpg\', 0), '
+                             '(1, \'2020-06-01 12:00:02\', 5, \'3.jpg\', 0), (2, \'2020-06-01 12:00:03\', 1, '
+                             '\'4.jpg\', 0), (2, \'2020-06-01 12:00:04\', 2, \'5.jpg\', 1)')
+        frame = db_models.Frame
+
+        updated = migrations.update_in_batches(database, frame, {frame.archive: 1}, frame.archive == 0,
+                                               batch_size=2, pause=0)
+        self.assertEqual(4, updated)
+        self.assertEqual(5, frame.select().where(frame.archive == 1).count())
+        # Picked up again, with nothing left to do
+        self.assertEqual(0, migrations.update_in_batches(database, frame, {frame.archive: 1}, frame.archive == 0,
+                                                         batch_size=2, pause=0))
+
+    def test_partitions(self):
+        database = pw.SqliteDatabase(self.path)
+        for statement in SCHEMA_1:
+            database.execute_sql(statement)
+        database.execute_sql('CREATE TABLE "snapshot_frame_20200601" ("camera_id" INTEGER NOT NULL, '
+                             '"timestamp" DATETIME NOT NULL, "frame" INTEGER, "filename" VARCHAR(255), '
+                             '"archive" INTEGER)')
+        database.execute_sql('CREATE INDEX "frame_20200601_timestamp_camera_id" ON "snapshot_frame_20200601" '
+                             '("timestamp", "camera_id")')
+        database.close()
+
+        self.mm.config["RECORDER"]["PARTITION_PERIOD"] = PERIOD_DAY
+        database = self.start()
+        self.assertEqual([["timestamp", "camera_id", "frame"]], index_columns(database, "snapshot_frame_20200601"))
+
+
+class TimestampStorageTests(DatabaseTestCase):
+    def save_frames(self):
+        for second in range(3):
+            db_models.Frame.from_native(motionmonitor.models.Frame(1, datetime(2020, 6, 1, 12, 0, second), second,
+                                                                   "frame-{}.jpg".format(second))).save()
+
+    def test_epoch(self):
+        self.mm.config["RECORDER"]["TIMESTAMPS"] = db_models.TIMESTAMPS_EPOCH
+        database = self.start()
+        self.save_frames()
+
+        self.assertEqual(("integer", 1591012800),
+                         database.execute_sql('SELECT typeof("timestamp"), "timestamp" FROM "snapshot_frame" '
+                                              'ORDER BY "timestamp" LIMIT 1').fetchone())
+        frame = db_models.Frame.get(db_models.Frame.frame == 1)
+        self.assertEqual(datetime(2020, 6, 1, 12, 0, 1), frame.to_native().timestamp)
+        self.assertEqual(["20200601120001", "20200601120002"],
+                         [db_models.format_timestamp(frame.timestamp) for frame in APISnapshotsView._query(
+                             datetime(2020, 6, 1, 12, 0, 1), None)])
+        self.assertIsNotNone(APISnapshotFrameView._query(1, datetime(2020, 6, 1, 12, 0, 2), 2))
+
+    def test_storage_kept(self):
+        self.mm.config["RECORDER"]["TIMESTAMPS"] = db_models.TIMESTAMPS_EPOCH
+        self.start().close()
+        self.mm.config["RECORDER"]["TIMESTAMPS"] = db_models.TIMESTAMPS_DATETIME
+        database = self.start()
+        self.assertEqual(db_models.TIMESTAMPS_EPOCH, db_models.timestamp_storage())
+        self.assertEqual(db_models.TIMESTAMPS_EPOCH, migrations.stored_timestamps(database))
+
+    def test_datetime_kept(self):
+        self.create_version_1().close()
+        self.mm.config["RECORDER"]["TIMESTAMPS"] = db_models.TIMESTAMPS_EPOCH
+        self.start()
+        self.save_frames()
+        self.assertEqual(db_models.TIMESTAMPS_DATETIME, db_models.timestamp_storage())
+        self.assertEqual(4, db_models.Frame.select().where(db_models.Frame.timestamp >= datetime(2020, 6, 1)).count())
+
+    def test_format_timestamp(self):
+        for value in (datetime(2020, 6, 1, 12, 0, 1), "2020-06-01 12:00:01", "2020-06-01 12:00:01.5", 1591012801):
+            with self.subTest(value=value):
+                self.assertEqual("20200601120001", db_models.format_timestamp(value))
+
+
+class QueryPlanTests(unittest.TestCase):
+    """Fails if one of the API's queries of the database stops using an index for its lookup, or has to sort."""
+
+    def setUp(self) -> None:
+        self.database = pw.SqliteDatabase(":memory:")
+        db_models.proxy.initialize(self.database)
+        self.database.create_tables([db_models.Event, db_models.Frame, db_models.EventFrame])
+        now = datetime(2020, 6, 1, 12, 0, 0)
+        db_models.Event.create(event_id="1", camera_id=1, start_time=now)
+        for i in range(100):
+            db_models.Frame.create(camera_id=i % 4, timestamp=now, frame=i, filename="{}.jpg".format(i))
+            db_models.EventFrame.create(camera_id=1, event_id=str(i % 10), timestamp=now, frame=i, score=i,
+                                        filename="{}.jpg".format(i))
+
+    def plans(self, function, *args) -> [str]:
+        """The details of the query plans of the statements that the function executes."""
+        statements = []
+        handler = logging.Handler()
+        handler.emit = lambda record: statements.append(record.msg)
+        logger = logging.getLogger("peewee")
+        level = logger.level
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+        try:
+            function(*args)
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(level)
+
+        details = []
+        for (sql, params) in statements:
+            details.extend(row[3] for row in self.database.execute_sql("EXPLAIN QUERY PLAN " + sql, params))
+        return details
+
+    def assertSearches(self, details):
+        self.assertTrue(details)
+        for detail in details:
+            self.assertTrue(detail.startswith("SEARCH"), detail)
+            self.assertNotIn("TEMP B-TREE", detail)
+
+    def test_snapshot_frame(self):
+        details = self.plans(APISnapshotFrameView._query, 1, datetime(2020, 6, 1, 12, 0, 0), 3)
+        self.assertSearches(details)
+        self.assertIn("(timestamp=? AND camera_id=? AND frame=?)", details[0])
+
+    def test_snapshots_in_range(self):
+        details = self.plans(APISnapshotsView._query, datetime(2020, 6, 1), datetime(2020, 6, 2))
+        self.assertSearches(details)
+        self.assertIn("COVERING INDEX", details[0])
+
+    def test_snapshots(self):
+        for detail in self.plans(APISnapshotsView._query, None, None):
+            self.assertIn("COVERING INDEX", detail)
+
+    def test_event_entity(self):
+        details = self.plans(APIEventEntityView._query, "1")
+        self.assertSearches(details)
+        # The event's frames, in order, with their scores, from the index alone
+        self.assertIn("COVERING INDEX", details[-1])
+
+    def test_event_frame(self):
+        self.assertSearches(self.plans(APIEventFrameView._query, "1", datetime(2020, 6, 1, 12, 0, 0), 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,7 @@ from datetime import datetime
 import peewee as pw
 
 import motionmonitor
+from motionmonitor.const import KEEP_TIER_7_DAYS, KEEP_TIER_FOREVER
 from motionmonitor.extensions.recorder import models
 from motionmonitor.extensions.recorder.models import Event, Frame, EventFrame
 
@@ -64,6 +65,14 @@ class FrameTableTests(unittest.TestCase):
         frames = Frame.select()
         self.assertEqual(0, len(frames))
 
+    def test_from_native_keep_tier(self):
+        midday = datetime(2020, 6, 1, 12, 0, 0)
+        e = motionmonitor.models.Frame(CAMERA_ID, midday, 0, "filename.jpg")
+        self.assertEqual(KEEP_TIER_FOREVER, Frame.from_native(e).archive)
+
+        e = motionmonitor.models.Frame(CAMERA_ID, midday.replace(minute=1), 0, "filename.jpg")
+        self.assertEqual(KEEP_TIER_7_DAYS, Frame.from_native(e).archive)
+
     def test_to_native(self):
         now = datetime.now()
         filename = "filename.jpg"
@@ -0,0 +1,262 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from datetime import date, datetime, timedelta
+from unittest import mock
+from unittest.mock import Mock
+
+import peewee as pw
+from aiohttp.test_utils import make_mocked_request
+from aiohttp.web_exceptions import HTTPBadRequest
+
+import motionmonitor
+from motionmonitor.const import KEY_MM, EVENT_JOB
+from motionmonitor.core import EventBus
+from motionmonitor.extensions.recorder import Recorder, APISnapshotsView, APISnapshotFrameView, APIEventEntityView
+from motionmonitor.extensions.recorder import models as db_models
+from motionmonitor.extensions.recorder.partitions import partitioner, period_start, period_end, PERIOD_DAY, \
+    PERIOD_NONE, PERIOD_WEEK
+from test.unit.motionmonitor.extensions.test_api import TestAPIBase
+
+EVENT_ID = "202006011200-1"
+
+
+def snapshot(timestamp: datetime, frame=0):
+    return db_models.Frame(camera_id=1, timestamp=timestamp, frame=frame,
+                           filename="{}-{}.jpg".format(timestamp.isoformat(), frame))
+
+
+def event_frame(timestamp: datetime, score=10):
+    return db_models.EventFrame(camera_id=1, event_id=EVENT_ID, timestamp=timestamp, frame=0, score=score,
+                                filename="{}.jpg".format(timestamp.isoformat()))
+
+
+class PeriodTests(unittest.TestCase):
+    def test_day(self):
+        self.assertEqual(date(2020, 6, 3), period_start(datetime(2020, 6, 3, 23, 59), PERIOD_DAY))
+        self.assertEqual(date(2020, 6, 4), period_end(date(2020, 6, 3), PERIOD_DAY))
+
+    def test_week(self):
+        # Weeks start on a Monday
+        self.assertEqual(date(2020, 6, 1), period_start(datetime(2020, 6, 7, 12, 0), PERIOD_WEEK))
+        self.assertEqual(date(2020, 6, 8), period_start(date(2020, 6, 8), PERIOD_WEEK))
+        self.assertEqual(date(2020, 6, 8), period_end(date(2020, 6, 1), PERIOD_WEEK))
+
+
+class SqlitePartitionTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.database = pw.SqliteDatabase(":memory:")
+        db_models.proxy.initialize(self.database)
+        self.database.create_tables([db_models.Event, db_models.Frame, db_models.EventFrame])
+        partitioner.configure(self.database, PERIOD_DAY)
+
+    def tearDown(self) -> None:
+        partitioner.configure(None, PERIOD_NONE)
+
+    def test_unknown_period(self):
+        with self.assertRaises(ValueError):
+            partitioner.configure(self.database, "month")
+
+    def test_route(self):
+        partitioner.route(snapshot(datetime(2020, 6, 1, 23, 59))).save()
+        partitioner.route(snapshot(datetime(2020, 6, 2, 0, 0))).save()
+        partitioner.route(event_frame(datetime(2020, 6, 2, 0, 0))).save()
+        # Events aren't partitioned
+        row = db_models.Event(event_id=EVENT_ID, camera_id=1, start_time=datetime(2020, 6, 1))
+        self.assertIs(row, partitioner.route(row))
+
+        self.assertEqual([date(2020, 6, 1), date(2020, 6, 2)], partitioner.partitions(db_models.Frame))
+        self.assertIn("snapshot_frame_20200601", self.database.get_tables())
+        self.assertIn("motion_frame_20200602", self.database.get_tables())
+        self.assertEqual(0, db_models.Frame.select().count())
+        self.assertEqual([1, 1], [model.select().count() for model in partitioner.models_for(db_models.Frame)][1:])
+
+    def test_models_for(self):
+        for day in (1, 2, 3):
+            partitioner.route(snapshot(datetime(2020, 6, day, 12, 0))).save()
+
+        tables = [model._meta.table_name for model in
+                  partitioner.models_for(db_models.Frame, datetime(2020, 6, 2, 23, 0), datetime(2020, 6, 3, 1, 0))]
+        self.assertEqual(["snapshot_frame", "snapshot_frame_20200602", "snapshot_frame_20200603"], tables)
+        self.assertEqual(4, len(partitioner.models_for(db_models.Frame)))
+        self.assertEqual(3, len(partitioner.models_for(db_models.Frame, start=datetime(2020, 6, 2))))
+
+    def test_find_existing(self):
+        partitioner.route(snapshot(datetime(2020, 6, 1, 12, 0))).save()
+        partitioner.configure(self.database, PERIOD_DAY)
+        self.assertEqual([date(2020, 6, 1)], partitioner.partitions(db_models.Frame))
+        self.assertEqual(1, partitioner.models_for(db_models.Frame)[1].select().count())
+
+    def test_prepare(self):
+        partitioner.prepare(datetime(2020, 6, 7, 12, 0))
+        self.assertEqual([date(2020, 6, 7), date(2020, 6, 8)], partitioner.partitions(db_models.EventFrame))
+
+    def test_drop_before(self):
+        for day in (1, 2, 3):
+            partitioner.route(snapshot(datetime(2020, 6, day, 12, 0))).save()
+            partitioner.route(event_frame(datetime(2020, 6, day, 12, 0))).save()
+        # Rows from before the tables were partitioned
+        snapshot(datetime(2020, 5, 1)).save()
+
+        # The partition the cutoff falls in is kept whole
+        self.assertEqual(2, partitioner.drop_before(datetime(2020, 6, 2, 18, 0)))
+        self.assertEqual([date(2020, 6, 2), date(2020, 6, 3)], partitioner.partitions(db_models.Frame))
+        self.assertEqual([date(2020, 6, 2), date(2020, 6, 3)], partitioner.partitions(db_models.EventFrame))
+        self.assertNotIn("snapshot_frame_20200601", self.database.get_tables())
+        self.assertEqual(0, db_models.Frame.select().count())
+
+    def test_drop_before_unpartitioned(self):
+        partitioner.configure(self.database, PERIOD_NONE)
+        for day in (1, 2, 3):
+            partitioner.route(snapshot(datetime(2020, 6, day, 12, 0))).save()
+        self.assertEqual(2, partitioner.drop_before(datetime(2020, 6, 3)))
+        self.assertEqual(1, db_models.Frame.select().count())
+
+
+class RecorderRetentionTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.mm = Mock()
+        self.mm.config = {"RECORDER": {"URL": "sqlite:///" + os.path.join(self.directory.name, "recorder.db"),
+                                       "PARTITION_PERIOD": "day", "RETENTION_DAYS": "7", "MAINTENANCE_INTERVAL": "0"}}
+        self.mm.bus = EventBus(self.mm)
+        self.mm.loop = asyncio.new_event_loop()
+        self.mm.loop.run_until_complete(Recorder(self.mm).start_extension())
+
+    def tearDown(self) -> None:
+        partitioner.configure(None, PERIOD_NONE)
+        db_models.proxy.obj.close()
+        self.mm.loop.close()
+        self.directory.cleanup()
+
+    def test_maintain(self):
+        now = datetime.now()
+        for age in (30, 8, 0):
+            frame = motionmonitor.models.Frame("1", now - timedelta(days=age), 0, "{}.jpg".format(age))
+            self.mm.bus.fire(motionmonitor.const.EVENT_NEW_FRAME, frame)
+        # Today's and tomorrow's partitions were created on start
+        self.assertEqual(4, len(partitioner.partitions(db_models.Frame)))
+
+        descriptions = []
+        self.mm.bus.listen(EVENT_JOB, lambda event: descriptions.append(event.data.progress_description))
+        self.mm.loop.run_until_complete(Recorder(self.mm).maintain())
+
+        self.assertRegex(descriptions[-1], r"^Dropped 2 partitions, Checkpointed [0-9]+ of [0-9]+ pages$")
+        self.assertEqual([period_start(now, PERIOD_DAY), period_start(now + timedelta(days=1), PERIOD_DAY)],
+                         partitioner.partitions(db_models.Frame))
+        self.assertEqual(1, sum(model.select().count() for model in partitioner.models_for(db_models.Frame)))
+
+
+class MySQLPartitionTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.database = pw.MySQLDatabase("motion")
+        self.database.execute_sql = Mock()
+        self.statements = []
+        # The first row of each table, None for an empty table
+        self.first_row = None
+
+        def execute_sql(sql, params=None):
+            self.statements.append(sql)
+            cursor = Mock()
+            cursor.fetchall.return_value = []
+            cursor.fetchone.return_value = self.first_row
+            return cursor
+        self.database.execute_sql.side_effect = execute_sql
+
+    def tearDown(self) -> None:
+        partitioner.configure(None, PERIOD_NONE)
+
+    def test_partition(self):
+        partitioner.configure(self.database, PERIOD_WEEK)
+        self.assertTrue(partitioner.native)
+        self.assertIn("ALTER TABLE `snapshot_frame` DROP INDEX `frame_filename`, "
+                      "ADD UNIQUE INDEX `frame_filename_timestamp` (`filename`, `timestamp`)", self.statements)
+        self.assertIn("ALTER TABLE `motion_frame` PARTITION BY RANGE (TO_DAYS(`timestamp`)) "
+                      "(PARTITION pmax VALUES LESS THAN MAXVALUE)", self.statements)
+
+        # Rows are written to the table, and MySQL puts them in their partition
+        row = snapshot(datetime(2020, 6, 3))
+        self.assertIs(row, partitioner.route(row))
+        self.assertEqual([db_models.Frame], partitioner.models_for(db_models.Frame, datetime(2020, 6, 3)))
+
+        del self.statements[:]
+        partitioner.prepare(datetime(2020, 6, 3))
+        self.assertEqual(4, len(self.statements))
+        self.assertEqual("ALTER TABLE `snapshot_frame` REORGANIZE PARTITION pmax INTO (PARTITION p20200601 VALUES "
+                         "LESS THAN (TO_DAYS('2020-06-08')), PARTITION pmax VALUES LESS THAN MAXVALUE)",
+                         self.statements[0])
+
+        del self.statements[:]
+        self.assertEqual(2, partitioner.drop_before(datetime(2020, 6, 9)))
+        self.assertEqual(["ALTER TABLE `snapshot_frame` DROP PARTITION p20200601",
+                          "ALTER TABLE `motion_frame` DROP PARTITION p20200601"], self.statements)
+
+    def test_existing_rows(self):
+        self.first_row = (1,)
+        partitioner.configure(self.database, PERIOD_WEEK)
+        self.assertFalse(partitioner.native)
+        self.assertFalse([statement for statement in self.statements if statement.startswith("ALTER")])
+
+        partitioner.configure(self.database, PERIOD_WEEK, convert_existing=True)
+        self.assertTrue(partitioner.native)
+        self.assertIn("ALTER TABLE `motion_frame` PARTITION BY RANGE (TO_DAYS(`timestamp`)) "
+                      "(PARTITION pmax VALUES LESS THAN MAXVALUE)", self.statements)
+
+
+class PartitionedViewTests(TestAPIBase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.database = pw.SqliteDatabase(":memory:")
+        db_models.proxy.initialize(self.database)
+        self.database.create_tables([db_models.Event, db_models.Frame, db_models.EventFrame])
+        partitioner.configure(self.database, PERIOD_DAY)
+
+    def tearDown(self) -> None:
+        partitioner.configure(None, PERIOD_NONE)
+
+    def get(self, view, url, match_info={}):
+        request = make_mocked_request("GET", url, match_info=match_info)
+        request.app[KEY_MM] = self.mm
+        return self.loop.run_until_complete(view().get(request))
+
+    def test_snapshots_by_time(self):
+        for day in (1, 2, 3):
+            partitioner.route(snapshot(datetime(2020, 6, day, 12, 0))).save()
+
+        self.assertEqual(3, len(self.is_valid_json(self.get(APISnapshotsView, "/snapshots"))["entities"]))
+        json_data = self.is_valid_json(self.get(APISnapshotsView, "/snapshots?start=20200602000000&end=20200602235959"))
+        self.assertEqual(1, len(json_data["entities"]))
+        self.assertEqual(["20200602120000"], [db_models.format_timestamp(frame.timestamp) for frame in
+                                              APISnapshotsView._query(datetime(2020, 6, 2),
+                                                                      datetime(2020, 6, 2, 23, 59, 59))])
+        with self.assertRaises(HTTPBadRequest):
+            self.get(APISnapshotsView, "/snapshots?start=yesterday")
+
+    @mock.patch('motionmonitor.extensions.api.convert_frames')
+    def test_snapshot_frame(self, mock_convert_frames):
+        mock_convert_frames.return_value = b'12345'
+        partitioner.route(snapshot(datetime(2020, 6, 2, 12, 0), frame=3)).save()
+        response = self.get(APISnapshotFrameView, APISnapshotFrameView.url,
+                            {"camera_id": "1", "timestamp": "20200602120000", "frame": "3"})
+        self.assertEqual(3, self.is_valid_json(response)["properties"]["frame"])
+        with self.assertRaises(HTTPBadRequest):
+            self.get(APISnapshotFrameView, APISnapshotFrameView.url,
+                     {"camera_id": "1", "timestamp": "20200603120000", "frame": "3"})
+
+    def test_event_across_partitions(self):
+        db_models.Event(event_id=EVENT_ID, camera_id=1, start_time=datetime(2020, 6, 1, 23, 59)).save()
+        partitioner.route(event_frame(datetime(2020, 6, 1, 23, 59, 30), score=10)).save()
+        partitioner.route(event_frame(datetime(2020, 6, 2, 0, 0, 30), score=50)).save()
+
+        json_data = self.is_valid_json(self.get(APIEventEntityView, APIEventEntityView.url, {"event_id": EVENT_ID}))
+        self.assertEqual(3, len(json_data["entities"]))
+
+        (event, top, frames) = APIEventEntityView._query(EVENT_ID)
+        self.assertEqual(50, top.score)
+        self.assertEqual(["20200601235930", "20200602000030"],
+                         [db_models.format_timestamp(frame.timestamp) for frame in frames])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,18 @@
 import asyncio
 import json
 import logging
+import os
 import socket
+import tempfile
+import time
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 from motionmonitor.extensions import socket_server
 
+SNAPSHOT_MSG = {"type": "picture_save", "filetype": "2", "camera": "1", "timestamp": "20200601120000", "frame": "1",
+                "file": "/tmp/1.jpg"}
+
 
 class TestSocketListener(unittest.TestCase):
     def setUp(self) -> None:
@@ -26,6 +32,7 @@ class TestSocketListener(unittest.TestCase):
 
         mm.config = self.config
         mm.loop = self.loop
+        mm.bus.has_listeners.return_value = False
 
         self.sl = socket_server.SocketListener(mm)
 
@@ -52,11 +59,190 @@ class TestSocketListener(unittest.TestCase):
     def test_simple(self):
         async def code_for_event_loop():
             self.sl.mm.bus.fire.side_effect = self.capture_event
-            self.send_socket_msg({"type": "picture_save"})
+            self.send_socket_msg(SNAPSHOT_MSG)
 
         self.loop.run_until_complete(code_for_event_loop())
 
-        self.assertEqual(self.msg["type"], "picture_save")
+        self.assertEqual(socket_server.EVENT_NEW_FRAME, self.msg_type)
+        self.assertEqual("/tmp/1.jpg", self.msg.filename)
+
+
+class TestSocketListenerWorkers(unittest.TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+
+        mm = Mock()
+        self.config = {"SOCKET_SERVER": {"ADDRESS": "127.0.0.1", "PORT": "9998", "WORKERS": "2"}}
+        mm.config = self.config
+        mm.loop = self.loop
+        mm.bus.has_listeners.return_value = False
+        self.fired = []
+        mm.bus.fire.side_effect = lambda msg_type, msg: self.fired.append((msg_type, msg))
+
+        self.sl = socket_server.SocketListener(mm)
+        self.loop.run_until_complete(self.sl.start_extension())
+
+    def tearDown(self) -> None:
+        self.sl.close()
+        self.loop.close()
+
+    def test_forwarded_by_worker(self):
+        self.assertEqual(2, len(self.sl.workers))
+
+        async def send_until_fired():
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            deadline = time.monotonic() + 10
+            # The workers take a moment to start, anything sent before then is lost.
+            while not self.fired and time.monotonic() < deadline:
+                sock.sendto(json.dumps(SNAPSHOT_MSG).encode(), ("127.0.0.1", 9998))
+                await asyncio.sleep(0.1)
+            sock.close()
+
+        self.loop.run_until_complete(send_until_fired())
+
+        (msg_type, frame) = self.fired[0]
+        self.assertEqual(socket_server.EVENT_NEW_FRAME, msg_type)
+        self.assertEqual(("1", "/tmp/1.jpg"), (frame.camera_id, frame.filename))
+
+    def test_killed_worker_is_replaced(self):
+        killed = self.sl.workers[0]
+        killed.kill()
+
+        async def wait_for_replacement():
+            deadline = time.monotonic() + 10
+            while self.sl.workers[0] is killed and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+
+        with patch.object(socket_server, "WORKER_RESPAWN_DELAY", 0.1):
+            self.loop.run_until_complete(wait_for_replacement())
+
+        self.assertIsNot(killed, self.sl.workers[0])
+        self.assertTrue(self.sl.workers[0].is_alive())
+        self.assertEqual(2, len(self.sl.workers))
+
+        self.sl.close()
+        self.assertFalse(killed.is_alive())
+        self.assertEqual([], self.sl.workers)
+
+    def test_invalid_datagrams_are_dropped(self):
+        async def send_until_fired():
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            deadline = time.monotonic() + 10
+            while not self.fired and time.monotonic() < deadline:
+                sock.sendto(b"not json", ("127.0.0.1", 9998))
+                sock.sendto(json.dumps({"type": "unknown"}).encode(), ("127.0.0.1", 9998))
+                sock.sendto(json.dumps({"type": "picture_save", "filetype": "2"}).encode(), ("127.0.0.1", 9998))
+                sock.sendto(json.dumps({"type": "audit"}).encode(), ("127.0.0.1", 9998))
+                await asyncio.sleep(0.1)
+            sock.close()
+
+        self.loop.run_until_complete(send_until_fired())
+
+        self.assertTrue(self.fired)
+        for (msg_type, msg) in self.fired:
+            self.assertEqual({"type": "audit"}, msg)
+
+
+class TestSocketListenerTransports(unittest.TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "motion-monitor.sock")
+        self.fired = []
+        self.sl = None
+
+    def tearDown(self) -> None:
+        if self.sl:
+            self.sl.close()
+        self.loop.close()
+        self.dir.cleanup()
+
+    def start(self, transport):
+        mm = Mock()
+        mm.config = {"SOCKET_SERVER": {"TRANSPORT": transport, "ADDRESS": "127.0.0.1", "PORT": "9997",
+                                       "PATH": self.path}}
+        mm.loop = self.loop
+        mm.bus.has_listeners.return_value = False
+        mm.bus.fire.side_effect = lambda msg_type, msg: self.fired.append((msg_type, msg))
+        self.sl = socket_server.SocketListener(mm)
+        self.loop.run_until_complete(self.sl.start_extension())
+
+    def wait_for_fired(self, count):
+        async def wait():
+            deadline = time.monotonic() + 5
+            while len(self.fired) < count and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+
+        self.loop.run_until_complete(wait())
+
+    def test_unix_dgram(self):
+        self.start("unix_dgram")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.sendto(json.dumps(SNAPSHOT_MSG).encode(), self.path)
+        sock.close()
+
+        self.wait_for_fired(1)
+        self.assertEqual([socket_server.EVENT_NEW_FRAME], [msg_type for (msg_type, frame) in self.fired])
+
+        self.sl.close()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_tcp(self):
+        self.start("tcp")
+        self.send_stream(socket.AF_INET, ("127.0.0.1", 9997))
+
+    def test_unix_stream(self):
+        self.start("unix_stream")
+        self.send_stream(socket.AF_UNIX, self.path)
+
+    def send_stream(self, family, address):
+        large = dict(SNAPSHOT_MSG, file="/tmp/" + "x" * 100000)
+
+        async def send():
+            reader, writer = await (asyncio.open_connection(*address) if family == socket.AF_INET
+                                    else asyncio.open_unix_connection(address))
+            # Split mid-message, an invalid message doesn't stop the rest, and a message larger than a datagram
+            writer.write(json.dumps(SNAPSHOT_MSG).encode() + b'\n{"type": "audit"')
+            await writer.drain()
+            await asyncio.sleep(0.05)
+            writer.write(b'}\nnot json\n\n')
+            writer.write(json.dumps(large).encode() + b"\n")
+            await writer.drain()
+            writer.close()
+
+        self.loop.run_until_complete(send())
+        self.wait_for_fired(3)
+
+        (snapshot, audit, large_snapshot) = [data for (msg_type, data) in self.fired]
+        self.assertEqual("/tmp/1.jpg", snapshot.filename)
+        self.assertEqual({"type": "audit"}, audit)
+        self.assertEqual(large["file"], large_snapshot.filename)
+
+    def test_stream_handler_error(self):
+        self.start("unix_stream")
+        fire = self.sl.protocol.mm.bus.fire
+        fire.side_effect = [RuntimeError("listener failed"), None]
+
+        async def send():
+            reader, writer = await asyncio.open_unix_connection(self.path)
+            writer.write(json.dumps(SNAPSHOT_MSG).encode() + b'\n{"type": "audit"}\n')
+            await writer.drain()
+            writer.close()
+
+        self.loop.run_until_complete(send())
+
+        async def wait():
+            deadline = time.monotonic() + 5
+            while fire.call_count < 2 and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+
+        self.loop.run_until_complete(wait())
+        # The connection carried on past the message whose listener failed
+        self.assertEqual({"type": "audit"}, fire.call_args[0][1])
+
+    def test_unknown_transport(self):
+        with self.assertRaises(ValueError):
+            self.start("carrier_pigeon")
 
 
 if __name__ == '__main__':
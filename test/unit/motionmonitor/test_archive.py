@@ -0,0 +1,210 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from pathlib import Path
+from unittest.mock import patch
+
+from motionmonitor import archive
+from motionmonitor.archive import FilenameTemplate, ArchiveWalker, load_checkpoints, save_checkpoints
+from motionmonitor.models import Frame, EventFrame
+
+SNAPSHOT_FILENAME = "snapshots/camera%t/%Y/%m/%d/%H/%M/%S-snapshot"
+MOTION_FILENAME = "motion/camera%t/%Y%m%d/%C/%Y%m%d-%H%M%S-%q"
+
+
+class TestFilenameTemplate(unittest.TestCase):
+
+    def test_snapshot(self):
+        template = FilenameTemplate(SNAPSHOT_FILENAME)
+        relpath = "snapshots/camera1/2020/06/01/12/30/15-snapshot.jpg"
+        frame = template.parse("/data/motion/" + relpath, relpath)
+        self.assertIsInstance(frame, Frame)
+        self.assertEqual("1", frame.camera_id)
+        self.assertEqual(datetime(2020, 6, 1, 12, 30, 15), frame.timestamp)
+        self.assertEqual(0, frame.frame_num)
+        self.assertEqual("/data/motion/" + relpath, frame.filename)
+
+    def test_motion(self):
+        template = FilenameTemplate(MOTION_FILENAME)
+        relpath = "motion/camera2/20200601/20200601123000/20200601-123015-03.jpg"
+        frame = template.parse(relpath, relpath)
+        self.assertIsInstance(frame, EventFrame)
+        self.assertEqual("2", frame.camera_id)
+        self.assertEqual("20200601123000", frame.event_id)
+        self.assertEqual(datetime(2020, 6, 1, 12, 30, 15), frame.timestamp)
+        self.assertEqual(3, frame.frame_num)
+
+    def test_prefix(self):
+        self.assertEqual("snapshots", FilenameTemplate(SNAPSHOT_FILENAME).prefix)
+        self.assertEqual("", FilenameTemplate("camera%t/%Y%m%d%H%M%S").prefix)
+
+    def test_not_matching(self):
+        template = FilenameTemplate(SNAPSHOT_FILENAME)
+        self.assertIsNone(template.parse("lastsnap.jpg", "lastsnap.jpg"))
+        self.assertIsNone(template.parse("x", "snapshots/camera1/2020/06/01/12/30/15-other.jpg"))
+        self.assertIsNone(template.parse("x", "snapshots/camera1/2020/13/01/12/30/15-snapshot.jpg"))
+
+    def test_day_depth(self):
+        self.assertEqual(3, FilenameTemplate(SNAPSHOT_FILENAME).day_depth)
+        self.assertEqual(1, FilenameTemplate(MOTION_FILENAME).day_depth)
+        self.assertIsNone(FilenameTemplate("camera%t/%Y/%m/%Y%m%d%H%M%S").day_depth)
+
+    def test_unsupported_specifier(self):
+        with self.assertRaises(ValueError):
+            FilenameTemplate("camera%t/%Y%m%d-%z")
+
+
+class TestArchiveWalker(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.target_dir = tempfile.mkdtemp()
+        self.template = FilenameTemplate(SNAPSHOT_FILENAME)
+        for camera in ("1", "2"):
+            for hour in ("10", "11", "12"):
+                self.create_file("snapshots/camera{}/2020/06/01/{}/00/00-snapshot.jpg".format(camera, hour))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.target_dir)
+
+    def create_file(self, relpath):
+        path = os.path.join(self.target_dir, relpath)
+        Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+        Path(path).touch()
+
+    def walk(self, walker):
+        return [frame for batch in walker.walk() for frame in batch]
+
+    def test_walk_all(self):
+        walker = ArchiveWalker(self.target_dir, self.template, 4, workers=2, batch_size=2)
+        frames = self.walk(walker)
+        self.assertEqual(6, len(frames))
+        self.assertEqual({"1", "2"}, {frame.camera_id for frame in frames})
+
+        # The newest hour directory of each camera is recorded as its checkpoint.
+        self.assertEqual({"camera1": "2020060112", "camera2": "2020060112"}, walker.checkpoints)
+
+    def test_walk_incremental(self):
+        checkpoints = {"camera1": "2020060111"}
+        walker = ArchiveWalker(self.target_dir, self.template, 4, checkpoints, full=False, workers=2)
+        frames = self.walk(walker)
+
+        # Hour 10 of camera1 is older than its checkpoint, camera2 has no checkpoint yet.
+        self.assertEqual(5, len(frames))
+        self.assertEqual("2020060112", checkpoints["camera1"])
+
+    def test_walk_full_ignores_checkpoint(self):
+        checkpoints = {"camera1": "2020060112", "camera2": "2020060112"}
+        walker = ArchiveWalker(self.target_dir, self.template, 4, checkpoints, full=True)
+        self.assertEqual(6, len(self.walk(walker)))
+        self.assertEqual({"camera1": "2020060112", "camera2": "2020060112"}, checkpoints)
+
+    def failing_scandir(self, relpath):
+        scandir = os.scandir
+        failing_path = os.path.join(self.target_dir, relpath)
+
+        def failing_scandir(path):
+            if path == failing_path:
+                raise PermissionError("Permission denied: {}".format(path))
+            return scandir(path)
+
+        return patch.object(archive.os, "scandir", failing_scandir)
+
+    def test_failed_subtree_walked_again(self):
+        self.create_file("snapshots/camera1/2020/06/02/10/00/00-snapshot.jpg")
+        checkpoints = {}
+        with self.failing_scandir("snapshots/camera1/2020/06/01/11"):
+            self.walk(ArchiveWalker(self.target_dir, self.template, 4, checkpoints, full=False, workers=2))
+        # The newer day was walked, but camera1 is held at the day that failed
+        self.assertEqual({"camera1": "20200601", "camera2": "2020060112"}, checkpoints)
+
+        frames = self.walk(ArchiveWalker(self.target_dir, self.template, 4, checkpoints, full=False, workers=2))
+        self.assertEqual(5, len(frames))
+        self.assertEqual({"camera1": "2020060210", "camera2": "2020060112"}, checkpoints)
+
+    def test_failed_subtree_in_full_walk(self):
+        checkpoints = {"camera1": "2020060112"}
+        with self.failing_scandir("snapshots/camera1/2020/06/01/11"):
+            frames = self.walk(ArchiveWalker(self.target_dir, self.template, 4, checkpoints, full=True, workers=2))
+        self.assertEqual({"2"}, {frame.camera_id for frame in frames})
+        # Moved back to the day that failed, for the next incremental walk
+        self.assertEqual({"camera1": "20200601", "camera2": "2020060112"}, checkpoints)
+
+    def test_ignores_other_files(self):
+        self.create_file("snapshots/camera1/2020/06/01/12/00/lastsnap.jpg")
+        walker = ArchiveWalker(self.target_dir, self.template, 4)
+        self.assertEqual(6, len(self.walk(walker)))
+
+    def test_remove_empty_dirs(self):
+        empty_dir = os.path.join(self.target_dir, "snapshots/camera1/2020/06/01/13")
+        Path(empty_dir).mkdir(parents=True)
+        walker = ArchiveWalker(self.target_dir, self.template, 4, remove_empty_dirs=True)
+        self.assertEqual(6, len(self.walk(walker)))
+        self.assertFalse(os.path.exists(empty_dir))
+
+    def test_remove_empty_parents(self):
+        # Left empty once its only hour is removed, as is its month, but not the camera's directory
+        empty_dir = os.path.join(self.target_dir, "snapshots/camera1/2019/12/31/23")
+        Path(empty_dir).mkdir(parents=True)
+        walker = ArchiveWalker(self.target_dir, self.template, 4, remove_empty_dirs=True)
+        self.assertEqual(6, len(self.walk(walker)))
+        self.assertFalse(os.path.exists(os.path.join(self.target_dir, "snapshots/camera1/2019")))
+        self.assertTrue(os.path.exists(os.path.join(self.target_dir, "snapshots/camera1/2020/06/01")))
+
+        os.remove(os.path.join(self.target_dir, "snapshots/camera2/2020/06/01/10/00/00-snapshot.jpg"))
+        self.assertEqual(5, len(self.walk(ArchiveWalker(self.target_dir, self.template, 4, remove_empty_dirs=True))))
+        self.assertFalse(os.path.exists(os.path.join(self.target_dir, "snapshots/camera2/2020/06/01/10")))
+        self.assertTrue(os.path.exists(os.path.join(self.target_dir, "snapshots/camera2")))
+
+    def test_skip_and_on_done(self):
+        self.create_file("snapshots/camera2/2020/06/02/10/00/00-snapshot.jpg")
+        done = []
+        walker = ArchiveWalker(self.target_dir, self.template, 4, workers=2, skip={"snapshots/camera1/2020"},
+                               on_done=done.append)
+        frames = self.walk(walker)
+        self.assertEqual({"2"}, {frame.camera_id for frame in frames})
+        # Each day is a subtree of its own
+        self.assertEqual(["snapshots/camera2/2020/06/01", "snapshots/camera2/2020/06/02"], sorted(done))
+
+        walker = ArchiveWalker(self.target_dir, self.template, 4, skip={"snapshots/camera2/2020/06/01"})
+        self.assertEqual(4, len(self.walk(walker)))
+
+    def test_stop_early(self):
+        walker = ArchiveWalker(self.target_dir, self.template, 4, workers=1, batch_size=1)
+        batches = walker.walk()
+        self.assertEqual(1, len(next(batches)))
+        batches.close()
+        # Neither camera's day was finished, so neither has a checkpoint yet
+        self.assertEqual({}, walker.checkpoints)
+
+
+class TestCheckpoints(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "audit", "checkpoint.json")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_saved_and_loaded(self):
+        checkpoints = {"snapshots": {"camera1": "2020060112"}, "motion": {"camera1": "20200601"}}
+        save_checkpoints(self.path, checkpoints)
+        self.assertEqual(checkpoints, load_checkpoints(self.path))
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+    def test_missing(self):
+        self.assertEqual({}, load_checkpoints(self.path))
+
+    def test_corrupt(self):
+        os.makedirs(os.path.dirname(self.path))
+        for content in ('{"snapshots": {"camera1": "2020', '["2020060112"]', ''):
+            with self.subTest(content=content):
+                with open(self.path, "w") as checkpoint_file:
+                    checkpoint_file.write(content)
+                self.assertEqual({}, load_checkpoints(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import asyncio
+import configparser
+import json
+import unittest
+from unittest.mock import Mock
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer, TestClient
+
+from motionmonitor.cluster import shard_for, shard_config, ClusterRouter, ClusterAPI
+
+
+def create_config():
+    config = configparser.RawConfigParser()
+    config.read_dict({"SOCKET_SERVER": {"ADDRESS": "0.0.0.0", "PORT": "8888", "WORKERS": "4"},
+                      "API": {"ADDRESS": "0.0.0.0", "PORT": "8001"},
+                      "RECORDER": {"URL": "sqlite:////tmp/recorder-{shard}.db"},
+                      "FILE_WATCHER": {"ENABLED": "true"},
+                      "CLUSTER": {"SHARDS": "2", "SHARD_BASE_PORT": "9100"}})
+    return config
+
+
+class TestSharding(unittest.TestCase):
+    def test_shard_for(self):
+        shards = [shard_for(camera_id, 4) for camera_id in range(100)]
+        self.assertEqual(set(range(4)), set(shards))
+        # Stable, and the same whether the camera_id is a string or not
+        self.assertEqual(shards, [shard_for(str(camera_id), 4) for camera_id in range(100)])
+
+    def test_shard_config(self):
+        config = shard_config(create_config(), 1)
+        self.assertEqual("127.0.0.1", config["SOCKET_SERVER"]["ADDRESS"])
+        self.assertEqual("9102", config["SOCKET_SERVER"]["PORT"])
+        self.assertEqual("0", config["SOCKET_SERVER"]["WORKERS"])
+        self.assertEqual("127.0.0.1", config["API"]["ADDRESS"])
+        self.assertEqual("9103", config["API"]["PORT"])
+        self.assertEqual("sqlite:////tmp/recorder-1.db", config["RECORDER"]["URL"])
+        self.assertEqual("false", config["FILE_WATCHER"]["ENABLED"])
+        self.assertEqual("0", config["CLUSTER"]["SHARDS"])
+        self.assertEqual("1", config["CLUSTER"]["SHARD"])
+        self.assertEqual("false", config["WEB_SERVER"]["ENABLED"])
+        self.assertEqual("false", config["FILE_MANAGER"]["ENABLED"])
+
+    def test_first_shard_manages_files(self):
+        config = shard_config(create_config(), 0)
+        self.assertEqual("true", config.get("FILE_MANAGER", "ENABLED", fallback="true"))
+        self.assertEqual("false", config["WEB_SERVER"]["ENABLED"])
+
+
+class TestClusterRouter(unittest.TestCase):
+    def setUp(self) -> None:
+        self.shards = [("127.0.0.1", 9100), ("127.0.0.1", 9102)]
+        self.router = ClusterRouter(self.shards)
+        self.router.connection_made(Mock())
+
+    def test_route_by_camera(self):
+        for camera_id in range(10):
+            data = json.dumps({"type": "picture_save", "camera": str(camera_id)}).encode()
+            self.router.datagram_received(data, ("127.0.0.1", 1234))
+            self.router.transport.sendto.assert_called_with(data, self.shards[shard_for(camera_id, 2)])
+
+    def test_no_camera(self):
+        data = json.dumps({"type": "audit"}).encode()
+        self.router.datagram_received(data, ("127.0.0.1", 1234))
+        self.router.transport.sendto.assert_called_with(data, self.shards[0])
+
+    def test_invalid(self):
+        self.router.datagram_received(b"not json", ("127.0.0.1", 1234))
+        self.router.transport.sendto.assert_not_called()
+
+
+class TestClusterAPI(unittest.TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self) -> None:
+        self.loop.close()
+
+    def create_shard(self, shard):
+        async def get_cameras(request):
+            return web.json_response({"entities": [{"href": "/cameras/{}".format(shard)}], "links": []})
+
+        async def get_camera(request):
+            return web.json_response({"shard": shard, "camera": request.match_info["camera_id"]})
+
+        async def get_root(request):
+            return web.json_response({"shard": shard})
+
+        app = web.Application()
+        app.router.add_get("/cameras", get_cameras)
+        app.router.add_get("/cameras/{camera_id}", get_camera)
+        app.router.add_get("/", get_root)
+        return TestServer(app)
+
+    def test_routing(self):
+        async def run():
+            shards = [self.create_shard(0), self.create_shard(1)]
+            for shard in shards:
+                await shard.start_server()
+            api = ClusterAPI([str(shard.make_url("")).rstrip("/") for shard in shards])
+
+            async with TestClient(TestServer(api.app)) as client:
+                response = await client.get("/cameras")
+                cameras = await response.json()
+                self.assertEqual(["/cameras/0", "/cameras/1"], [entity["href"] for entity in cameras["entities"]])
+
+                for camera_id in range(5):
+                    response = await client.get("/cameras/{}".format(camera_id))
+                    self.assertEqual({"shard": shard_for(camera_id, 2), "camera": str(camera_id)},
+                                     await response.json())
+
+                response = await client.get("/")
+                self.assertEqual({"shard": 0}, await response.json())
+
+            for shard in shards:
+                await shard.close()
+
+        self.loop.run_until_complete(run())
+
+    def test_shard_down(self):
+        async def run():
+            shard = self.create_shard(0)
+            await shard.start_server()
+            # Nothing listens on the second shard's port
+            down = TestServer(web.Application())
+            await down.start_server()
+            down_url = str(down.make_url("")).rstrip("/")
+            await down.close()
+            api = ClusterAPI([str(shard.make_url("")).rstrip("/"), down_url])
+
+            async with TestClient(TestServer(api.app)) as client:
+                response = await client.get("/cameras")
+                self.assertEqual(200, response.status)
+                cameras = await response.json()
+                self.assertEqual(["/cameras/0"], [entity["href"] for entity in cameras["entities"]])
+
+                camera_id = next(camera_id for camera_id in range(10) if shard_for(camera_id, 2) == 1)
+                response = await client.get("/cameras/{}".format(camera_id))
+                self.assertEqual(503, response.status)
+
+            await shard.close()
+            api = ClusterAPI([down_url])
+            async with TestClient(TestServer(api.app)) as client:
+                response = await client.get("/cameras")
+                self.assertEqual(503, response.status)
+
+        self.loop.run_until_complete(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import json
+import unittest
+
+from motionmonitor import codec
+
+
+class TestCodec(unittest.TestCase):
+    def setUp(self) -> None:
+        self.default = codec.NAME
+
+    def tearDown(self) -> None:
+        codec.select(self.default)
+
+    def test_default_is_most_preferred(self):
+        self.assertEqual(codec.available()[0], self.default)
+        self.assertIn("json", codec.available())
+
+    def test_codecs_agree(self):
+        obj = {"href": "/cameras/1", "frame": 3, "score": 1.5, "event": None, "classes": ["camera"], "name": "café"}
+        for name in codec.available():
+            with self.subTest(codec=name):
+                codec.select(name)
+                self.assertEqual(name, codec.NAME)
+                encoded = codec.dumps(obj)
+                self.assertIsInstance(encoded, bytes)
+                self.assertEqual(obj, json.loads(encoded))
+                self.assertEqual(obj, codec.loads(json.dumps(obj).encode()))
+                self.assertEqual(obj, codec.loads(json.dumps(obj)))
+
+    def test_invalid(self):
+        for name in codec.available():
+            codec.select(name)
+            for data in [b"not json", b"\xff", b'{"type": "picture_save"']:
+                with self.subTest(codec=name, data=data), self.assertRaises(ValueError):
+                    codec.loads(data)
+
+    def test_unknown_codec(self):
+        with self.assertRaises(KeyError):
+            codec.select("yaml")
+
+    def test_json_response(self):
+        response = codec.json_response({"entities": []})
+        self.assertEqual("application/json", response.content_type)
+        self.assertEqual("utf-8", response.charset)
+        self.assertEqual({"entities": []}, json.loads(response.body))
+
+
+if __name__ == '__main__':
+    unittest.main()
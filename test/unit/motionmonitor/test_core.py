@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import time
+import unittest
+from unittest.mock import Mock
+
+from motionmonitor.core import EventBus, MotionMonitor
+
+
+class TestEventBus(unittest.TestCase):
+    def setUp(self) -> None:
+        self.bus = EventBus(Mock(), slow_listener_budget=0.01, slow_listener_warning_interval=60, listener_window=3)
+
+    def test_listener_stats(self):
+        self.bus.listen("test:event", self.fast_listener)
+        for _ in range(5):
+            self.bus.fire("test:event")
+
+        (stats,) = self.bus.listener_stats
+        self.assertEqual("test:event", stats.event_type)
+        self.assertTrue(stats.listener.endswith("TestEventBus.fast_listener"))
+        self.assertEqual(5, stats.calls)
+        self.assertEqual(3, len(stats.durations))
+        self.assertEqual(0, stats.slow_calls)
+
+    def test_slow_listener_warnings_are_rate_limited(self):
+        self.bus.listen("test:event", self.slow_listener)
+        with self.assertLogs("motionmonitor.core.EventBus", level="WARNING") as logs:
+            for _ in range(3):
+                self.bus.fire("test:event")
+
+        self.assertEqual(1, len(logs.output))
+        self.assertIn("slow_listener", logs.output[0])
+        (stats,) = self.bus.listener_stats
+        self.assertEqual(3, stats.slow_calls)
+        self.assertEqual(2, stats.suppressed_warnings)
+
+    def test_removed_listener_stats(self):
+        remove = self.bus.listen("test:event", self.fast_listener)
+        self.bus.fire("test:event")
+        remove()
+        self.assertEqual([], self.bus.listener_stats)
+
+    def fast_listener(self, event):
+        pass
+
+    def slow_listener(self, event):
+        time.sleep(0.02)
+
+
+class TestMotionMonitor(unittest.TestCase):
+    def test_close(self):
+        # Without loading the extensions from EXTENSIONS_DIR
+        mm = object.__new__(MotionMonitor)
+        mm._MotionMonitor__logger = logging.getLogger("motionmonitor.core.MotionMonitor")
+        closed = []
+        first = Mock(spec=["start_extension", "close"])
+        first.close.side_effect = lambda: closed.append("first")
+        failing = Mock(spec=["start_extension", "close"])
+        failing.close.side_effect = RuntimeError("Already closed")
+        last = Mock(spec=["start_extension", "close"])
+        last.close.side_effect = lambda: closed.append("last")
+        mm.extensions = [first, Mock(spec=["start_extension"]), failing, last]
+
+        loop = asyncio.new_event_loop()
+        with self.assertLogs("motionmonitor.core.MotionMonitor", level="ERROR"):
+            loop.run_until_complete(mm.close())
+        loop.close()
+        # In the reverse of the order they were started in, carrying on past the one that failed
+        self.assertEqual(["last", "first"], closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
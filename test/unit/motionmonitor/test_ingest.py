@@ -0,0 +1,116 @@
+import unittest
+from datetime import datetime
+from unittest.mock import Mock
+
+from motionmonitor import ingest
+from motionmonitor.const import (
+    EVENT_MANAGEMENT_ACTIVITY,
+    EVENT_MOTION_EVENT_START,
+    EVENT_MOTION_INTERNAL,
+    EVENT_NEW_FRAME,
+    EVENT_NEW_MOTION_FRAME
+)
+from motionmonitor.core import EventBus
+from motionmonitor.extensions.socket_server import SocketHandler
+from motionmonitor.models import Event, EventFrame, Frame
+from motionmonitor.sequence import SequenceTracker
+
+SNAPSHOT_MSG = {"type": "picture_save", "filetype": "2", "camera": "1", "timestamp": "20200601120000", "frame": "3",
+                "file": "/tmp/1.jpg"}
+MOTION_FRAME_MSG = dict(SNAPSHOT_MSG, filetype="1", event="202006011200", score="12")
+
+
+class TestDecodeMsg(unittest.TestCase):
+    def test_snapshot(self):
+        (event_type, frame) = ingest.decode_msg(SNAPSHOT_MSG)
+        self.assertEqual(EVENT_NEW_FRAME, event_type)
+        self.assertIsInstance(frame, Frame)
+        self.assertEqual(("1", datetime(2020, 6, 1, 12, 0, 0), "3", "/tmp/1.jpg"),
+                         (frame.camera_id, frame.timestamp, frame.frame_num, frame.filename))
+
+    def test_motion_frame(self):
+        # Motion's filetype may arrive as a number too
+        (event_type, frame) = ingest.decode_msg(dict(MOTION_FRAME_MSG, filetype=1))
+        self.assertEqual(EVENT_NEW_MOTION_FRAME, event_type)
+        self.assertIsInstance(frame, EventFrame)
+        self.assertEqual(("202006011200", "12"), (frame.event_id, frame.score))
+
+    def test_event(self):
+        msg = {"type": "event_start", "camera": "1", "event": "202006011200", "timestamp": "20200601120000"}
+        (event_type, event) = ingest.decode_msg(msg)
+        self.assertEqual(EVENT_MOTION_EVENT_START, event_type)
+        self.assertIsInstance(event, Event)
+
+    def test_management(self):
+        self.assertEqual((EVENT_MANAGEMENT_ACTIVITY, {"type": "audit"}), ingest.decode_msg({"type": "audit"}))
+
+    def test_nothing_to_fire(self):
+        self.assertEqual((None, None), ingest.decode_msg({"type": "motion_detected", "camera": "1"}))
+        self.assertEqual((None, None), ingest.decode_msg(dict(SNAPSHOT_MSG, filetype="8")))
+        # Only a picture_save needs a filetype
+        self.assertEqual((None, None), ingest.decode_msg({"type": "movie_end", "camera": "1"}))
+        self.assertEqual((None, None), ingest.decode_msg({"type": "movie_start", "camera": "1", "filetype": "8"}))
+
+    def test_invalid(self):
+        for msg in [[], "picture_save", {}, {"type": "unknown"}, {"type": "picture_save"},
+                    dict(SNAPSHOT_MSG, filetype="snapshot"), {"type": "picture_save", "filetype": "2"},
+                    dict(SNAPSHOT_MSG, timestamp="yesterday"), dict(SNAPSHOT_MSG, type=["picture_save"]),
+                    dict(SNAPSHOT_MSG, type={"picture_save": 1}), dict(SNAPSHOT_MSG, filetype=["2"]),
+                    dict(SNAPSHOT_MSG, filetype={"2": 2}), dict(SNAPSHOT_MSG, filetype=True)]:
+            with self.subTest(msg=msg), self.assertRaises(ingest.InvalidMessage):
+                ingest.decode_msg(msg)
+
+    def test_validate(self):
+        for msg in [SNAPSHOT_MSG, dict(MOTION_FRAME_MSG, filetype=1, camera=1),
+                    {"type": "event_end", "camera": "1", "event": "202006011200", "timestamp": "20200601120000"},
+                    {"type": "audit"}]:
+            with self.subTest(msg=msg):
+                self.assertEqual(ingest.decode_msg(msg)[0], ingest.decode_msg(msg, validate=True)[0])
+
+    def test_validate_invalid(self):
+        # Messages that the decoders accept, but that don't match the schema of their type
+        for msg in [dict(SNAPSHOT_MSG, frame="three"), dict(SNAPSHOT_MSG, camera=""), dict(SNAPSHOT_MSG, file=None),
+                    dict(MOTION_FRAME_MSG, score=[]),
+                    {"type": "event_start", "camera": True, "event": "202006011200", "timestamp": "20200601120000"}]:
+            with self.subTest(msg=msg):
+                ingest.decode_msg(msg)
+                with self.assertRaises(ingest.InvalidMessage):
+                    ingest.decode_msg(msg, validate=True)
+
+
+class TestSocketHandlerDispatch(unittest.TestCase):
+    def setUp(self) -> None:
+        self.mm = Mock()
+        self.mm.bus = EventBus(self.mm)
+        self.mm.sequences = SequenceTracker()
+        self.handler = SocketHandler(self.mm)
+
+    def test_one_bus_hop(self):
+        fired = []
+        self.mm.bus.listen(EVENT_NEW_FRAME, lambda event: fired.append(event.data.filename))
+        self.handler.datagram_received(b'{"type": "picture_save", "filetype": "2", "camera": "1", '
+                                       b'"timestamp": "20200601120000", "frame": "3", "file": "/tmp/1.jpg"}', None)
+        self.assertEqual(["/tmp/1.jpg"], fired)
+        self.assertEqual({EVENT_NEW_FRAME: 1}, self.mm.bus.listeners)
+
+    def test_raw_message_listeners(self):
+        raw = []
+        self.mm.bus.listen(EVENT_MOTION_INTERNAL, lambda event: raw.append(event.data))
+        self.handler.dispatch(SNAPSHOT_MSG, *ingest.decode_msg(SNAPSHOT_MSG))
+        self.handler.dispatch({"type": "audit"}, *ingest.decode_msg({"type": "audit"}))
+        self.assertEqual([SNAPSHOT_MSG], raw)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            self.handler.datagram_received(b'{"type": "picture_save"}', None)
+        with self.assertRaises(ValueError):
+            SocketHandler(self.mm, validate=True).datagram_received(
+                b'{"type": "event_start", "camera": "1", "event": "", "timestamp": "20200601120000"}', None)
+        with self.assertRaises(ValueError):
+            self.handler.datagram_received(b'\xff', None)
+        with self.assertRaises(ValueError):
+            self.handler.datagram_received(b'{"type": ["picture_save"], "filetype": "2"}', None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+from unittest.mock import Mock
+
+from motionmonitor import metrics
+from motionmonitor.core import EventBus
+from motionmonitor.metrics import Counter, Gauge, Histogram, Registry
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self) -> None:
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = self.registry.register(Counter("test_requests_total", "Requests", ["path"]))
+        counter.labels("/").inc()
+        counter.labels("/").inc(2)
+        counter.labels("/cameras").inc()
+
+        text = self.registry.render()
+        self.assertIn("# TYPE test_requests_total counter", text)
+        self.assertIn('test_requests_total{path="/"} 3', text)
+        self.assertIn('test_requests_total{path="/cameras"} 1', text)
+
+    def test_labels_are_cached(self):
+        counter = Counter("test_requests_total", "Requests", ["path"])
+        self.assertIs(counter.labels("/"), counter.labels("/"))
+
+    def test_wrong_labels(self):
+        counter = Counter("test_requests_total", "Requests", ["path"])
+        with self.assertRaises(ValueError):
+            counter.labels("/", "GET")
+
+    def test_gauge(self):
+        gauge = self.registry.register(Gauge("test_cameras", "Cameras"))
+        gauge.set(4)
+        self.assertIn("test_cameras 4", self.registry.render())
+
+        gauge.set_function(lambda: 8)
+        self.assertIn("test_cameras 8", self.registry.render())
+
+    def test_histogram(self):
+        histogram = self.registry.register(Histogram("test_seconds", "Durations", buckets=(0.1, 1.0)))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        text = self.registry.render()
+        self.assertIn('test_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{le="1"} 2', text)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 3', text)
+        self.assertIn("test_seconds_sum 5.55", text)
+        self.assertIn("test_seconds_count 3", text)
+
+    def test_escaped_label_values(self):
+        counter = self.registry.register(Counter("test_requests_total", "Requests", ["path"]))
+        counter.labels('a"b').inc()
+        self.assertIn('test_requests_total{path="a\\"b"} 1', self.registry.render())
+
+    def test_duplicate_registration(self):
+        self.registry.register(Counter("test_requests_total", "Requests"))
+        with self.assertRaises(ValueError):
+            self.registry.register(Counter("test_requests_total", "Requests"))
+
+
+class TestEventBusMetrics(unittest.TestCase):
+    def test_fire(self):
+        bus = EventBus(Mock())
+        bus.listen("test:metrics", self.handle)
+
+        fired = metrics.EVENTS_FIRED.labels("test:metrics").value
+        bus.fire("test:metrics")
+        self.assertEqual(fired + 1, metrics.EVENTS_FIRED.labels("test:metrics").value)
+
+        listener = "{}.{}".format(__name__, "TestEventBusMetrics.handle")
+        self.assertEqual(1, sum(metrics.LISTENER_SECONDS.labels("test:metrics", listener).counts))
+
+    def handle(self, event):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
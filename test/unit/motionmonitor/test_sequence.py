@@ -0,0 +1,183 @@
+import asyncio
+import json
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+from motionmonitor import metrics
+from motionmonitor.cameramonitor import CameraMonitor
+from motionmonitor.const import EVENT_NEW_FRAME, EVENT_MOTION_EVENT_START, EVENT_NEW_MOTION_FRAME
+from motionmonitor.core import EventBus
+from motionmonitor.extensions.socket_server import SocketHandler
+from motionmonitor.models import Frame, EventFrame, Event
+from motionmonitor.sequence import SequenceTracker, ReorderBuffer, sequence_key
+
+TIMESTAMP = datetime(2020, 6, 1, 12, 0, 0)
+
+
+def create_frame(frame_num, camera_id="1", timestamp=TIMESTAMP):
+    return Frame(camera_id, timestamp, str(frame_num), "/tmp/{}-{}.jpg".format(camera_id, frame_num))
+
+
+class TestSequenceTracker(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tracker = SequenceTracker()
+
+    def test_in_order(self):
+        for frame_num in range(1, 5):
+            self.assertTrue(self.tracker.observe(create_frame(frame_num)))
+        # A new second starts its numbering again
+        self.assertTrue(self.tracker.observe(create_frame(1, timestamp=TIMESTAMP + timedelta(seconds=1))))
+
+        self.assertEqual({"cameraId": "1", "frames": 5, "gaps": 0, "missedFrames": 0, "duplicates": 0,
+                          "reordered": 0, "missedEventStarts": 0}, self.tracker.cameras["1"].to_json())
+
+    def test_gap(self):
+        gaps = metrics.FRAME_SEQUENCE_ANOMALIES.labels("gap-camera", "gap").value
+        for frame_num in [1, 2, 6]:
+            self.tracker.observe(create_frame(frame_num, camera_id="gap-camera"))
+
+        sequence = self.tracker.cameras["gap-camera"]
+        self.assertEqual(1, sequence.gaps)
+        self.assertEqual(3, sequence.missed)
+        self.assertEqual(gaps + 1, metrics.FRAME_SEQUENCE_ANOMALIES.labels("gap-camera", "gap").value)
+
+    def test_duplicate(self):
+        self.assertTrue(self.tracker.observe(create_frame(1)))
+        self.assertFalse(self.tracker.observe(create_frame(1)))
+        self.assertEqual(1, self.tracker.cameras["1"].duplicates)
+        self.assertEqual(1, self.tracker.cameras["1"].frames)
+
+    def test_reordered(self):
+        for frame_num in [1, 3, 2]:
+            self.assertTrue(self.tracker.observe(create_frame(frame_num)))
+
+        sequence = self.tracker.cameras["1"]
+        self.assertEqual(1, sequence.reordered)
+        # The frame that arrived late is only reordered, it didn't leave a gap
+        self.assertEqual(1, sequence.gaps)
+
+    def test_cameras_are_separate(self):
+        self.tracker.observe(create_frame(2, camera_id="1"))
+        self.tracker.observe(create_frame(1, camera_id="2"))
+        self.assertEqual(0, self.tracker.cameras["2"].reordered)
+
+    def test_deliver(self):
+        # Every frame is delivered until the deliveries are tracked
+        self.assertTrue(self.tracker.deliver(create_frame(1), "socket server"))
+        self.assertTrue(self.tracker.deliver(create_frame(1), "file watcher"))
+
+        self.tracker.track_deliveries()
+        self.assertTrue(self.tracker.deliver(create_frame(1), "file watcher"))
+        self.assertFalse(self.tracker.deliver(Frame("1", TIMESTAMP, 0, "/tmp//1-1.jpg"), "socket server"))
+        self.assertTrue(self.tracker.deliver(create_frame(2), "socket server"))
+
+    def test_kinds_are_separate(self):
+        motion_frame = EventFrame("1", "ev1", TIMESTAMP, "3", "/tmp/motion-3.jpg", 10)
+        self.assertTrue(self.tracker.observe(motion_frame))
+        # A snapshot with the same timestamp and number isn't a duplicate of it, nor out of order
+        self.assertTrue(self.tracker.observe(create_frame(3)))
+        self.assertTrue(self.tracker.observe(create_frame(1)))
+        self.assertEqual({"cameraId": "1", "frames": 3, "gaps": 0, "missedFrames": 0, "duplicates": 0,
+                          "reordered": 1, "missedEventStarts": 0}, self.tracker.cameras["1"].to_json())
+        self.assertFalse(self.tracker.observe(motion_frame))
+
+    def test_unnumbered(self):
+        self.assertTrue(self.tracker.observe(create_frame("")))
+        self.assertEqual({}, self.tracker.cameras)
+
+    def test_missed_event_start(self):
+        self.tracker.missed_event_start("1")
+        self.assertEqual(1, self.tracker.cameras["1"].missed_event_starts)
+
+    def test_event_start_seen(self):
+        mm = Mock()
+        mm.cameras = {}
+        mm.bus = EventBus(mm)
+        mm.sequences = self.tracker
+        CameraMonitor(mm)
+
+        mm.bus.fire(EVENT_MOTION_EVENT_START, Event("ev1", "1", TIMESTAMP))
+        mm.bus.fire(EVENT_NEW_MOTION_FRAME, EventFrame("1", "ev1", TIMESTAMP, "1", "/tmp/motion-1.jpg", 10))
+        self.assertNotIn("1", self.tracker.cameras)
+        self.assertEqual(1, len(mm.cameras["1"].recent_motion["ev1"].frames))
+
+        # Without its start
+        mm.bus.fire(EVENT_NEW_MOTION_FRAME, EventFrame("1", "ev2", TIMESTAMP, "2", "/tmp/motion-2.jpg", 10))
+        self.assertEqual(1, self.tracker.cameras["1"].missed_event_starts)
+
+
+class TestReorderBuffer(unittest.TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.released = []
+        self.buffer = ReorderBuffer(self.loop, 0.05, lambda event_type, frame: self.released.append(frame.frame_num))
+
+    def tearDown(self) -> None:
+        self.loop.close()
+
+    def add(self, frame_num, camera_id="1"):
+        frame = create_frame(frame_num, camera_id=camera_id)
+        self.buffer.add(sequence_key(frame), EVENT_NEW_FRAME, frame)
+
+    def test_restores_order(self):
+        for frame_num in [1, 3, 2, 5, 4]:
+            self.add(frame_num)
+        self.assertEqual([], self.released)
+        self.assertEqual(5, len(self.buffer))
+
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+        self.assertEqual(["1", "2", "3", "4", "5"], self.released)
+        self.assertEqual(0, len(self.buffer))
+
+    def test_late_frame(self):
+        self.add(2)
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+        self.add(1)
+        self.add(3)
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+        self.assertEqual(["2", "1", "3"], self.released)
+
+    def test_close_releases_everything(self):
+        self.add(2)
+        self.add(1)
+        self.buffer.close()
+        self.assertEqual(["1", "2"], self.released)
+
+
+class TestSocketHandlerSequences(unittest.TestCase):
+    def setUp(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.mm = Mock()
+        self.mm.loop = self.loop
+        self.mm.bus = EventBus(self.mm)
+        self.mm.sequences = SequenceTracker()
+        self.frames = []
+        self.mm.bus.listen(EVENT_NEW_FRAME, lambda event: self.frames.append(event.data.frame_num))
+
+    def tearDown(self) -> None:
+        self.loop.close()
+
+    def send_snapshots(self, handler, frame_nums):
+        for frame_num in frame_nums:
+            msg = {"type": "picture_save", "filetype": "2", "camera": "1", "timestamp": "20200601120000",
+                   "frame": str(frame_num), "file": "/tmp/{}.jpg".format(frame_num)}
+            handler.datagram_received(json.dumps(msg).encode(), ("127.0.0.1", 1234))
+
+    def test_duplicates_are_dropped(self):
+        self.send_snapshots(SocketHandler(self.mm), [1, 2, 2, 3])
+        self.assertEqual(["1", "2", "3"], self.frames)
+
+    def test_reorder_window(self):
+        handler = SocketHandler(self.mm, reorder_window=0.05)
+        self.send_snapshots(handler, [1, 3, 2])
+        self.assertEqual([], self.frames)
+
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+        self.assertEqual(["1", "2", "3"], self.frames)
+        self.assertEqual(1, self.mm.sequences.cameras["1"].reordered)
+        handler.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
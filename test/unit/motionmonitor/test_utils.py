@@ -0,0 +1,46 @@
+import unittest
+from datetime import datetime
+
+from motionmonitor.const import KEEP_TIER_7_DAYS, KEEP_TIER_4_WEEKS, KEEP_TIER_3_MONTHS, KEEP_TIER_FOREVER, \
+    TIMELAPSE_MINUTELY, TIMELAPSE_HOURLY, TIMELAPSE_SIX_HOURLY, TIMELAPSE_DAILY
+from motionmonitor.utils import snapshot_keep_tier, snapshot_timelapse_buckets
+
+
+class TestSnapshotKeepTier(unittest.TestCase):
+
+    def test_not_on_the_hour(self):
+        self.assertEqual(KEEP_TIER_7_DAYS, snapshot_keep_tier(datetime(2020, 6, 1, 12, 1, 0)))
+        self.assertEqual(KEEP_TIER_7_DAYS, snapshot_keep_tier(datetime(2020, 6, 1, 6, 59, 59)))
+
+    def test_on_the_hour(self):
+        self.assertEqual(KEEP_TIER_4_WEEKS, snapshot_keep_tier(datetime(2020, 6, 1, 0, 0, 0)))
+        self.assertEqual(KEEP_TIER_4_WEEKS, snapshot_keep_tier(datetime(2020, 6, 1, 13, 0, 30)))
+
+    def test_morning_and_evening(self):
+        self.assertEqual(KEEP_TIER_3_MONTHS, snapshot_keep_tier(datetime(2020, 6, 1, 6, 0, 0)))
+        self.assertEqual(KEEP_TIER_3_MONTHS, snapshot_keep_tier(datetime(2020, 6, 1, 18, 0, 0)))
+
+    def test_midday(self):
+        self.assertEqual(KEEP_TIER_FOREVER, snapshot_keep_tier(datetime(2020, 6, 1, 12, 0, 0)))
+
+
+
+class TestSnapshotTimelapseBuckets(unittest.TestCase):
+
+    def test_minutely_only(self):
+        buckets = snapshot_timelapse_buckets(datetime(2020, 6, 1, 13, 30, 15))
+        self.assertEqual([(TIMELAPSE_MINUTELY, datetime(2020, 6, 1, 13, 30, 0))], buckets)
+
+    def test_hourly(self):
+        buckets = snapshot_timelapse_buckets(datetime(2020, 6, 1, 13, 0, 15))
+        self.assertEqual([TIMELAPSE_MINUTELY, TIMELAPSE_HOURLY], [granularity for (granularity, _) in buckets])
+        self.assertEqual({datetime(2020, 6, 1, 13, 0, 0)}, {bucket for (_, bucket) in buckets})
+
+    def test_midday(self):
+        buckets = snapshot_timelapse_buckets(datetime(2020, 6, 1, 12, 0, 0))
+        self.assertEqual([TIMELAPSE_MINUTELY, TIMELAPSE_HOURLY, TIMELAPSE_SIX_HOURLY, TIMELAPSE_DAILY],
+                         [granularity for (granularity, _) in buckets])
+
+
+if __name__ == '__main__':
+    unittest.main()
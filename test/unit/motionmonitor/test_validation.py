@@ -0,0 +1,72 @@
+import unittest
+
+from motionmonitor import validation
+
+SCHEMA = {
+    "type": "object",
+    "required": ["camera", "timestamp"],
+    "properties": {
+        "camera": {"type": ["string", "integer"], "minLength": 1},
+        "timestamp": {"type": "string", "pattern": "^[0-9]{14}$"},
+        "note": {"type": "string", "maxLength": 4},
+    }
+}
+
+
+class TestCompileSchema(unittest.TestCase):
+    def test_compiled_once(self):
+        self.assertIs(validation.compile_schema(SCHEMA), validation.compile_schema(SCHEMA))
+
+    def test_invalid_schema(self):
+        with self.assertRaises(Exception):
+            validation.compile_schema({"type": 5})
+
+
+class TestCompiledSchema(unittest.TestCase):
+    def setUp(self) -> None:
+        self.schema = validation.compile_schema(SCHEMA)
+
+    def test_predicate(self):
+        self.assertIsNotNone(self.schema.accepts)
+        self.assertIsNone(validation.CompiledSchema({"type": "object", "additionalProperties": False}).accepts)
+        self.assertIsNone(validation.CompiledSchema({"properties": {"a": {"enum": [1]}}}).accepts)
+
+    def test_valid(self):
+        for instance in [{"camera": "1", "timestamp": "20200601120000"},
+                         {"camera": 1, "timestamp": "20200601120000", "note": "abcd", "other": None}]:
+            with self.subTest(instance=instance):
+                self.assertTrue(self.schema.accepts(instance))
+                self.assertIsNone(self.schema.error(instance))
+                self.assertTrue(self.schema.is_valid(instance))
+
+    def test_invalid(self):
+        for (instance, error) in [
+            ([], "[] is not of type 'object'"),
+            ({"camera": "1"}, "missing timestamp"),
+            ({}, "missing camera, timestamp"),
+            ({"camera": "1", "timestamp": "2020"}, "'2020' does not match '^[0-9]{14}$'"),
+            ({"camera": True, "timestamp": "20200601120000"}, "True is not of type 'string', 'integer'"),
+            ({"camera": "", "timestamp": "20200601120000"}, "'' should be non-empty"),
+            ({"camera": "1", "timestamp": "20200601120000", "note": "abcde"}, "'abcde' is too long"),
+        ]:
+            with self.subTest(instance=instance):
+                self.assertFalse(self.schema.accepts(instance))
+                self.assertEqual(error, self.schema.error(instance))
+                self.assertFalse(self.schema.is_valid(instance))
+
+    def test_agrees_with_validator(self):
+        # The predicate may only reject what the validator would, never accept more.
+        for instance in [{"camera": 1.5, "timestamp": "20200601120000"}, {"camera": "1", "timestamp": 20200601120000},
+                         {"camera": "1", "timestamp": "20200601120000", "note": 4}]:
+            with self.subTest(instance=instance):
+                self.assertFalse(self.schema.validator.is_valid(instance))
+                self.assertIsNotNone(self.schema.error(instance))
+
+    def test_without_predicate(self):
+        schema = validation.CompiledSchema({"type": "object", "properties": {"a": {"enum": [1, 2]}}})
+        self.assertIsNone(schema.error({"a": 1}))
+        self.assertIsNotNone(schema.error({"a": 3}))
+
+
+if __name__ == '__main__':
+    unittest.main()